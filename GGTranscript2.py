@@ -1,6 +1,8 @@
 import io
 import os
-import pyaudio
+from capture import MicrophoneCapture
+from vad import VadGate
+from transcript_store import TranscriptStore, default_path
 from google.cloud import speech
 from google.api_core.exceptions import GoogleAPIError
 
@@ -8,15 +10,18 @@ from google.api_core.exceptions import GoogleAPIError
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "C:/Users/loren/Desktop/MI/PythonTranscriptionFSM/Client-Key.json"
 
 def stream_generator(rate, chunk):
-    audio_interface = pyaudio.PyAudio()
-    audio_stream = audio_interface.open(format=pyaudio.paInt16,
-                                        channels=1,
-                                        rate=rate,
-                                        input=True,
-                                        frames_per_buffer=chunk)
+    # Le callback PyAudio écrit dans un tampon circulaire partagé
+    capture = MicrophoneCapture(rate, chunk).start()
+    reader = capture.reader()
 
-    while True:
-        yield audio_stream.read(chunk)
+    try:
+        while True:
+            samples = reader.read(chunk)
+            if samples is None:
+                return
+            yield samples
+    finally:
+        capture.stop()
 
 def transcribe_streaming():
     client = speech.SpeechClient()
@@ -36,21 +41,43 @@ def transcribe_streaming():
         interim_results=True
     )
 
-    # Utilisation du flux audio
-    requests = (speech.StreamingRecognizeRequest(audio_content=chunk)
-                for chunk in stream_generator(rate, chunk))
+    # Seule la parole détectée est envoyée à l'API
+    gate = VadGate(rate)
+    store = TranscriptStore(default_path("google"), "google", language=config.language_code)
 
     try:
-        # Reconnaissance continue
-        responses = client.streaming_recognize(streaming_config, requests)
+        # Une requête par énoncé, ouverte seulement quand la parole commence
+        for utterance in gate.utterances_from(stream_generator(rate, chunk)):
+            # Début de l'énoncé dans la session : le premier bloc transmis se termine à gate.position
+            timing = {}
+
+            def audio_requests(utterance=utterance, timing=timing):
+                for content in utterance:
+                    timing.setdefault("start", (gate.position - len(content) // 2) / rate)
+                    yield speech.StreamingRecognizeRequest(audio_content=content)
+
+            requests = audio_requests()
 
-        for response in responses:
-            for result in response.results:
-                if result.is_final:
-                    print(f"Transcribed Text: {result.alternatives[0].transcript}")
+            # Reconnaissance continue
+            responses = client.streaming_recognize(streaming_config, requests)
+
+            previous_end = 0.0
+            for response in responses:
+                for result in response.results:
+                    if result.is_final:
+                        print(f"Transcribed Text: {result.alternatives[0].transcript}")
+                        end = result.result_end_time.total_seconds()
+                        store.add(timing["start"] + previous_end, timing["start"] + end,
+                                  result.alternatives[0].transcript, result.alternatives[0].confidence)
+                        previous_end = end
 
     except GoogleAPIError as e:
         print(f"Error during transcription: {e}")
 
+    finally:
+        store.close()
+        print(gate.report())
+        print(f"Transcription : {store.path}")
+
 if __name__ == "__main__":
     transcribe_streaming()
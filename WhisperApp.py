@@ -1,29 +1,62 @@
 import argparse
-import os
-import numpy as np
-import speech_recognition as sr
-import whisper
-import torch
-
+import math
+import time
+
+from audio_buffer import PhraseBuffer
+from capture import find_input_device, list_input_devices, open_capture
+from compute_profile import get_profile
+from local_agreement import StreamingDecoder, Word
+from metrics import metrics
+from model_server import RemoteModel, load_model
+from terminal import LiveRenderer
+from transcript_store import TranscriptStore, default_path
+from vad import VAD_BACKENDS, VadGate
+from word_events import EventWriter, WordDiffer, whisper_words
 from datetime import datetime, timedelta
-from queue import Queue
-from time import sleep
 from sys import platform
 
 
 def transcribe_audio():
+    launch_time = time.monotonic()
+    first_transcript_time = None
+
     # Command-line argument parsing
-    parser = argparse.ArgumentParser(description="Real-time speech transcription using Whisper and SpeechRecognition")
-    parser.add_argument("--model", choices=["tiny", "base", "small", "medium", "large"], default="medium",
-                        help="Specify the model size for Whisper")
+    parser = argparse.ArgumentParser(description="Real-time speech transcription using Whisper")
+    parser.add_argument("--model", choices=["auto", "tiny", "base", "small", "medium", "large"], default="medium",
+                        help="Specify the model size for Whisper, or 'auto' for the size benchmarked on this machine")
     parser.add_argument("--use_non_english", action='store_true',
                         help="Utilize a non-English model for transcription")
     parser.add_argument("--energy_threshold", type=int, default=1000,
-                        help="Microphone energy threshold for detecting speech")
+                        help="Microphone energy threshold (int16 RMS) below which audio is never treated as speech")
     parser.add_argument("--record_interval", type=float, default=2.0,
                         help="Interval in seconds for how often the microphone records")
     parser.add_argument("--pause_duration", type=float, default=3.0,
                         help="Duration in seconds of silence that ends a transcription phrase")
+    parser.add_argument("--max_window", type=float, default=30.0,
+                        help="Maximum length in seconds of audio transcribed at once; longer phrases start a new line")
+    parser.add_argument("--streaming", action='store_true',
+                        help="Commit words agreed on by consecutive decodes and only decode the uncommitted tail")
+    parser.add_argument("--vad", choices=VAD_BACKENDS + ("off",), default="energy",
+                        help="Voice activity detector used to keep silence away from Whisper")
+    parser.add_argument("--model_server", type=str, default=None,
+                        help="Unix socket of a running model_server.py to use instead of loading the model here")
+    parser.add_argument("--input_file", type=str, default=None,
+                        help="Audio file replayed instead of the microphone: 16-bit WAV, or FLAC, MP3, ... decoded "
+                             "with PyAV, at any sample rate and channel count (mixed down to 16 kHz mono)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed of --input_file relative to real time (0 replays as fast as it is transcribed)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Deliver each replayed chunk up to this many seconds late, like a loaded machine")
+    parser.add_argument("--transcript", type=str, default=None,
+                        help="Transcript file (.jsonl) to write; an existing one is continued after its last complete line")
+    parser.add_argument("--refresh_rate", type=float, default=10.0,
+                        help="Maximum redraws per second of the line being transcribed (0 for no limit)")
+    parser.add_argument("--word_events", type=str, default=None,
+                        help="Write word-level appended/revised/finalized events as JSON lines to this file or FIFO")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Local port serving per-stage latency histograms (/metrics, Prometheus format)")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Write a Chrome trace JSON of the stages to this file at exit")
     
     # Special handling for Linux microphone setup
     if platform.startswith('linux'):
@@ -31,90 +64,178 @@ def transcribe_audio():
                             help="Default microphone for Linux. Use 'list' to show available microphones")
     
     args = parser.parse_args()
+    if args.word_events == "-":
+        parser.error("--word_events - would mix JSON with the live display on stdout; give a file or FIFO")
+    metrics.start(args.metrics_port, args.trace)
 
     # Initialize key variables
     last_phrase_time = None
-    audio_queue = Queue()
-    recognizer = sr.Recognizer()
-    recognizer.energy_threshold = args.energy_threshold
-    recognizer.dynamic_energy_threshold = False
 
     # Setup microphone based on platform
+    device_index = None
     if platform.startswith('linux'):
-        mic_device = None
         if args.mic_name == 'list':
             print("Available microphone devices:")
-            for idx, mic in enumerate(sr.Microphone.list_microphone_names()):
+            for idx, mic in list_input_devices():
                 print(f"{idx}: {mic}")
             return
-        else:
-            for idx, mic in enumerate(sr.Microphone.list_microphone_names()):
-                if args.mic_name in mic:
-                    mic_device = sr.Microphone(device_index=idx, sample_rate=16000)
-                    break
+        elif not args.input_file:
+            device_index = find_input_device(args.mic_name)
+
+    # torch takes seconds to import: listing the microphones above does without it
+    import torch
+
+    # Pick the model size and thread count that keep up with live audio on this machine
+    cpu_threads = 0
+    if args.model == "auto":
+        # The profile was benchmarked with the exact model loaded here, English-only or not
+        profile = get_profile("whisper", english=not args.use_non_english)
+        model_name, cpu_threads = profile.model, profile.cpu_threads
     else:
-        mic_device = sr.Microphone(sample_rate=16000)
+        model_name = args.model + (".en" if not args.model.startswith("large") and not args.use_non_english else "")
 
-    # Load Whisper model
-    model_name = args.model + (".en" if args.model != "large" and not args.use_non_english else "")
-    audio_model = whisper.load_model(model_name)
+    # Load Whisper model, or use the one kept loaded by the model server
+    if args.model_server:
+        compute_type = "float16" if torch.cuda.is_available() else "float32"
+        audio_model = RemoteModel("whisper", model_name, compute_type, socket_path=args.model_server)
+    else:
+        audio_model = load_model("whisper", model_name, cpu_threads=cpu_threads)
 
     # Parameters for audio processing
     record_interval = args.record_interval
     pause_duration = args.pause_duration
-    transcription_texts = ['']
-
-    # Adjust microphone settings for ambient noise
-    with mic_device:
-        recognizer.adjust_for_ambient_noise(mic_device)
-
-    def audio_callback(_, audio_data: sr.AudioData):
-        """Callback for processing audio data in the background."""
-        raw_audio = audio_data.get_raw_data()
-        audio_queue.put(raw_audio)
-
-    # Start recording in the background
-    recognizer.listen_in_background(mic_device, audio_callback, phrase_time_limit=record_interval)
+    # Finished phrases go to the transcript file; only the current one is kept here
+    current_text = ''
+    current_confidence = None
+    phrase_start = phrase_end = None
+    gate = None
+    if args.vad != "off":
+        # The VAD tracks the ambient noise floor; the energy threshold stays a hard minimum
+        min_energy_db = 20 * math.log10(max(args.energy_threshold, 1) / 32768.0)
+        gate = VadGate(16000, backend=args.vad, min_energy_db=min_energy_db)
+    phrase_buffer = PhraseBuffer(sample_rate=16000, max_seconds=args.max_window)
+    decoder = None
+    if args.streaming:
+        decoder = StreamingDecoder(audio_model, phrase_buffer, fp16=torch.cuda.is_available())
+
+    # Start capturing: the PyAudio callback (or the replayed file) writes into a shared ring buffer
+    device = open_capture(16000, 1024, device_index=device_index, input_file=args.input_file, speed=args.speed,
+                          jitter=args.jitter)
+    reader = device.reader()
+    device.start()
+    record_samples = int(record_interval * 16000)
+    renderer = LiveRenderer(max_rate=args.refresh_rate)
+    store = TranscriptStore(args.transcript or default_path("whisper"), "whisper", model=model_name)
+    # Downstream consumers get only the words that changed, with their times in the session
+    events = EventWriter(args.word_events) if args.word_events else None
+    differ = WordDiffer()
     print("Whisper model loaded and ready for transcription.\n")
 
     while True:
         try:
-            current_time = datetime.utcnow()
-
-            if not audio_queue.empty():
+            # Wait for a record interval of audio, and take everything captured since the last tick
+            waited = time.monotonic()
+            samples = reader.read_available(min_samples=record_samples, max_samples=phrase_buffer.max_samples,
+                                            timeout=2 * record_interval)
+            if samples is None:
+                if device.closed:
+                    break
+                continue
+            captured = time.monotonic()
+            metrics.observe("capture", waited, captured)
+            chunk_end = reader.position / 16000
+            chunk_start = chunk_end - len(samples) / 16000
+
+            # Silence never reaches Whisper
+            if gate:
+                samples = gate.process_samples(samples)
+
+            if len(samples):
+                current_time = datetime.utcnow()
                 phrase_ended = False
 
                 if last_phrase_time and current_time - last_phrase_time > timedelta(seconds=pause_duration):
                     phrase_ended = True
                 
                 last_phrase_time = current_time
+                incoming = len(samples)
 
-                # Combine and process the audio data
-                combined_audio = b''.join(list(audio_queue.queue))
-                audio_queue.queue.clear()
-
-                # Convert audio data to a format Whisper can transcribe
-                audio_array = np.frombuffer(combined_audio, dtype=np.int16).astype(np.float32) / 32768.0
-                transcription_result = audio_model.transcribe(audio_array, fp16=torch.cuda.is_available())
-                transcribed_text = transcription_result['text'].strip()
-
-                if phrase_ended:
-                    transcription_texts.append(transcribed_text)
+                # A full window is closed like a pause so no audio is dropped from the line
+                if phrase_ended or (len(phrase_buffer) and incoming > phrase_buffer.free):
+                    phrase_ended = True
+                    if decoder:
+                        current_text = decoder.finish()
+                    else:
+                        phrase_buffer.clear()
+                phrase_buffer.append(samples)
+                window_start = chunk_start if phrase_ended or phrase_start is None else phrase_start
+
+                started = time.monotonic()
+                if decoder:
+                    # Only the uncommitted tail of the phrase is decoded
+                    decoder.decode()
+                    transcribed_text = decoder.text()
+                    words = [Word(window_start + word.start, window_start + word.end, word.text.strip())
+                             for word in decoder.words()]
+                    confidence = None
                 else:
-                    transcription_texts[-1] = transcribed_text
+                    # Whisper transcribes a zero-copy view of the current phrase
+                    transcription_result = audio_model.transcribe(phrase_buffer.window(), fp16=torch.cuda.is_available(),
+                                                                  word_timestamps=events is not None)
+                    transcribed_text = transcription_result['text'].strip()
+                    words = whisper_words(transcription_result['segments'], window_start)
+                    logprobs = [segment['avg_logprob'] for segment in transcription_result['segments']
+                                if segment.get('avg_logprob') is not None]
+                    confidence = math.exp(sum(logprobs) / len(logprobs)) if logprobs else None
+                rendered = time.monotonic()
+                metrics.observe("inference", started, rendered)
+
+                if transcribed_text and first_transcript_time is None:
+                    first_transcript_time = time.monotonic() - launch_time
 
-                os.system('cls' if os.name == 'nt' else 'clear')
-                for line in transcription_texts:
-                    print(line)
-                print('', end='', flush=True)
+                if phrase_ended:
+                    # The finished phrase scrolls up once; only the current one is redrawn
+                    renderer.final(current_text)
+                    store.add(phrase_start, phrase_end, current_text, current_confidence)
+                    if events:
+                        events.write(differ.finalize())
+                    phrase_start = None
+                if phrase_start is None:
+                    phrase_start = chunk_start
+                phrase_end = chunk_end
+                current_text, current_confidence = transcribed_text, confidence
+                renderer.interim(transcribed_text)
+                if events:
+                    events.write(differ.update(words))
+                metrics.observe("render", rendered)
+                metrics.observe("end_to_end", captured)
             else:
-                sleep(0.25)
+                renderer.refresh()
         except KeyboardInterrupt:
             break
 
+    device.stop()
+    renderer.close()
+    if current_text:
+        store.add(phrase_start, phrase_end, current_text, current_confidence)
+    store.close()
+    if events:
+        events.write(differ.finalize())
+        events.close()
+
     print("\nFinal Transcription:")
-    for line in transcription_texts:
-        print(line)
+    for segment in store.segments():
+        print(segment['text'])
+    print(f"Transcript: {store.path}")
+    print(f"Capture: {device.stats()}")
+    if gate:
+        print(gate.report())
+    if events:
+        print(f"Word events: {differ.report()}")
+    if first_transcript_time is not None:
+        print(f"Time to first transcript: {first_transcript_time:.1f} s")
+    metrics.annotate(capture=device.stats())
+    metrics.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""Real-time-factor controller for chunked live transcription.
+
+After each chunk, the controller gets the length of the audio decoded, the
+capture time it spans (longer when the VAD cut silence out of it), how long it
+waited in the queue and how long inference took. It keeps a smoothed real-time
+factor (RTF, inference time / decoded audio time) and adjusts the decoding
+settings within the configured bounds:
+
+- beam size and best_of go down one step while inference falls behind
+  (RTF above `high_rtf` or chunks waiting in the queue) and back up while it
+  has headroom (RTF below `low_rtf` and no wait);
+- the chunk length moves towards the longest chunk whose expected latency,
+  capture plus inference, still fits 90% of the latency SLO. Longer chunks cut
+  fewer words in half.
+
+Every decision is logged as JSON on the ``adaptive`` logger.
+"""
+import json
+import logging
+import threading
+
+logger = logging.getLogger("adaptive")
+
+
+class RtfController:
+    def __init__(self, latency_slo=3.0, min_chunk=1.0, max_chunk=5.0, chunk_step=0.5,
+                 min_beam=1, max_beam=7, min_best_of=1, max_best_of=5,
+                 low_rtf=0.5, high_rtf=0.9, smoothing=0.3):
+        self.latency_slo = latency_slo
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.chunk_step = chunk_step
+        self.min_beam = min_beam
+        self.max_beam = max_beam
+        self.min_best_of = min_best_of
+        self.max_best_of = max_best_of
+        self.low_rtf = low_rtf
+        self.high_rtf = high_rtf
+        self.smoothing = smoothing
+        self.chunk_length = min_chunk
+        self.beam_size = max_beam
+        self.best_of = max_best_of
+        self.rtf = None
+        self._lock = threading.Lock()
+
+    def settings(self):
+        """Current ``(chunk_length, beam_size, best_of)``."""
+        with self._lock:
+            return self.chunk_length, self.beam_size, self.best_of
+
+    def observe(self, audio_seconds, inference_seconds, queue_seconds, captured_seconds=None):
+        """Record one transcribed chunk and adjust the settings for the next ones.
+
+        `captured_seconds` is the capture time the chunk spans (default: `audio_seconds`): its first
+        word waited that long before the chunk was complete, whatever silence was left out.
+        """
+        if audio_seconds <= 0:
+            return
+        if captured_seconds is None:
+            captured_seconds = audio_seconds
+        with self._lock:
+            rtf = inference_seconds / audio_seconds
+            self.rtf = rtf if self.rtf is None else self.smoothing * rtf + (1 - self.smoothing) * self.rtf
+            latency = captured_seconds + queue_seconds + inference_seconds
+            before = (self.chunk_length, self.beam_size, self.best_of)
+
+            falling_behind = self.rtf > self.high_rtf or queue_seconds > self.chunk_length
+            if falling_behind or latency > self.latency_slo:
+                if self.best_of > self.min_best_of:
+                    self.best_of -= 1
+                elif self.beam_size > self.min_beam:
+                    self.beam_size -= 1
+            elif self.rtf < self.low_rtf and queue_seconds < 0.5 * self.chunk_length:
+                if self.beam_size < self.max_beam:
+                    self.beam_size += 1
+                elif self.best_of < self.max_best_of:
+                    self.best_of += 1
+
+            # Expected latency of a chunk of length L is about L * (1 + RTF); keep 10% headroom
+            target = min(self.max_chunk, max(self.min_chunk, 0.9 * self.latency_slo / (1 + self.rtf)))
+            if target > self.chunk_length:
+                self.chunk_length = min(target, self.chunk_length + self.chunk_step)
+            elif target < self.chunk_length:
+                self.chunk_length = max(target, self.chunk_length - self.chunk_step)
+            self.chunk_length = round(self.chunk_length, 3)
+
+            after = (self.chunk_length, self.beam_size, self.best_of)
+            logger.info(json.dumps({
+                "audio_s": round(audio_seconds, 3),
+                "captured_s": round(captured_seconds, 3),
+                "queue_s": round(queue_seconds, 3),
+                "inference_s": round(inference_seconds, 3),
+                "latency_s": round(latency, 3),
+                "rtf": round(rtf, 3),
+                "rtf_smoothed": round(self.rtf, 3),
+                "changed": before != after,
+                "chunk_length": self.chunk_length,
+                "beam_size": self.beam_size,
+                "best_of": self.best_of,
+            }))
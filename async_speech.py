@@ -0,0 +1,342 @@
+"""Asyncio streaming client for Google Speech-to-Text, many streams at once.
+
+Every stream (one room, one microphone or one recording) runs as a task on a
+single event loop, and all of them share one `SpeechAsyncClient` and so one
+gRPC channel: requests are multiplexed over the same HTTP/2 connection instead
+of one connection and one thread per stream.
+
+Each stream keeps the behaviour of ggTranscriptUser: a request only opens on
+speech, silence is never sent, and a request reaching `STREAMING_LIMIT` is
+half-closed and continued by the next one, which first replays from the
+`BridgeBuffer` the audio after the last final result. The first final
+result of the new request leaves out the words that the previous request
+already returned, from the replay or as the two halves of a word cut by
+the restart.
+
+Capture is polled without blocking the loop and gated continuously into a
+per-stream send queue, also while a request waits for its last results. The
+queue is the stream's backpressure: when its requests fall more than
+`max_backlog_ms` of speech behind, the oldest speech is dropped and counted,
+so one slow stream never delays the others or grows its latency without
+bound. A replay as fast as it is transcribed (``--speed 0``) blocks instead:
+its capture waits for the requests, and no speech is dropped.
+
+Run against the local fake server with ``--server localhost:50051`` (see
+fake_speech_server.py).
+"""
+import argparse
+import asyncio
+import time
+from collections import deque, namedtuple
+
+from bridge import BridgeBuffer
+from capture import open_capture
+from speech_client import make_async_client
+from transcript_store import TranscriptStore, default_path
+from vad import VadGate
+
+STREAMING_LIMIT = 240000  # 4 minutes, as in ggTranscriptUser
+SAMPLE_RATE = 16000
+CHUNK_SIZE = SAMPLE_RATE // 10  # 100 ms
+POLL_INTERVAL = 0.02
+
+UTTERANCE_END = (None, None)
+
+StreamResult = namedtuple("StreamResult", "stream request is_final end_ms transcript confidence words")
+
+
+def streaming_config(language="fr-FR", rate=SAMPLE_RATE, interim_results=True):
+    from google.cloud import speech
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=rate,
+        language_code=language,
+        max_alternatives=1,
+        enable_word_time_offsets=True,
+    )
+    return speech.StreamingRecognitionConfig(config=config, interim_results=interim_results)
+
+
+def _ms(duration):
+    return int(duration.total_seconds() * 1000)
+
+
+def _after_seam(words, last_word):
+    """The words of the first final result after a seam that the request before it did not return.
+
+    `last_word` is the last word of the previous request's last final result.
+    """
+    words = [word for word in words if (word[0] + word[1]) / 2 >= last_word[1]]
+    # A word cut by the half-close is heard in two halves, one on each side of the seam
+    if words and words[0][2] == last_word[2] and words[0][0] <= last_word[1]:
+        words = words[1:]
+    return words
+
+
+class AsyncStream:
+    """One capture reader transcribed by a chain of bridged streaming requests."""
+
+    def __init__(self, name, client, config, reader, rate=SAMPLE_RATE, chunk=CHUNK_SIZE,
+                 streaming_limit_ms=STREAMING_LIMIT, max_backlog_ms=10000, block=False, on_result=None):
+        from google.cloud import speech
+        self._speech = speech
+        self.name = name
+        self.client = client
+        self.config = config
+        self.reader = reader
+        self.rate = rate
+        self.chunk = chunk
+        self.streaming_limit_ms = streaming_limit_ms
+        self.max_backlog = rate * max_backlog_ms // 1000
+        self.block = block
+        self.on_result = on_result
+        self.gate = VadGate(rate)
+        self.bridge = BridgeBuffer(rate)
+        self.closed = False
+        self.stream_cut = False
+        self.is_final_end_time = 0
+        self.last_final_word = None  # (start ms, end ms, word) in session time of the last final result
+        self.request_started = 0.0
+        self.requests = 0
+        self.finals = 0
+        self.dropped_samples = 0
+        self._queue = deque()  # (session position, samples) runs to send, and UTTERANCE_END markers
+        self._queued = 0
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._capture_done = False
+
+    async def _read(self):
+        """Next captured samples, polling so the event loop never blocks; None once capture ended."""
+        while not self.closed:
+            samples = self.reader.read_available(min_samples=self.chunk, max_samples=4 * self.chunk, timeout=0)
+            if samples is not None:
+                return samples
+            if self.reader.closed:
+                return None
+            await asyncio.sleep(POLL_INTERVAL)
+        return None
+
+    async def _capture(self):
+        """Gate the capture into the send queue, whatever the requests are doing."""
+        try:
+            while True:
+                while self.block and self._queued >= self.max_backlog and not self.closed:
+                    # The source waits on its readers: hold the capture back instead of dropping speech
+                    self._room.clear()
+                    await self._room.wait()
+                samples = await self._read()
+                if samples is None:
+                    return
+                runs = self.gate.process_runs(samples)
+                for position, run in runs:
+                    self._queue.append((position, run))
+                    self._queued += len(run)
+                if runs and not self.gate.active:
+                    self._queue.append(UTTERANCE_END)
+                while not self.block and self._queued > self.max_backlog:
+                    # The requests fell behind: drop the oldest speech rather than let latency grow
+                    position, run = self._queue.popleft()
+                    if run is not None:
+                        self._queued -= len(run)
+                        self.dropped_samples += len(run)
+                if self._queue:
+                    self._ready.set()
+        finally:
+            self._capture_done = True
+            self._ready.set()
+
+    async def _peek(self):
+        """First queued item, waiting for one; None once capture ended and the queue is empty."""
+        while not self._queue:
+            if self._capture_done or self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue[0]
+
+    def _pop(self):
+        position, run = self._queue.popleft()
+        if run is not None:
+            self._queued -= len(run)
+            self._room.set()
+        return position, run
+
+    async def _requests(self, replay):
+        request = self._speech.StreamingRecognizeRequest
+        yield request(streaming_config=self.config)
+        if replay:
+            yield request(audio_content=replay)
+
+        expected = None
+        while not self.closed:
+            item = await self._peek()
+            if item is None:
+                return
+            if item is UTTERANCE_END:
+                self._pop()
+                return
+            if expected is not None and item[0] != expected:
+                # Audio was dropped: the rest goes to a new request
+                return
+
+            # Everything queued that continues this utterance goes in one message
+            data = []
+            while self._queue and self._queue[0] is not UTTERANCE_END and (expected is None or
+                                                                           self._queue[0][0] == expected):
+                position, run = self._pop()
+                self.bridge.append(position, run)
+                data.append(run.tobytes())
+                expected = position + len(run)
+            yield request(audio_content=b"".join(data))
+
+            if (time.monotonic() - self.request_started) * 1000 >= self.streaming_limit_ms:
+                # Half-close: the request still returns finals for the audio it already has
+                self.stream_cut = True
+                return
+
+    async def _run_request(self, replay):
+        # A request continuing one cut at the limit starts at a seam inside the utterance
+        seam = self.last_final_word if self.stream_cut else None
+        self.request_started = time.monotonic()
+        self.stream_cut = False
+        self.is_final_end_time = 0
+        responses = await self.client.streaming_recognize(requests=self._requests(replay))
+        async for response in responses:
+            if not response.results or not response.results[0].alternatives:
+                continue
+            result = response.results[0]
+            alternative = result.alternatives[0]
+            end_ms = _ms(result.result_end_time)
+            transcript = alternative.transcript
+            words = [(self.bridge.session_ms(_ms(word.start_time)), self.bridge.session_ms(_ms(word.end_time)),
+                      word.word) for word in alternative.words]
+            if result.is_final:
+                self.is_final_end_time = end_ms
+                self.finals += 1
+                if seam is not None and words:
+                    words = _after_seam(words, seam)
+                    seam = None
+                    if not words:
+                        continue
+                    transcript = " ".join(word for _, _, word in words)
+                if words:
+                    self.last_final_word = words[-1]
+            if self.on_result is not None:
+                self.on_result(StreamResult(self.name, self.requests, result.is_final,
+                                            self.bridge.session_ms(end_ms), transcript, alternative.confidence,
+                                            words))
+
+    async def run(self):
+        capture = asyncio.create_task(self._capture())
+        replay = b""
+        try:
+            while not self.closed:
+                if not replay:
+                    # Requests only open on speech
+                    item = await self._peek()
+                    if item is None:
+                        break
+                    if item is UTTERANCE_END:
+                        self._pop()
+                        continue
+                await self._run_request(replay)
+                # A request cut at the limit is continued from its last final result
+                replay = self.bridge.restart(self.is_final_end_time if self.stream_cut else None)
+                self.requests += 1
+        finally:
+            self.closed = True
+            self._room.set()
+            await capture
+
+    def stats(self):
+        return {
+            "stream": self.name,
+            "requests": self.requests,
+            "finals": self.finals,
+            "dropped_seconds": round(self.dropped_samples / self.rate, 3),
+            "reader_overruns": self.reader.overruns,
+            "silence_skipped_seconds": round(self.gate.saved_seconds, 3),
+        }
+
+
+def print_result(result):
+    if result.is_final:
+        print(f"[{result.stream}] {result.end_ms}: {result.transcript}", flush=True)
+
+
+def store_results(store, show=print_result):
+    """Result callback that also appends every final result to a `TranscriptStore`, tagged with its stream."""
+    previous_end = {}
+
+    def on_result(result):
+        show(result)
+        if result.is_final:
+            start_ms = result.words[0][0] if result.words else previous_end.get(result.stream, result.end_ms)
+            previous_end[result.stream] = result.end_ms
+            store.add(start_ms / 1000, result.end_ms / 1000, result.transcript, result.confidence,
+                      stream=result.stream)
+    return on_result
+
+
+async def run_streams(sources, address=None, language="fr-FR", on_result=print_result, **options):
+    """Transcribe ``(name, reader)`` sources concurrently over one shared client."""
+    client = make_async_client(address)
+    config = streaming_config(language)
+    streams = [AsyncStream(name, client, config, reader, on_result=on_result, **options) for name, reader in sources]
+    await asyncio.gather(*(stream.run() for stream in streams))
+    return streams
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe several audio streams concurrently with Google Speech")
+    parser.add_argument("--input_files", nargs="*", default=[],
+                        help="Recordings, one stream each: 16-bit WAV, or FLAC, MP3, ... decoded with PyAV, "
+                             "at any sample rate and channel count")
+    parser.add_argument("--device_indexes", nargs="*", type=int, default=[], help="Input devices, one stream each")
+    parser.add_argument("--streams", type=int, default=1,
+                        help="Streams per input file (load testing with the same recording)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Playback speed of input files (0 replays as fast as they are transcribed, dropping nothing)")
+    parser.add_argument("--server", default=None, help="host:port of a plain-text Speech server (e.g. the fake one)")
+    parser.add_argument("--language", default="fr-FR", help="Recognition language")
+    parser.add_argument("--streaming_limit", type=int, default=STREAMING_LIMIT,
+                        help="Milliseconds before a request is continued by a new one")
+    parser.add_argument("--transcript", default=None,
+                        help="Transcript file (.jsonl) shared by all streams, each segment tagged with its stream")
+    parser.add_argument("--max_backlog_ms", type=int, default=10000,
+                        help="Speech a stream may queue while its requests fall behind before dropping the oldest")
+    args = parser.parse_args()
+
+    devices = []
+    sources = []
+    for path in args.input_files:
+        for copy in range(args.streams):
+            devices.append(open_capture(SAMPLE_RATE, CHUNK_SIZE, input_file=path, speed=args.speed))
+            sources.append((f"{path}#{copy}" if args.streams > 1 else path, devices[-1].reader()))
+    for index in args.device_indexes:
+        devices.append(open_capture(SAMPLE_RATE, CHUNK_SIZE, device_index=index))
+        sources.append((f"device {index}", devices[-1].reader()))
+    if not sources:
+        parser.error("Give at least one input file or device index")
+
+    store = TranscriptStore(args.transcript or default_path("google"), "google", language=args.language)
+    for device in devices:
+        device.start()
+    try:
+        streams = asyncio.run(run_streams(sources, args.server, args.language, on_result=store_results(store),
+                                          streaming_limit_ms=args.streaming_limit,
+                                          max_backlog_ms=args.max_backlog_ms, block=args.speed == 0))
+    except KeyboardInterrupt:
+        streams = []
+    finally:
+        for device in devices:
+            device.stop()
+        store.close()
+
+    for stream in streams:
+        print(stream.stats())
+
+
+if __name__ == "__main__":
+    main()
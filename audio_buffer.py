@@ -0,0 +1,78 @@
+"""Preallocated float32 audio buffers used by the live transcription loops."""
+import numpy as np
+
+INT16_SCALE = 32768.0
+
+
+class PhraseBuffer:
+    """Fixed-capacity float32 accumulator for the phrase being transcribed.
+
+    Incoming int16 chunks are converted once, on arrival, into a backing
+    array twice the window length. The live window is always contiguous, so
+    `window()` hands the model a view without copying; when writes reach the
+    end of the backing array the live samples are moved back to the front,
+    which costs at most one copy of the window per window's worth of audio.
+    """
+
+    def __init__(self, sample_rate=16000, max_seconds=30.0):
+        self.sample_rate = sample_rate
+        self.max_samples = int(sample_rate * max_seconds)
+        self._data = np.zeros(2 * self.max_samples, dtype=np.float32)
+        self._start = 0
+        self._end = 0
+        self.dropped_samples = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def duration(self):
+        """Length of the current window in seconds."""
+        return len(self) / self.sample_rate
+
+    @property
+    def free(self):
+        """Number of samples that can be appended before old audio is dropped."""
+        return self.max_samples - len(self)
+
+    def append(self, raw_audio):
+        """Convert a chunk of int16 PCM bytes (or an int16 array, possibly strided) and add it to the window.
+
+        If the window would grow past `max_samples`, the oldest samples are
+        dropped and counted in `dropped_samples`.
+        """
+        samples = raw_audio if isinstance(raw_audio, np.ndarray) else np.frombuffer(raw_audio, dtype=np.int16)
+        if len(samples) >= self.max_samples:
+            self.dropped_samples += len(self) + len(samples) - self.max_samples
+            samples = samples[-self.max_samples:]
+            self._start = self._end = 0
+        elif len(samples) > self.free:
+            overflow = len(samples) - self.free
+            self._start += overflow
+            self.dropped_samples += overflow
+
+        n = len(samples)
+        if self._end + n > len(self._data):
+            live = len(self)
+            self._data[:live] = self._data[self._start:self._end]
+            self._start, self._end = 0, live
+
+        out = self._data[self._end:self._end + n]
+        out[:] = samples
+        out *= 1.0 / INT16_SCALE
+        self._end += n
+
+    def window(self):
+        """Return a view of the current window.
+
+        The view is only valid until the next call to `append` or `clear`.
+        """
+        return self._data[self._start:self._end]
+
+    def consume(self, n):
+        """Drop the first `n` samples of the window, e.g. once they are committed."""
+        self._start += min(n, len(self))
+
+    def clear(self):
+        """Start a new, empty window."""
+        self._start = self._end = 0
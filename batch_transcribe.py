@@ -0,0 +1,242 @@
+"""Batched offline transcription of directories of recordings with faster-whisper.
+
+Files are decoded progressively, cut into speech segments by the VAD gate,
+and the segments of several files are packed into batched inference calls,
+consecutive segments of a file sharing a Whisper window, so no decode ever
+mixes two files. Windows go to the model `batch_size` at a time as they fill
+up, so a worker holds a few windows of audio whatever the files' length.
+Groups of files are spread over a process pool holding one model per worker.
+Every finished file is appended to a manifest, so an interrupted run picks up
+where it stopped.
+"""
+import argparse
+import bisect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from capture import decode_audio_chunks
+from vad import VadGate
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".m4a", ".ogg", ".opus", ".webm", ".mp4")
+
+# Whisper decodes at most 30 seconds at once
+MAX_SEGMENT_SECONDS = 30.0
+
+_pipeline = None
+
+
+def _timestamp_scale():
+    """Units of `clip_timestamps`: sample indices before faster-whisper 1.2, seconds from 1.2 on."""
+    from faster_whisper import __version__
+    version = tuple(int(part) for part in __version__.split(".")[:2])
+    return SAMPLE_RATE if version < (1, 2) else 1
+
+
+def pack_windows(clips):
+    """Audio holding each clip at the start of its own 30-second window, and the `clip_timestamps` of the windows.
+
+    Every window is a whole clip timestamp, padded with silence (Whisper pads
+    shorter input to 30 seconds anyway), so no version of the pipeline merges
+    two clips into one decode, and a segment belongs to window
+    ``int(segment.start // MAX_SEGMENT_SECONDS)``. Clips are float32, or
+    int16 scaled to float, and at most 30 seconds long.
+    """
+    window = int(MAX_SEGMENT_SECONDS * SAMPLE_RATE)
+    audio = np.zeros(window * len(clips), dtype=np.float32)
+    for index, clip in enumerate(clips):
+        if len(clip) > window:
+            raise ValueError(f"Clip of {len(clip) / SAMPLE_RATE:.1f} s is longer than one window")
+        target = audio[index * window:index * window + len(clip)]
+        if clip.dtype == np.int16:
+            np.multiply(clip, np.float32(1.0 / 32768.0), out=target)
+        else:
+            target[:] = clip
+    scale = _timestamp_scale()
+    timestamps = [{"start": index * MAX_SEGMENT_SECONDS * scale, "end": (index + 1) * MAX_SEGMENT_SECONDS * scale}
+                  for index in range(len(clips))]
+    return audio, timestamps
+
+
+def window_of(segment, count):
+    """Index of the `pack_windows` window a segment was decoded in, and its start and end within the clip."""
+    index = min(int(segment.start // MAX_SEGMENT_SECONDS), count - 1)
+    offset = index * MAX_SEGMENT_SECONDS
+    return index, segment.start - offset, segment.end - offset
+
+
+def speech_segments(path, max_seconds=MAX_SEGMENT_SECONDS, gate=None):
+    """Yield the ``(start, samples)`` speech segments of a file as it is decoded.
+
+    Once they are all read, ``gate.received`` is the file's length in samples.
+    """
+    gate = gate or VadGate(SAMPLE_RATE)
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    current_start = None
+    current = []
+    current_length = 0
+
+    for chunk in decode_audio_chunks(path, SAMPLE_RATE):
+        for start, run in gate.process_runs(chunk):
+            if current and start != current_start + current_length:
+                yield current_start, np.concatenate(current)
+                current, current_length = [], 0
+            if not current:
+                current_start = start
+            while current_length + len(run) > max_samples:
+                cut = max_samples - current_length
+                current.append(run[:cut])
+                yield current_start, np.concatenate(current)
+                current_start += max_samples
+                current, current_length = [], 0
+                run = run[cut:]
+            if len(run):
+                current.append(run)
+                current_length += len(run)
+
+    if current:
+        yield current_start, np.concatenate(current)
+
+
+def _init_worker(model_name, device, compute_type, cpu_threads):
+    global _pipeline
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+    model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+    _pipeline = BatchedInferencePipeline(model=model)
+
+
+def transcribe_files(paths, batch_size=16, language=None):
+    """Transcribe a group of files with batched calls over all of their speech segments.
+
+    Returns one result per file: its path, duration and timed segments.
+    """
+    window = int(MAX_SEGMENT_SECONDS * SAMPLE_RATE)
+    results = [{"path": path, "audio_seconds": 0.0, "segments": []} for path in paths]
+    windows = []  # (file index, [(position in the file, offset in the window)], [samples]), not transcribed yet
+    for file_index, path in enumerate(paths):
+        gate = VadGate(SAMPLE_RATE)
+        current = None
+        for start, samples in speech_segments(path, gate=gate):
+            length = sum(len(part) for part in current[2]) if current else window
+            if length + len(samples) > window:
+                if len(windows) >= batch_size:
+                    # Every window but the new one is full: one batched call for them
+                    _transcribe_windows(windows, results, batch_size, language)
+                    windows = []
+                current = (file_index, [], [])
+                windows.append(current)
+                length = 0
+            current[1].append((start, length))
+            current[2].append(samples)
+        results[file_index]["audio_seconds"] = round(gate.received / SAMPLE_RATE, 3)
+
+    if windows:
+        _transcribe_windows(windows, results, batch_size, language)
+    return results
+
+
+def _transcribe_windows(windows, results, batch_size, language):
+    """One batched call over `windows`, whose segments are added to the results of their files."""
+    audio, clip_timestamps = pack_windows([np.concatenate(parts) for _, _, parts in windows])
+    segments, _ = _pipeline.transcribe(audio, language=language, vad_filter=False,
+                                       clip_timestamps=clip_timestamps, batch_size=batch_size)
+    for segment in segments:
+        # Map the window back to its file, then to the segment of the file it started in
+        index, start, end = window_of(segment, len(windows))
+        file_index, placed, _ = windows[index]
+        offsets = [offset for _, offset in placed]
+        file_start, offset = placed[max(bisect.bisect_right(offsets, round(start * SAMPLE_RATE)) - 1, 0)]
+        shift = (file_start - offset) / SAMPLE_RATE
+        results[file_index]["segments"].append({
+            "start": round(start + shift, 3),
+            "end": round(end + shift, 3),
+            "text": segment.text.strip(),
+        })
+
+
+def find_audio_files(input_dir):
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def read_manifest(manifest_path):
+    """Paths already transcribed; a line cut short by a crash is ignored."""
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, encoding="utf-8") as manifest:
+        for line in manifest:
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def write_result(result, input_dir, output_dir):
+    """Write the transcript of one file as .txt and .json under the output directory."""
+    relative = os.path.relpath(result["path"], input_dir)
+    base = os.path.join(output_dir, os.path.splitext(relative)[0])
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with open(base + ".json", "w", encoding="utf-8") as json_file:
+        json.dump(result, json_file, ensure_ascii=False, indent=1)
+    with open(base + ".txt", "w", encoding="utf-8") as text_file:
+        text_file.write("\n".join(segment["text"] for segment in result["segments"]) + "\n")
+    return base + ".json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched offline transcription of a directory of recordings")
+    parser.add_argument("input_dir", help="Directory searched recursively for audio files")
+    parser.add_argument("--output_dir", default="transcripts", help="Where transcripts are written")
+    parser.add_argument("--manifest", default=None,
+                        help="Manifest of finished files (default: <output_dir>/manifest.jsonl)")
+    parser.add_argument("--model", default="medium", help="faster-whisper model size or path")
+    parser.add_argument("--device", default="cpu", help="Device used by each worker (cpu or cuda)")
+    parser.add_argument("--compute_type", default="int8", help="CTranslate2 compute type")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes, one model each")
+    parser.add_argument("--cpu_threads", type=int, default=0, help="Threads per worker (0 lets CTranslate2 decide)")
+    parser.add_argument("--batch_size", type=int, default=16, help="Speech segments decoded per batch")
+    parser.add_argument("--files_per_task", type=int, default=8,
+                        help="Files whose segments are packed together in one worker task")
+    parser.add_argument("--language", default=None, help="Language code; detected when omitted")
+    args = parser.parse_args()
+
+    manifest_path = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+    os.makedirs(args.output_dir, exist_ok=True)
+    done = read_manifest(manifest_path)
+    pending = [path for path in find_audio_files(args.input_dir) if path not in done]
+    print(f"{len(pending)} files to transcribe, {len(done)} already done")
+
+    tasks = [pending[i:i + args.files_per_task] for i in range(0, len(pending), args.files_per_task)]
+    audio_seconds = 0.0
+    start = time.monotonic()
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, ProcessPoolExecutor(
+            max_workers=args.workers, initializer=_init_worker,
+            initargs=(args.model, args.device, args.compute_type, args.cpu_threads)) as pool:
+        futures = [pool.submit(transcribe_files, task, args.batch_size, args.language) for task in tasks]
+        for future in as_completed(futures):
+            for result in future.result():
+                output = write_result(result, args.input_dir, args.output_dir)
+                manifest.write(json.dumps({"path": result["path"], "output": output,
+                                           "audio_seconds": result["audio_seconds"]}) + "\n")
+                audio_seconds += result["audio_seconds"]
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+            elapsed = time.monotonic() - start
+            print(f"{audio_seconds / 3600:.2f} h of audio in {elapsed / 3600:.2f} h: "
+                  f"{audio_seconds / max(elapsed, 1e-9):.1f} audio-hours per wall-clock hour")
+
+
+if __name__ == "__main__":
+    main()
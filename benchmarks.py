@@ -0,0 +1,498 @@
+"""Benchmarks of the live transcription paths against local stand-ins.
+
+``engines``: replays one corpus through every engine configuration (see
+engines.py), in real time and as fast as possible, each configuration in its
+own process, and reports real-time factor, first-partial and final latency,
+peak RSS and word error rate. The corpus is a directory of 16 kHz mono WAV
+files with a same-name .txt reference each; without one, coded speech is
+used, which only the fake Google server (``google-fake``) can recognize.
+
+``seams``: transcribes coded speech (see fake_speech_server.py) with
+ggTranscriptUser against the fake Speech server, once with the sequential
+restart and once with the overlapped handover, and reports the words lost or
+duplicated at request seams and the latency of final results.
+
+``resample``: converts an hour of 48 kHz stereo capture to 16 kHz mono in
+100 ms chunks with resample.FormatConverter and with stateless per-chunk
+scipy resampling, and reports the time taken and the signal-to-noise ratio of
+the output against the exact tones of the input (chunk edges are where
+stateless resampling loses it).
+
+``uplink``: the handover session of ``seams`` with the audio sent as
+LINEAR16, FLAC and Ogg Opus (see uplink.py), and the bytes sent, the
+encoder's CPU time and the latency and accuracy of final results for each.
+The fake server decodes with ffmpeg, whose FLAC parser holds about ten frames
+(a second) before it decodes: that part of the FLAC latency is the server's.
+
+``startup``: runs ``transcribe.py <command> --help`` for every command of
+the front door in a fresh interpreter and reports the start-up time, the
+time spent importing and the heaviest imports (``python -X importtime``), so
+a module that starts importing torch or a cloud client at the top shows up.
+
+``metrics``: cost of one latency observation (see metrics.py), disabled,
+enabled and with Chrome tracing, and the share of a handover session against
+the fake server spent recording them.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import time
+import wave
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+
+def _words(text):
+    return re.findall(r"[\w']+", text.lower())
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance between two texts, divided by the length of the reference."""
+    reference, hypothesis = _words(reference), _words(hypothesis)
+    if not reference:
+        return float(len(hypothesis) > 0)
+    previous = list(range(len(hypothesis) + 1))
+    for i, word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, other in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != other))
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / 2 ** 20, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def load_corpus(directory=None, utterances=5):
+    """``(audio, reference)`` of a corpus, its files joined with one second of silence between them."""
+    silence = np.zeros(SAMPLE_RATE, dtype=np.int16)
+    parts, references = [silence], []
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith(".wav"):
+                continue
+            path = os.path.join(directory, name)
+            with wave.open(path, "rb") as wav:
+                if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (SAMPLE_RATE, 1, 2):
+                    raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+                parts += [np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16), silence]
+            with open(os.path.splitext(path)[0] + ".txt", encoding="utf-8") as reference:
+                references.append(reference.read().strip())
+    else:
+        from fake_speech_server import coded_speech, word_ids, word_text
+        for first in range(1, 20 * utterances, 20):
+            words = word_ids(20, first)
+            parts += [coded_speech(words), silence]
+            references.append(" ".join(word_text(i) for i in words))
+    return np.concatenate(parts), " ".join(references)
+
+
+def replay(engine, audio, speed=1.0, chunk=SAMPLE_RATE // 10):
+    """Feed `audio` to an engine at `speed` times real time (0: as fast as it takes it) and time the results."""
+    fed_at = []  # when the end of each chunk was fed: the capture time of its audio
+    partial_latencies, final_latencies = [], []
+    finals = []
+    processing = 0.0
+
+    def record(segments, now):
+        for segment in segments:
+            index = min(max(int(np.ceil(segment.end * SAMPLE_RATE / chunk)) - 1, 0), len(fed_at) - 1)
+            (final_latencies if segment.is_final else partial_latencies).append(now - fed_at[index])
+            if segment.is_final:
+                finals.append((segment.start, segment.text))
+
+    start = time.monotonic()
+    for offset in range(0, len(audio), chunk):
+        if speed:
+            delay = start + (offset + chunk) / SAMPLE_RATE / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        fed = time.monotonic()
+        fed_at.append(fed)
+        segments = engine.feed(audio[offset:offset + chunk])
+        now = time.monotonic()
+        processing += now - fed
+        record(segments, now)
+    fed = time.monotonic()
+    segments = engine.finish()
+    now = time.monotonic()
+    processing += now - fed
+    record(segments, now)
+
+    first = partial_latencies[:1] or final_latencies[:1]
+    audio_seconds = len(audio) / SAMPLE_RATE
+    return {
+        "audio_s": round(audio_seconds, 1),
+        "wall_s": round(now - start, 1),
+        "rtf": round(processing / audio_seconds, 3),
+        "first_partial_latency_s": round(first[0], 3) if first else None,
+        "final_latency_p50_s": round(_percentile(final_latencies, 50), 3),
+        "final_latency_p95_s": round(_percentile(final_latencies, 95), 3),
+        # Utterances sent concurrently may finish out of order
+        "text": " ".join(text.strip() for _, text in sorted(finals)),
+    }
+
+
+def _engine_worker(spec, speed, corpus_dir, utterances, language):
+    """Run one configuration in a fresh process, so load time and peak memory are its own."""
+    from engines import create_engine
+
+    audio, reference = load_corpus(corpus_dir, utterances)
+    loaded = time.monotonic()
+    engine = create_engine(spec, **({"language": language} if language else {}))
+    load_seconds = time.monotonic() - loaded
+    try:
+        result = replay(engine, audio, speed)
+    finally:
+        engine.close()
+    result = dict({"engine": spec, "speed": speed or "max", "load_s": round(load_seconds, 1)}, **result)
+    result["wer"] = round(word_error_rate(reference, result.pop("text")), 3)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def engine_benchmark(specs, speeds=(1.0, 0.0), corpus_dir=None, utterances=5, language=None):
+    """Yield the results of every engine spec at every speed; ``google-fake`` runs against a local fake server."""
+    server = None
+    context = multiprocessing.get_context("spawn")
+    try:
+        for spec in specs:
+            if spec == "google-fake":
+                if server is None:
+                    from fake_speech_server import start_server
+                    server, _, address = start_server()
+                spec = "google:" + address
+            for speed in speeds:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    yield pool.submit(_engine_worker, spec, speed, corpus_dir, utterances, language).result()
+    finally:
+        if server is not None:
+            server.stop(0)
+
+
+def word_errors(expected, received):
+    """``(missing, duplicated)`` word counts of a transcript of distinct words."""
+    counts = Counter(received)
+    missing = sum(1 for word in expected if not counts[word])
+    duplicated = sum(count - 1 for word, count in counts.items() if count > 1)
+    return missing, duplicated
+
+
+def seam_benchmark(handover_overlap, words=100, streaming_limit_ms=6000, open_delay_ms=300, uplink=None):
+    """Transcribe `words` coded words in one utterance and measure the seams."""
+    from google.cloud import speech
+
+    import ggTranscriptUser as gg
+    from capture import FakeDevice
+    from fake_speech_server import FakeSpeechServicer, coded_speech, start_server, word_text
+    from speech_client import make_client
+
+    server, servicer, address = start_server(FakeSpeechServicer(open_delay_ms=open_delay_ms))
+    silence = np.zeros(SAMPLE_RATE, dtype=np.int16)
+    audio = np.concatenate((silence, coded_speech(range(1, words + 1)), silence, silence))
+    chunks = [audio[i:i + gg.CHUNK_SIZE] for i in range(0, len(audio), gg.CHUNK_SIZE)]
+
+    finals = []
+
+    def show(end_ms, transcript, is_final, *_):
+        if is_final:
+            finals.append((time.monotonic(), end_ms, transcript.split()))
+
+    config = speech.StreamingRecognitionConfig(config=speech.RecognitionConfig(
+        encoding=uplink.recognition_encoding() if uplink else speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=SAMPLE_RATE,
+        language_code="fr-FR", enable_word_time_offsets=True), interim_results=True)
+    client = make_client(address)
+
+    started = time.monotonic()
+    stream = gg.ResumableMicrophoneStream(SAMPLE_RATE, gg.CHUNK_SIZE, FakeDevice(chunks, SAMPLE_RATE, gg.CHUNK_SIZE),
+                                          streaming_limit_ms, uplink)
+    with contextlib.redirect_stdout(io.StringIO()), stream:
+        if handover_overlap:
+            gg.transcribe_handover(client, config, stream, handover_overlap, show)
+        else:
+            gg.transcribe_sequential(client, config, stream, show)
+    server.stop(0)
+
+    # Capture runs in real time: session time t was captured at started + t
+    latencies = [emitted - started - end_ms / 1000 for emitted, end_ms, _ in finals]
+    emitted = [0.0] + [emitted - started for emitted, _, _ in finals]
+    # Seam latency: that of the first final result after each request opened mid-utterance
+    seam_latencies = []
+    for opened in servicer.opened[1:]:
+        after = [latency for (emitted_at, _, _), latency in zip(finals, latencies) if emitted_at >= opened]
+        if after:
+            seam_latencies.append(after[0])
+    missing, duplicated = word_errors([word_text(i) for i in range(1, words + 1)],
+                                      [word for _, _, received in finals for word in received])
+    return {
+        "mode": f"handover {handover_overlap} ms" if handover_overlap else "sequential",
+        "requests": servicer.streams,
+        "missing_words": missing,
+        "duplicated_words": duplicated,
+        "final_latency_p50_s": round(_percentile(latencies, 50), 3),
+        "final_latency_p95_s": round(_percentile(latencies, 95), 3),
+        "final_latency_max_s": round(max(latencies, default=float("nan")), 3),
+        "seam_latency_mean_s": round(float(np.mean(seam_latencies)) if seam_latencies else float("nan"), 3),
+        "seam_latency_max_s": round(max(seam_latencies, default=float("nan")), 3),
+        "longest_gap_between_finals_s": round(float(np.max(np.diff(emitted))), 3),
+    }
+
+
+def uplink_benchmark(words=100, streaming_limit_ms=60000, overlap=2000, bitrate=24000):
+    """The same handover session sent with each uplink encoding."""
+    from uplink import ENCODINGS, Uplink
+
+    results = []
+    for encoding in ENCODINGS:
+        uplink = Uplink(encoding, SAMPLE_RATE, bitrate)
+        result = seam_benchmark(overlap, words, streaming_limit_ms, uplink=uplink)
+        stats = uplink.stats()
+        # The session's audio: the words plus three seconds of silence
+        seconds = stats["pcm_bytes"] / 2 / SAMPLE_RATE
+        results.append({
+            "encoding": encoding if encoding != "ogg_opus" else f"ogg_opus {bitrate // 1000} kbit/s",
+            "sent_bytes": stats["sent_bytes"],
+            "sent_kbit_s": round(stats["sent_bytes"] * 8 / seconds / 1000, 1) if seconds else None,
+            "ratio": stats["ratio"],
+            "encoder_cpu_percent": round(100 * stats["encoder_cpu_s"] / seconds, 2) if seconds else None,
+            **{key: result[key] for key in ("requests", "missing_words", "duplicated_words",
+                                            "final_latency_p50_s", "final_latency_p95_s")},
+        })
+    return results
+
+
+def _tones(rate, seconds, delay=0.0):
+    """Two speech-band tones (437 Hz, 2993 Hz) at `rate`, `delay` seconds late."""
+    t = np.arange(int(rate * seconds)) / rate - delay
+    return 8000 * np.sin(2 * np.pi * 437 * t) + 3000 * np.sin(2 * np.pi * 2993 * t)
+
+
+def _snr_db(output, reference):
+    n = min(len(output), len(reference))
+    # Skip the filters' start-up
+    output, reference = output[SAMPLE_RATE // 10:n], reference[SAMPLE_RATE // 10:n]
+    return round(float(10 * np.log10(np.mean(reference ** 2) / np.mean((output - reference) ** 2))), 1)
+
+
+def resample_benchmark(minutes=60, in_rate=48000, channels=2, chunk_ms=100):
+    """Time and accuracy of streaming conversion against stateless per-chunk scipy resampling."""
+    from scipy import signal
+
+    from resample import FormatConverter
+
+    # Ten seconds of capture, looped: whole periods of every tone, so the loop is seamless, but
+    # not of the chunks, as in real capture. A 12 kHz tone above the 8 kHz output band must be filtered out, not aliased
+    block_seconds = 10
+    t = np.arange(in_rate * block_seconds) / in_rate
+    mono = _tones(in_rate, block_seconds) + 3000 * np.sin(2 * np.pi * 12007 * t)
+    block = np.repeat(mono.astype(np.int16), channels)
+    chunk = in_rate * chunk_ms // 1000
+    chunks = [block[i:i + chunk * channels] for i in range(0, len(block), chunk * channels)]
+    loops = int(minutes * 60 // block_seconds)
+    out_chunk = chunk * SAMPLE_RATE // in_rate
+
+    def run(convert):
+        first = []
+        start = time.perf_counter()
+        for loop in range(loops):
+            for samples in chunks:
+                out = convert(samples)
+                if loop == 0:
+                    first.append(np.array(out, dtype=np.float64))
+        return time.perf_counter() - start, np.concatenate(first)
+
+    converter = FormatConverter(in_rate, channels, SAMPLE_RATE, 1, max_frames=chunk)
+    delay = (converter._resamplers[0].taps * converter._resamplers[0].up - 1) / 2 / converter._resamplers[0].up / in_rate
+    methods = {
+        "streaming polyphase": (converter.process, delay),
+        "scipy resample per chunk": (
+            lambda samples: signal.resample(samples.reshape(-1, channels).mean(axis=1), out_chunk), 0.0),
+        "scipy resample_poly per chunk": (
+            lambda samples: signal.resample_poly(samples.reshape(-1, channels).mean(axis=1), SAMPLE_RATE, in_rate), 0.0),
+    }
+    for name, (convert, delay) in methods.items():
+        seconds, output = run(convert)
+        yield {
+            "method": name,
+            "input": f"{loops * block_seconds / 60:.0f} min {in_rate} Hz x{channels}",
+            "seconds": round(seconds, 2),
+            "x_realtime": round(loops * block_seconds / seconds),
+            "snr_db": _snr_db(output, _tones(SAMPLE_RATE, block_seconds, delay)),
+        }
+
+
+def _import_times(stderr):
+    """Microseconds of each top-level import, nested ones included, in ``python -X importtime`` output."""
+    times = {}
+    for line in stderr.splitlines():
+        # Nested imports are indented after the second bar
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", line)
+        if match:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def startup_benchmark(commands=None, runs=5):
+    """Start-up and import time of ``transcribe.py [command] --help`` in a fresh interpreter."""
+    from transcribe import COMMANDS
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcribe.py")
+    results = []
+    for command in [None] + list(commands or COMMANDS):
+        argv = [script] + ([command] if command else []) + ["--help"]
+        walls = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable] + argv, capture_output=True, text=True)
+            walls.append(time.perf_counter() - started)
+        traced = subprocess.run([sys.executable, "-X", "importtime"] + argv, capture_output=True, text=True)
+        imports = _import_times(traced.stderr)
+        result = {
+            "command": command or "(none)",
+            "startup_ms_p50": round(1000 * _percentile(walls, 50), 1),
+            "import_ms": round(sum(imports.values()) / 1000, 1),
+            "heaviest_imports": [f"{name} {us / 1000:.1f} ms"
+                                 for name, us in sorted(imports.items(), key=lambda item: -item[1])[:3]],
+        }
+        if completed.returncode:
+            result["error"] = (completed.stderr.strip().splitlines() or [f"exit code {completed.returncode}"])[-1]
+        results.append(result)
+    return results
+
+
+def _observe_cost(metrics, observations):
+    start = time.perf_counter()
+    for _ in range(observations):
+        metrics.observe("inference", 0.0, 0.001, seq=1)
+    return (time.perf_counter() - start) / observations
+
+
+def metrics_benchmark(observations=100000, words=100):
+    """Microseconds per observation, and the instrumentation overhead of a transcription session."""
+    from metrics import Metrics
+
+    disabled, enabled, traced = Metrics(), Metrics(), Metrics()
+    enabled.enabled = True
+    traced.start(trace_path=os.devnull)
+    costs = {name: _observe_cost(instance, observations)
+             for name, instance in (("disabled", disabled), ("enabled", enabled), ("traced", traced))}
+
+    # A real session with tracing on, in place of the instance ggTranscriptUser records into
+    import ggTranscriptUser as gg
+    session = Metrics()
+    session.start(trace_path=os.devnull)
+    shared, gg.metrics = gg.metrics, session
+    try:
+        started = time.monotonic()
+        seam_benchmark(2000, words)
+        wall = time.monotonic() - started
+    finally:
+        gg.metrics = shared
+    recorded = sum(histogram.count for histogram in session.histograms.values())
+    return {
+        "observe_us_disabled": round(costs["disabled"] * 1e6, 3),
+        "observe_us_enabled": round(costs["enabled"] * 1e6, 3),
+        "observe_us_traced": round(costs["traced"] * 1e6, 3),
+        "session_observations": recorded,
+        "session_stages": {stage: histogram.count for stage, histogram in sorted(session.histograms.items())},
+        "overhead_percent": round(100 * recorded * costs["traced"] / wall, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the live transcription paths")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    engines = subparsers.add_parser("engines", help="Every engine under the same replayed corpus")
+    engines.add_argument("--engines", nargs="+", default=["google-fake"],
+                         help="Engine specs: engine[:model[:compute_type[:device]]], google[:host:port] or google-fake")
+    engines.add_argument("--speeds", nargs="+", type=float, default=[1.0, 0.0],
+                         help="Replay speeds relative to real time (0: as fast as the engine takes the audio)")
+    engines.add_argument("--corpus", default=None,
+                         help="Directory of 16 kHz mono WAV files with same-name .txt references (default: coded speech)")
+    engines.add_argument("--utterances", type=int, default=5, help="Coded utterances when no corpus is given")
+    engines.add_argument("--language", default=None, help="Language of the corpus")
+    engines.add_argument("--output", default=None, help="Also append the results to this JSONL file")
+
+    seams = subparsers.add_parser("seams", help="Words lost or duplicated at Google request seams")
+    seams.add_argument("--words", type=int, default=100, help="Coded words in the utterance (0.4 s each)")
+    seams.add_argument("--streaming_limit", type=int, default=6000, help="Request length in ms before a seam")
+    seams.add_argument("--overlap", type=int, default=2000, help="Handover overlap in ms")
+    seams.add_argument("--open_delay", type=int, default=300, help="Simulated stream setup time of the server in ms")
+
+    resample = subparsers.add_parser("resample", help="Streaming resampler against per-chunk scipy resampling")
+    resample.add_argument("--minutes", type=float, default=60, help="Length of the converted capture")
+    resample.add_argument("--rate", type=int, default=48000, help="Device rate")
+    resample.add_argument("--channels", type=int, default=2, help="Device channels")
+
+    uplink = subparsers.add_parser("uplink", help="Bytes sent, encoder CPU and accuracy per uplink encoding")
+    uplink.add_argument("--words", type=int, default=100, help="Coded words in the utterance (0.4 s each)")
+    uplink.add_argument("--streaming_limit", type=int, default=60000, help="Request length in ms before a seam")
+    uplink.add_argument("--overlap", type=int, default=2000, help="Handover overlap in ms")
+    uplink.add_argument("--bitrate", type=int, default=24000, help="Opus bitrate in bit/s")
+
+    startup = subparsers.add_parser("startup", help="Start-up and import time of every transcribe.py command")
+    startup.add_argument("--commands", nargs="+", default=None, help="Commands to time (default: all)")
+    startup.add_argument("--runs", type=int, default=5, help="Runs per command")
+    startup.add_argument("--output", default=None, help="Also append the results to this JSONL file")
+
+    metrics = subparsers.add_parser("metrics", help="Overhead of the latency instrumentation")
+    metrics.add_argument("--observations", type=int, default=100000, help="Observations timed per configuration")
+    metrics.add_argument("--words", type=int, default=100, help="Coded words in the measured session")
+    args = parser.parse_args()
+
+    if args.benchmark == "engines":
+        for result in engine_benchmark(args.engines, args.speeds, args.corpus, args.utterances, args.language):
+            print(result, flush=True)
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as output:
+                    output.write(json.dumps(result) + "\n")
+    elif args.benchmark == "seams":
+        for overlap in (0, args.overlap):
+            print(seam_benchmark(overlap, args.words, args.streaming_limit, args.open_delay), flush=True)
+    elif args.benchmark == "resample":
+        for result in resample_benchmark(args.minutes, args.rate, args.channels):
+            print(result, flush=True)
+    elif args.benchmark == "uplink":
+        for result in uplink_benchmark(args.words, args.streaming_limit, args.overlap, args.bitrate):
+            print(result, flush=True)
+    elif args.benchmark == "startup":
+        for result in startup_benchmark(args.commands, args.runs):
+            print(result, flush=True)
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as output:
+                    output.write(json.dumps(result) + "\n")
+    elif args.benchmark == "metrics":
+        print(metrics_benchmark(args.observations, args.words), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Pont entre deux requêtes de reconnaissance en continu."""
+import numpy as np
+
+BRIDGING_HORIZON = 10000  # ms d'audio envoyé gardés pour le pont entre deux requêtes
+
+
+class BridgeBuffer:
+    """
+    Tampon circulaire borné de l'audio envoyé à la requête en cours.
+
+    Chaque bloc envoyé est repéré par sa position (en échantillons) dans la
+    session capturée : le temps d'une requête (result_end_time) se convertit
+    exactement en temps de session, y compris pour l'audio rejoué par le pont.
+    La mémoire ne dépend que de l'horizon du pont, pas de la durée de la requête.
+    """
+
+    def __init__(self, rate: int, horizon_ms: int = BRIDGING_HORIZON) -> None:
+        self._rate = rate
+        self.capacity = rate * horizon_ms // 1000
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self.total = 0  # échantillons envoyés depuis le début de la session
+        self.origin = 0  # position du premier échantillon de la requête en cours
+        self._runs = []  # (position dans total, position dans la session) de chaque bloc contigu
+
+    def _session_position(self, index: int) -> int:
+        for start, position in reversed(self._runs):
+            if start <= index:
+                return position + index - start
+        return self._runs[0][1] if self._runs else 0
+
+    def append(self, session_position: int, samples) -> None:
+        """Ajoute un bloc envoyé, dont le premier échantillon est à `session_position`."""
+        if not self._runs or self._session_position(self.total) != session_position:
+            self._runs.append((self.total, session_position))
+
+        kept = samples[-self.capacity:]
+        start = (self.total + len(samples) - len(kept)) % self.capacity
+        first = min(len(kept), self.capacity - start)
+        self._data[start:start + first] = kept[:first]
+        self._data[:len(kept) - first] = kept[first:]
+        self.total += len(samples)
+
+        # Seuls les blocs de la requête en cours servent encore à la conversion
+        while len(self._runs) > 1 and self._runs[1][0] <= self.origin:
+            self._runs.pop(0)
+
+    def session_ms(self, stream_ms: int) -> int:
+        """Convertit un temps de la requête en cours (ms) en temps de session (ms)."""
+        index = min(self.origin + stream_ms * self._rate // 1000, self.total)
+        return self._session_position(index) * 1000 // self._rate
+
+    def restart(self, from_ms=None) -> bytes:
+        """
+        Commence une nouvelle requête. Avec `from_ms`, l'audio envoyé depuis ce
+        temps de la requête précédente (dans la limite de l'horizon) est
+        renvoyé pour être rejoué au début de la nouvelle requête.
+        """
+        if from_ms is None:
+            self.origin = self.total
+            return b""
+
+        start = self.origin + from_ms * self._rate // 1000
+        start = min(max(start, self.total - self.capacity), self.total)
+        begin = start % self.capacity
+        end = begin + self.total - start
+        if end <= self.capacity:
+            replay = self._data[begin:end].tobytes()
+        else:
+            replay = self._data[begin:].tobytes() + self._data[:end - self.capacity].tobytes()
+        self.origin = start
+        return replay
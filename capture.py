@@ -0,0 +1,421 @@
+"""Shared audio capture for every entry point.
+
+PyAudio delivers audio through a callback that copies it once into a
+preallocated int16 ring buffer. Each consumer gets its own `RingReader`, which
+hands out NumPy views (or memoryviews) of the ring without copying, except
+for reads that wrap around its end. A reader that falls more than the ring's
+capacity behind loses the oldest audio and counts it in `overruns`.
+Multi-channel devices write interleaved frames, which `deinterleave` splits
+into one strided view per channel, again without copying.
+
+Microphones are opened at their native rate and channel count, and the
+callback converts each buffer once to the requested format with a
+`resample.FormatConverter` before it reaches the ring, so readers always see
+`rate` Hz and `channels` channels. WAV files replayed by `FakeDevice` are
+converted the same way.
+
+`FakeDevice` feeds the same ring from an audio file or a generator, in real
+time, faster, with jittered delivery, or as fast as the readers consume it,
+so pipelines can be tested and benchmarked without a microphone.
+"""
+import random
+import threading
+import time
+import wave
+
+import numpy as np
+
+from resample import FormatConverter
+
+
+class RingBuffer:
+    """Single-writer, multi-reader int16 ring buffer.
+
+    `written` counts every sample ever written; readers keep their own
+    absolute position in that count. Samples are copied in and out under the
+    ring's lock, so a reader never takes audio the writer is overwriting.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self.written = 0
+        self.closed = False
+        self._readers = []
+        self._cond = threading.Condition()
+
+    def write(self, samples, block=False):
+        """Append int16 samples. With `block`, wait instead of overwriting audio a reader has not released."""
+        n = len(samples)
+        if block and n > self.capacity:
+            # Readers can never make room for more than the whole ring at once
+            for start in range(0, n, self.capacity):
+                self.write(samples[start:start + self.capacity], block=True)
+            return
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self.closed or not self._readers or
+                                    self.written + n - min(r._released for r in self._readers) <= self.capacity)
+            if n > self.capacity:
+                samples = samples[-self.capacity:]
+            start = (self.written + n - len(samples)) % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.written += n
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class RingReader:
+    """One consumer's cursor into a `RingBuffer`.
+
+    Arrays returned by `read` are views of the ring, or of a scratch buffer
+    owned by the reader when a read wraps around. They stay valid until the
+    next read (a blocking writer waits for it; a live one only overwrites
+    them once the reader falls a whole ring behind); copy them to keep them
+    longer. `read_available` returns whole
+    frames of `frame` interleaved samples.
+    """
+
+    def __init__(self, ring, max_read=16000, frame=1):
+        self._ring = ring
+        self.frame = frame
+        self._scratch = np.empty(max_read, dtype=np.int16)
+        self.position = ring.written
+        self._released = self.position  # start of the last array returned, kept from a blocking writer until the next read
+        self.overruns = 0
+        with ring._cond:
+            ring._readers.append(self)
+
+    def available(self):
+        return self._ring.written - self.position
+
+    @property
+    def closed(self):
+        """True once the device is closed and every sample has been read."""
+        return self._ring.closed and self.available() <= 0
+
+    def _lag(self):
+        """Samples behind the writer, after skipping those it overwrote; called under the ring's lock."""
+        ring = self._ring
+        lag = ring.written - self.position
+        if lag > ring.capacity:
+            # The writer lapped this reader: skip to the oldest audio still in the ring
+            self.overruns += lag - ring.capacity
+            self.position = ring.written - ring.capacity
+            lag = ring.capacity
+        return lag
+
+    def _wait(self, n, timeout):
+        ring = self._ring
+        with ring._cond:
+            if self._released != self.position:
+                # A new read: the array returned by the last one may be overwritten
+                self._released = self.position
+                ring._cond.notify_all()
+            ring._cond.wait_for(lambda: ring.written - self.position >= n or ring.closed, timeout)
+            return self._lag()
+
+    def _take(self, n):
+        ring = self._ring
+        with ring._cond:
+            # The writer may have lapped this reader since `_wait`
+            self._lag()
+            start = self.position % ring.capacity
+            if start + n <= ring.capacity:
+                view = ring._data[start:start + n]
+            else:
+                if len(self._scratch) < n:
+                    self._scratch = np.empty(n, dtype=np.int16)
+                first = ring.capacity - start
+                self._scratch[:first] = ring._data[start:]
+                self._scratch[first:n] = ring._data[:n - first]
+                view = self._scratch[:n]
+            self._released = self.position
+            self.position += n
+            ring._cond.notify_all()
+        return view
+
+    def read(self, n, timeout=None):
+        """Return `n` samples, waiting for them; None on timeout.
+
+        Once the device is closed, the last read returns the fewer samples
+        left (whole frames), so the end of a replayed file is not lost; then
+        None.
+        """
+        available = self._wait(n, timeout)
+        if available < n:
+            if not self._ring.closed:
+                return None
+            available -= available % self.frame
+            if available <= 0:
+                return None
+            return self._take(available)
+        return self._take(n)
+
+    def read_available(self, min_samples=1, max_samples=None, timeout=None):
+        """Return everything available (at least `min_samples`, at most `max_samples`), or None."""
+        available = self._wait(min_samples, timeout)
+        if available < min_samples:
+            if not self._ring.closed or available == 0:
+                return None
+        if max_samples is not None:
+            available = min(available, max_samples)
+        if self.frame > 1:
+            available -= available % self.frame
+            if not available:
+                return None
+        return self._take(available)
+
+    def read_memoryview(self, n, timeout=None):
+        """Like `read`, as a byte memoryview for consumers that take raw PCM."""
+        samples = self.read(n, timeout)
+        return None if samples is None else memoryview(samples).cast("B")
+
+    def seek(self, position):
+        """Move to an absolute sample position still held by the ring."""
+        with self._ring._cond:
+            self.position = max(position, self._ring.written - self._ring.capacity)
+            self._released = self.position
+            self._ring._cond.notify_all()
+
+    def close(self):
+        with self._ring._cond:
+            if self in self._ring._readers:
+                self._ring._readers.remove(self)
+            self._ring._cond.notify_all()
+
+
+class _CaptureDevice:
+    def __init__(self, rate, chunk, channels, ring_seconds):
+        self.rate = rate
+        self.chunk = chunk
+        self.channels = channels
+        self.ring = RingBuffer(int(rate * ring_seconds) * channels)
+        self.device_overflows = 0
+        self.device_format = (rate, channels)  # rate and channels delivered by the device
+        self._converter = None
+
+    def _convert_from(self, device_rate, device_channels, max_frames):
+        """Convert what the device delivers when it is not already in the requested format."""
+        self.device_format = (device_rate, device_channels)
+        if self.device_format != (self.rate, self.channels):
+            self._converter = FormatConverter(device_rate, device_channels, self.rate, self.channels, max_frames)
+
+    @property
+    def closed(self):
+        return self.ring.closed
+
+    def reader(self, max_read=None):
+        return RingReader(self.ring, max_read or self.rate * self.channels, self.channels)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def stats(self):
+        return {
+            "captured_seconds": round(self.ring.written / self.channels / self.rate, 3),
+            "device_format": self.device_format,
+            "device_overflows": self.device_overflows,
+            "reader_overruns": [reader.overruns for reader in self.ring._readers],
+        }
+
+
+class MicrophoneCapture(_CaptureDevice):
+    """PyAudio input stream whose callback writes into the shared ring.
+
+    With `native`, the device is opened at its default rate and channel
+    count (mono stays mono when the device has several channels and one is
+    requested: they are averaged). Otherwise it is opened in the requested
+    format, falling back to the native one if PortAudio refuses it.
+    """
+
+    def __init__(self, rate=16000, chunk=1024, channels=1, device_index=None, ring_seconds=30, native=True):
+        super().__init__(rate, chunk, channels, ring_seconds)
+        self.device_index = device_index
+        self.native = native
+        self._interface = None
+        self._stream = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & self._pyaudio.paInputOverflow:
+            self.device_overflows += 1
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        if self._converter is not None:
+            samples = self._converter.process(samples)
+        self.ring.write(samples)
+        return None, self._pyaudio.paContinue
+
+    def _native_format(self):
+        if self.device_index is None:
+            info = self._interface.get_default_input_device_info()
+        else:
+            info = self._interface.get_device_info_by_index(self.device_index)
+        # Virtual devices (pulse, default) report dozens of channels: at most stereo is downmixed
+        channels = min(int(info["maxInputChannels"]), 2)
+        return int(info["defaultSampleRate"]), channels if self.channels == 1 else self.channels
+
+    def _open(self, rate, channels):
+        frames = self.chunk * rate // self.rate
+        self._convert_from(rate, channels, 4 * frames)
+        self._stream = self._interface.open(
+            format=self._pyaudio.paInt16,
+            channels=channels,
+            rate=rate,
+            input=True,
+            input_device_index=self.device_index,
+            frames_per_buffer=frames,
+            stream_callback=self._callback,
+        )
+
+    def start(self):
+        import pyaudio
+        self._pyaudio = pyaudio
+        self._interface = pyaudio.PyAudio()
+        if self.native:
+            self._open(*self._native_format())
+        else:
+            try:
+                self._open(self.rate, self.channels)
+            except OSError:
+                # Invalid sample rate or channel count for this device
+                self._open(*self._native_format())
+        return self
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._interface.terminate()
+            self._stream = None
+        self.ring.close()
+
+
+class FakeDevice(_CaptureDevice):
+    """Capture device fed from an audio file or an iterable of PCM chunks.
+
+    16-bit WAV files are read directly, other formats (FLAC, MP3, ...) are
+    decoded with PyAV. `speed` is the playback rate relative to real time; 0
+    feeds as fast as the slowest reader consumes, without ever overwriting
+    unread audio. With `jitter`, each chunk arrives up to `jitter` seconds
+    after it is due, like the callbacks of a loaded machine, while the
+    schedule itself does not drift.
+    """
+
+    def __init__(self, source, rate=16000, chunk=1024, channels=1, speed=1.0, ring_seconds=30, jitter=0.0,
+                 seed=None):
+        super().__init__(rate, chunk, channels, ring_seconds)
+        self.source = source
+        self.speed = speed
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def _chunks(self):
+        if isinstance(self.source, str) and not self.source.lower().endswith(".wav"):
+            self.device_format = (self.rate, self.channels)
+            yield from decode_audio_chunks(self.source, self.rate, self.channels)
+        elif isinstance(self.source, str):
+            with wave.open(self.source, "rb") as wav:
+                if wav.getsampwidth() != 2:
+                    raise ValueError(f"{self.source} must be 16-bit PCM")
+                self._convert_from(wav.getframerate(), wav.getnchannels(), self.chunk)
+                while True:
+                    data = wav.readframes(self.chunk)
+                    if not data:
+                        return
+                    samples = np.frombuffer(data, dtype=np.int16)
+                    yield samples if self._converter is None else self._converter.process(samples)
+        else:
+            for data in self.source:
+                yield np.frombuffer(data, dtype=np.int16) if isinstance(data, (bytes, bytearray)) else data
+
+    def _run(self):
+        start = time.monotonic()
+        fed = 0
+        try:
+            for samples in self._chunks():
+                if self._stopped.is_set():
+                    break
+                if self.speed:
+                    fed += len(samples) // self.channels
+                    due = start + fed / self.rate / self.speed
+                    if self.jitter:
+                        due += self._random.uniform(0.0, self.jitter)
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.ring.write(samples, block=not self.speed)
+        finally:
+            self.ring.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.ring.close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def decode_audio_chunks(path, rate=16000, channels=1):
+    """Yield interleaved int16 chunks of an audio file at `rate` and `channels` while PyAV decodes it."""
+    import av
+    resampler = av.AudioResampler(format="s16", layout={1: "mono", 2: "stereo"}.get(channels, f"{channels}c"),
+                                  rate=rate)
+    with av.open(path) as container:
+        for frame in container.decode(audio=0):
+            frame.pts = None
+            for resampled in resampler.resample(frame):
+                yield resampled.to_ndarray().reshape(-1)
+        for resampled in resampler.resample(None):
+            yield resampled.to_ndarray().reshape(-1)
+
+
+def list_input_devices():
+    """``(index, name)`` of every input device PortAudio knows about."""
+    import pyaudio
+    interface = pyaudio.PyAudio()
+    try:
+        devices = []
+        for index in range(interface.get_device_count()):
+            info = interface.get_device_info_by_index(index)
+            if info.get("maxInputChannels", 0) > 0:
+                devices.append((index, info["name"]))
+        return devices
+    finally:
+        interface.terminate()
+
+
+def find_input_device(name):
+    """Index of the first input device whose name contains `name`, or None."""
+    for index, device_name in list_input_devices():
+        if name in device_name:
+            return index
+    return None
+
+
+def deinterleave(samples, channels):
+    """Per-channel views of interleaved frames: rows of a ``(channels, frames)`` strided view, no copy."""
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels).T
+
+
+def open_capture(rate=16000, chunk=1024, device_index=None, input_file=None, speed=1.0, channels=1, native=True,
+                 jitter=0.0):
+    """Microphone capture, or a `FakeDevice` replaying `input_file` when one is given."""
+    if input_file:
+        return FakeDevice(input_file, rate, chunk, channels, speed=speed, jitter=jitter)
+    return MicrophoneCapture(rate, chunk, channels, device_index=device_index, native=native)
@@ -0,0 +1,309 @@
+"""Hardware detection and benchmarked compute profiles for the Whisper engines.
+
+A profile is a model, device, compute type and thread count. Candidates are
+the models and compute types the detected device supports and has the memory
+for. They are benchmarked on a session recording given with ``--audio``, or
+on a synthetic voiced signal by default, from the smallest model up: the
+largest model whose fastest compute type keeps the real-time factor
+(inference time / audio time) under the target is kept, and the search stops
+at the first model that does not, so larger ones are never loaded for
+nothing. The winner is cached per host, so a machine only benchmarks once.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from model_server import ENGINES, SAMPLE_RATE, load_model, run_transcribe
+
+Profile = namedtuple("Profile", ["engine", "model", "device", "compute_type", "cpu_threads", "rtf"])
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "transcription", "compute_profiles.json")
+MODEL_SIZES = ("large-v3", "medium", "small", "base", "tiny")
+MODEL_PARAMETERS = {"large-v3": 1550e6, "medium": 769e6, "small": 244e6, "base": 74e6, "tiny": 39e6}
+WEIGHT_BYTES = {"int8": 1, "int8_float32": 1, "int8_float16": 1, "float16": 2, "float32": 4}
+
+# Inference should use at most half of real time, leaving room for capture and VAD
+DEFAULT_TARGET_RTF = 0.5
+
+# Fastest first; the benchmark decides between them
+CPU_COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+CUDA_COMPUTE_TYPES = ("int8_float16", "float16")
+
+
+def _physical_cores(logical):
+    cores = set()
+    physical_id = None
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("physical id"):
+                    physical_id = line.split(":", 1)[1].strip()
+                elif line.startswith("core id"):
+                    cores.add((physical_id, line.split(":", 1)[1].strip()))
+    except OSError:
+        pass
+    return len(cores) or logical
+
+
+def _memory_gb():
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 30, 1)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _gpu_memory_gb():
+    try:
+        import torch
+        return round(torch.cuda.get_device_properties(0).total_memory / 2 ** 30, 1)
+    except (ImportError, RuntimeError, AssertionError):
+        return None
+
+
+def detect_hardware():
+    """Describe the CPU and GPUs of this machine."""
+    flags = set()
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("flags"):
+                    flags.update(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+
+    cuda_devices = 0
+    try:
+        import ctranslate2
+        cuda_devices = ctranslate2.get_cuda_device_count()
+    except ImportError:
+        try:
+            import torch
+            cuda_devices = torch.cuda.device_count()
+        except ImportError:
+            pass
+
+    logical = os.cpu_count() or 1
+    return {
+        "host": socket.gethostname(),
+        "machine": platform.machine(),
+        "logical_cores": logical,
+        "physical_cores": _physical_cores(logical),
+        "cuda_devices": cuda_devices,
+        "memory_gb": _memory_gb(),
+        "gpu_memory_gb": _gpu_memory_gb() if cuda_devices else None,
+        "avx2": "avx2" in flags,
+        "avx512": "avx512f" in flags,
+        "vnni": "avx512_vnni" in flags or "avx_vnni" in flags,
+    }
+
+
+def _supported_compute_types(device):
+    try:
+        import ctranslate2
+        return ctranslate2.get_supported_compute_types(device)
+    except ImportError:
+        return None
+
+
+def model_name(size, english=False):
+    """Name of the model of `size` to load: the English-only variant with `english` (there is none of large)."""
+    return size + ".en" if english and not size.startswith("large") else size
+
+
+def device_settings(engine, device, hardware):
+    """``(compute_type, cpu_threads)`` worth benchmarking for `engine` on `device`, fastest first."""
+    threads = hardware["physical_cores"] if device == "cpu" else 0
+    if engine == "whisper":
+        return [("float16" if device == "cuda" else "float32", threads)]
+    supported = _supported_compute_types(device)
+    compute_types = CUDA_COMPUTE_TYPES if device == "cuda" else CPU_COMPUTE_TYPES
+    return [(compute_type, threads) for compute_type in compute_types
+            if supported is None or compute_type in supported]
+
+
+def _fits(size, compute_type, memory_gb):
+    # Weights plus as much again for activations, the decoder's cache and the runtime
+    return memory_gb is None or 2 * MODEL_PARAMETERS[size] * WEIGHT_BYTES[compute_type] <= memory_gb * 2 ** 30
+
+
+def candidate_profiles(engine, hardware, models=MODEL_SIZES, english=False):
+    """Profiles this hardware can run, grouped by model, smallest model first."""
+    device = "cuda" if hardware["cuda_devices"] else "cpu"
+    memory_gb = hardware.get("gpu_memory_gb" if device == "cuda" else "memory_gb")
+    groups = []
+    for size in sorted(models, key=MODEL_PARAMETERS.get):
+        group = [Profile(engine, model_name(size, english), device, compute_type, cpu_threads, None)
+                 for compute_type, cpu_threads in device_settings(engine, device, hardware)
+                 if _fits(size, compute_type, memory_gb)]
+        if group:
+            groups.append(group)
+    return groups
+
+
+def load_benchmark_audio(path=None, max_seconds=30.0):
+    """Read up to `max_seconds` of 16 kHz mono audio from a .wav or raw .pcm session archive.
+
+    Without a path, a synthetic voiced signal is used. It is not speech, so
+    the timings are only indicative: decoding cost grows with the number of
+    tokens, and a session archive gives more representative ones.
+    """
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    if path is None:
+        t = np.arange(max_samples) / SAMPLE_RATE
+        pitch = 140 + 40 * np.sin(2 * np.pi * 0.5 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+        return (0.1 * envelope * sum(np.sin(k * phase) / k for k in range(1, 8))).astype(np.float32)
+
+    if path.endswith(".pcm"):
+        samples = np.fromfile(path, dtype=np.int16, count=max_samples)
+    else:
+        with wave.open(path, "rb") as wav:
+            if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError(f"{path} must be 16 kHz mono 16-bit PCM")
+            samples = np.frombuffer(wav.readframes(max_samples), dtype=np.int16)
+    return samples.astype(np.float32) / 32768.0
+
+
+def benchmark(profile, audio, chunk_seconds=5.0):
+    """Return the profile with its measured real-time factor on `audio`, in chunks as live capture sends them."""
+    model = load_model(profile.engine, profile.model, profile.compute_type, profile.device,
+                       cpu_threads=profile.cpu_threads)
+    options = {"beam_size": 5}
+    if profile.engine == "whisper":
+        options["fp16"] = profile.compute_type == "float16"
+
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    start = time.monotonic()
+    for offset in range(0, len(audio), chunk):
+        run_transcribe(profile.engine, model, audio[offset:offset + chunk], options)
+    elapsed = time.monotonic() - start
+    del model
+    return profile._replace(rtf=round(elapsed / (len(audio) / SAMPLE_RATE), 3))
+
+
+def select_profile(engine, audio, target_rtf=DEFAULT_TARGET_RTF, hardware=None, models=MODEL_SIZES, english=False,
+                   log=print):
+    """Benchmark candidates and return the most accurate model that keeps up, with its fastest compute type.
+
+    When no model keeps up, the fastest profile measured is returned.
+    """
+    hardware = hardware or detect_hardware()
+    fastest = None
+    selected = None
+    for group in candidate_profiles(engine, hardware, models, english):
+        results = []
+        for profile in group:
+            try:
+                result = benchmark(profile, audio)
+            except (RuntimeError, ValueError) as e:
+                log(f"{profile.model} {profile.compute_type}: unavailable ({e})")
+                continue
+            log(f"{result.model} {result.device} {result.compute_type} threads={result.cpu_threads}: "
+                f"RTF {result.rtf}")
+            results.append(result)
+        if not results:
+            continue
+        best = min(results, key=lambda result: result.rtf)
+        if best.rtf > target_rtf:
+            # Larger models are slower still
+            if fastest is None or best.rtf < fastest.rtf:
+                fastest = best
+            break
+        selected = best
+    if selected is None and fastest is None:
+        raise RuntimeError(f"No {engine} profile could be loaded on this machine")
+    return selected or fastest
+
+
+def _cache_key(engine, hardware, english=False):
+    return f"{engine}{'.en' if english else ''}@{hardware['host']}"
+
+
+def get_profile(engine, target_rtf=DEFAULT_TARGET_RTF, audio_path=None, refresh=False, english=False,
+                cache_path=CACHE_PATH, log=print):
+    """Return this host's cached profile for `engine`, benchmarking it first if needed.
+
+    With `english`, the English-only models are benchmarked, and the profile
+    names the one to load.
+    """
+    hardware = detect_hardware()
+    key = _cache_key(engine, hardware, english)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as cache_file:
+            cache = json.load(cache_file)
+
+    entry = cache.get(key)
+    if not refresh and entry and entry["hardware"] == hardware and entry["target_rtf"] == target_rtf:
+        return Profile(**entry["profile"])
+
+    log(f"Benchmarking {engine} profiles for {hardware['host']} (target RTF {target_rtf})")
+    profile = select_profile(engine, load_benchmark_audio(audio_path), target_rtf, hardware, english=english, log=log)
+    cache[key] = {"hardware": hardware, "target_rtf": target_rtf, "profile": profile._asdict()}
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as cache_file:
+        json.dump(cache, cache_file, indent=1)
+    return profile
+
+
+def settings_for(engine, model=None, device=None, compute_type=None, cpu_threads=None,
+                 target_rtf=DEFAULT_TARGET_RTF, log=print):
+    """Model, device, compute type and thread count to load, from the given ones and this host's profile.
+
+    The profile only fills in what is not given. When the device given is not
+    the profile's, the compute type and threads come from that device's own
+    candidates instead, and a compute type the device does not support is
+    rejected with a ValueError.
+    """
+    settings = {"model": model, "device": device, "compute_type": compute_type, "cpu_threads": cpu_threads}
+    if None in (model, device, compute_type):
+        profile = get_profile(engine, target_rtf, log=log)
+        settings["model"] = model or profile.model
+        settings["device"] = device or profile.device
+        if settings["device"] == profile.device:
+            settings["compute_type"] = compute_type or profile.compute_type
+            if cpu_threads is None:
+                settings["cpu_threads"] = profile.cpu_threads
+    hardware = detect_hardware()
+    if settings["device"] == "auto":
+        settings["device"] = "cuda" if hardware["cuda_devices"] else "cpu"
+    if settings["device"] == "cuda" and not hardware["cuda_devices"]:
+        raise ValueError("No CUDA device on this machine")
+    candidates = device_settings(engine, settings["device"], hardware)
+    if settings["compute_type"] is None:
+        settings["compute_type"] = candidates[0][0]
+    elif engine == "faster-whisper":
+        supported = _supported_compute_types(settings["device"])
+        if supported is not None and settings["compute_type"] not in supported:
+            raise ValueError(f"{settings['compute_type']} is not supported on {settings['device']}; "
+                             f"expected one of {', '.join(sorted(supported))}")
+    if settings["cpu_threads"] is None:
+        settings["cpu_threads"] = candidates[0][1]
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick and cache the fastest compute profile that keeps up with live audio")
+    parser.add_argument("--engine", choices=ENGINES, default="faster-whisper")
+    parser.add_argument("--target_rtf", type=float, default=DEFAULT_TARGET_RTF,
+                        help="Highest acceptable inference time per second of audio")
+    parser.add_argument("--audio", default=None, help="16 kHz mono .wav or .pcm session archive to benchmark on")
+    parser.add_argument("--refresh", action="store_true", help="Benchmark again even if a profile is cached")
+    args = parser.parse_args()
+
+    print(json.dumps(detect_hardware(), indent=1))
+    profile = get_profile(args.engine, args.target_rtf, args.audio, args.refresh)
+    print(json.dumps(profile._asdict(), indent=1))
+
+
+if __name__ == "__main__":
+    main()
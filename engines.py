@@ -0,0 +1,182 @@
+"""One interface over every transcription backend.
+
+An `Engine` is fed 16 kHz mono int16 frames as they are captured and returns
+the segments each call produced: partial ones, which later calls may revise,
+and final ones. Times are seconds of the audio fed so far, so the same
+capture, replay and benchmark code drives any backend:
+
+- ``whisper`` and ``faster-whisper`` (`LocalWhisperEngine`): speech is gated
+  by the VAD into a phrase window, re-transcribed every `step` seconds of new
+  speech (partial) and once more when the utterance ends (final);
+- ``google`` (`GoogleEngine`): one streaming request per utterance, through
+  `speech.SpeechClient`, optionally against a local server such as
+  fake_speech_server.py.
+
+Engines are created from specs as used by model_server.py --preload:
+``engine[:model[:compute_type[:device]]]``, or ``google[:host:port]``.
+"""
+import math
+import queue
+import threading
+from collections import namedtuple
+
+from audio_buffer import PhraseBuffer
+from speech_client import make_client
+from vad import VadGate
+
+SAMPLE_RATE = 16000
+ENGINE_NAMES = ("whisper", "faster-whisper", "google")
+
+Segment = namedtuple("Segment", "start end text is_final confidence")
+
+
+class Engine:
+    """Frames in, segments out. Subclasses implement `feed` and `finish`."""
+
+    name = None
+
+    def feed(self, samples):
+        """Process int16 frames; return the segments produced meanwhile."""
+        raise NotImplementedError
+
+    def finish(self):
+        """End of audio: return the last segments, all final."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalWhisperEngine(Engine):
+    def __init__(self, engine="faster-whisper", model_name="base", compute_type="default", device="auto",
+                 step=1.0, max_window=30.0, language=None, model=None, vad_backend="energy"):
+        from model_server import load_model
+        self.name = engine
+        self.model = model if model is not None else load_model(engine, model_name, compute_type, device)
+        self.options = {"language": language} if language else {}
+        if engine == "whisper":
+            self.options["fp16"] = compute_type == "float16"
+        self.step = int(step * SAMPLE_RATE)
+        self.gate = VadGate(SAMPLE_RATE, backend=vad_backend)
+        self.buffer = PhraseBuffer(SAMPLE_RATE, max_window)
+        self.phrase_start = None
+        self._undecoded = 0
+
+    def _transcribe(self, is_final):
+        from model_server import run_transcribe
+        result = run_transcribe(self.name, self.model, self.buffer.window(), self.options)
+        logprobs = [segment["avg_logprob"] for segment in result["segments"] if segment.get("avg_logprob") is not None]
+        confidence = math.exp(sum(logprobs) / len(logprobs)) if logprobs else None
+        self._undecoded = 0
+        return Segment(self.phrase_start / SAMPLE_RATE, (self.phrase_start + len(self.buffer)) / SAMPLE_RATE,
+                       result["text"].strip(), is_final, confidence)
+
+    def _end_phrase(self, out):
+        if len(self.buffer):
+            out.append(self._transcribe(True))
+        self.buffer.clear()
+        self.phrase_start = None
+
+    def feed(self, samples):
+        out = []
+        for position, run in self.gate.process_runs(samples):
+            if self.phrase_start is not None and (position != self.phrase_start + len(self.buffer)
+                                                  or len(run) > self.buffer.free):
+                # A new utterance, or a full window, closes the phrase
+                self._end_phrase(out)
+            if self.phrase_start is None:
+                self.phrase_start = position
+            self.buffer.append(run)
+            self._undecoded += len(run)
+        if not self.gate.active:
+            self._end_phrase(out)
+        elif self._undecoded >= self.step:
+            out.append(self._transcribe(False))
+        return out
+
+    def finish(self):
+        out = []
+        self._end_phrase(out)
+        return out
+
+
+class GoogleEngine(Engine):
+    name = "google"
+
+    def __init__(self, address=None, language="fr-FR", interim_results=True):
+        from google.cloud import speech
+        self._speech = speech
+        self.client = make_client(address)
+        self.config = speech.StreamingRecognitionConfig(config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16, sample_rate_hertz=SAMPLE_RATE,
+            language_code=language, max_alternatives=1), interim_results=interim_results)
+        self.gate = VadGate(SAMPLE_RATE)
+        self._results = queue.Queue()
+        self._audio = None
+        self._expected = None
+        self._threads = []
+
+    def _open(self, origin):
+        self._audio = queue.Queue()
+        thread = threading.Thread(target=self._listen, args=(self._audio, origin / SAMPLE_RATE), daemon=True)
+        thread.start()
+        self._threads = [t for t in self._threads if t.is_alive()]
+        self._threads.append(thread)
+
+    def _close_request(self):
+        if self._audio is not None:
+            self._audio.put(None)
+            self._audio = None
+            self._expected = None
+
+    def _listen(self, audio, origin):
+        requests = (self._speech.StreamingRecognizeRequest(audio_content=content) for content in iter(audio.get, None))
+        previous_end = 0.0
+        for response in self.client.streaming_recognize(self.config, requests):
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                end = result.result_end_time.total_seconds()
+                self._results.put(Segment(origin + previous_end, origin + end, result.alternatives[0].transcript,
+                                          result.is_final, result.alternatives[0].confidence or None))
+                if result.is_final:
+                    previous_end = end
+
+    def _drain(self):
+        out = []
+        while True:
+            try:
+                out.append(self._results.get_nowait())
+            except queue.Empty:
+                return out
+
+    def feed(self, samples):
+        for position, run in self.gate.process_runs(samples):
+            if self._audio is None or position != self._expected:
+                # One request per utterance, as in the Google scripts
+                self._close_request()
+                self._open(position)
+            self._audio.put(run.tobytes())
+            self._expected = position + len(run)
+        if not self.gate.active:
+            self._close_request()
+        return self._drain()
+
+    def finish(self):
+        self._close_request()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return [segment for segment in self._drain() if segment.is_final]
+
+
+def create_engine(spec, **options):
+    """Engine for a spec: ``engine[:model[:compute_type[:device]]]`` or ``google[:host:port]``."""
+    name, _, rest = spec.partition(":")
+    if name == "google":
+        return GoogleEngine(rest or None, **options)
+    if name not in ENGINE_NAMES:
+        raise ValueError(f"Unknown engine: {name}")
+    parts = rest.split(":") if rest else []
+    model_name, compute_type, device = (parts + ["base", "default", "auto"][len(parts):])[:3]
+    return LocalWhisperEngine(name, model_name, compute_type, device, **options)
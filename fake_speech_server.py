@@ -0,0 +1,317 @@
+"""Local stand-in for the Google Speech-to-Text v1 streaming API.
+
+The server speaks the real gRPC protocol (``google.cloud.speech.v1.Speech``
+``StreamingRecognize``), so `speech.SpeechClient` and `speech.SpeechAsyncClient`
+talk to it unchanged over an insecure channel. It recognizes "coded speech":
+test audio built by `coded_speech`, where each word is a pair of tones, one
+from a low and one from a high group, whose frequencies carry the word's
+number (as DTMF digits do). The tones pass the VAD gate like speech, and the
+code survives any cut, replay or bridging, and lossy coding down to Opus at
+12 kbit/s, so the words a client prints can be checked exactly against the
+words that were played.
+
+Requests configured for FLAC or OGG_OPUS are decoded with ffmpeg (see
+uplink.py) before recognition; `bytes_received` counts what was sent and
+`audio_seconds` what it decoded to.
+
+Like the real API, the server sends interim results while audio arrives and a
+final result every `final_every_ms` of audio, with `result_end_time` counted
+from the start of the request.
+"""
+import argparse
+import threading
+import time
+from concurrent import futures
+from datetime import timedelta
+
+import queue
+import subprocess
+
+import grpc
+import numpy as np
+from google.cloud import speech
+
+SAMPLE_RATE = 16000
+BLOCK_MS = 10
+# Tone frequencies are multiples of 100 Hz, whole periods in any 10 ms block: one FFT bin each
+LOW_BINS = range(2, 20)  # 200 to 1900 Hz
+HIGH_BINS = range(21, 40)  # 2100 to 3900 Hz
+MAX_WORD_ID = len(LOW_BINS) * len(HIGH_BINS)
+MIN_RMS = 500  # quieter blocks are silence
+MIN_WORD_BLOCKS = 3  # shorter runs are blocks straddling two words
+
+
+def coded_speech(word_ids, word_ms=400, rate=SAMPLE_RATE, amplitude=4000):
+    """int16 audio of the given word numbers, one `word_ms` pair of tones per word.
+
+    Numbers run from 1 to `MAX_WORD_ID`. Consecutive words must differ.
+    """
+    word_length = rate * word_ms // 1000
+    t = 2 * np.pi * 100 * np.arange(word_length) / rate  # phase of a 100 Hz tone, times the bin
+    words = []
+    for word_id in word_ids:
+        if not 1 <= word_id <= MAX_WORD_ID:
+            raise ValueError(f"Word numbers run from 1 to {MAX_WORD_ID}")
+        low, high = divmod(word_id - 1, len(HIGH_BINS))
+        tones = np.sin(LOW_BINS[low] * t) + np.sin(HIGH_BINS[high] * t)
+        words.append((amplitude / 2 * tones).astype(np.int16))
+    return np.concatenate(words)
+
+
+def word_ids(count, first=1):
+    """`count` consecutive word numbers from `first`, wrapping around after `MAX_WORD_ID`."""
+    return [(first - 1 + i) % MAX_WORD_ID + 1 for i in range(count)]
+
+
+def word_text(word_id):
+    return f"w{word_id}"
+
+
+class _Recognizer:
+    """Turns the audio of one request into timed words."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.block = rate * BLOCK_MS // 1000
+        self._pending = np.zeros(0, dtype=np.int16)
+        self.received = 0  # samples received in this request
+        self.words = []  # finished (start_ms, end_ms, word_id)
+        self._run = None  # [code, first block, number of blocks] being read
+
+    def feed(self, audio):
+        samples = np.concatenate((self._pending, np.frombuffer(audio, dtype=np.int16)))
+        n_blocks = len(samples) // self.block
+        self._pending = samples[n_blocks * self.block:]
+        first = self.received // self.block
+        self.received += len(audio) // 2
+        if not n_blocks:
+            return
+        blocks = samples[:n_blocks * self.block].reshape(n_blocks, self.block).astype(np.float64)
+        spectrum = np.abs(np.fft.rfft(blocks, axis=1))
+        low = spectrum[:, LOW_BINS.start:LOW_BINS.stop].argmax(axis=1)
+        high = spectrum[:, HIGH_BINS.start:HIGH_BINS.stop].argmax(axis=1)
+        codes = np.where(np.sqrt((blocks ** 2).mean(axis=1)) >= MIN_RMS, 1 + low * len(HIGH_BINS) + high, 0)
+        for index, code in enumerate(codes, first):
+            if self._run is not None and self._run[0] == code:
+                self._run[2] += 1
+                continue
+            self._close_run()
+            self._run = [code, index, 1]
+
+    def _close_run(self):
+        if self._run is not None and self._run[0] > 0 and self._run[2] >= MIN_WORD_BLOCKS:
+            code, start, length = self._run
+            self.words.append((start * BLOCK_MS, (start + length) * BLOCK_MS, code))
+        self._run = None
+
+    def partial(self):
+        """The word being read, if any, as ``(start_ms, end_ms, word_id)``."""
+        if self._run is None or self._run[0] <= 0 or self._run[2] < MIN_WORD_BLOCKS:
+            return None
+        code, start, length = self._run
+        return start * BLOCK_MS, (start + length) * BLOCK_MS, code
+
+    def finish(self):
+        self._close_run()
+
+
+class _Decoder:
+    """ffmpeg decoding one request's FLAC or Ogg Opus stream to PCM as its bytes arrive."""
+
+    def __init__(self, encoding, rate):
+        from uplink import decoder_command
+        self._process = subprocess.Popen(decoder_command(encoding, rate), stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        self._pcm = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for data in iter(lambda: self._process.stdout.read(65536), b""):
+            self._pcm.put(data)
+        self._pcm.put(None)
+
+    def _drain(self, block):
+        out = []
+        while True:
+            try:
+                data = self._pcm.get(block=block)
+            except queue.Empty:
+                break
+            if data is None:
+                break
+            out.append(data)
+        return b"".join(out)
+
+    def decode(self, data):
+        """Send encoded bytes; return the PCM decoded so far."""
+        self._process.stdin.write(data)
+        return self._drain(False)
+
+    def finish(self):
+        """End of the stream: the rest of the PCM."""
+        self._process.stdin.close()
+        pcm = self._drain(True)
+        self._process.wait()
+        return pcm
+
+
+def _result(words, is_final, end_ms):
+    transcript = " ".join(word_text(word_id) for _, _, word_id in words)
+    alternative = speech.SpeechRecognitionAlternative(
+        transcript=transcript,
+        confidence=0.9 if is_final else 0.0,
+        words=[speech.WordInfo(start_time=timedelta(milliseconds=start), end_time=timedelta(milliseconds=end),
+                               word=word_text(word_id)) for start, end, word_id in words],
+    )
+    return speech.StreamingRecognizeResponse(results=[speech.StreamingRecognitionResult(
+        alternatives=[alternative], is_final=is_final, result_end_time=timedelta(milliseconds=end_ms),
+        stability=0.0 if is_final else 0.5)])
+
+
+class FakeSpeechServicer:
+    """StreamingRecognize over coded speech; counts what it received."""
+
+    def __init__(self, final_every_ms=2000, interim_every_ms=300, latency_ms=0, open_delay_ms=0):
+        self.final_every_ms = final_every_ms
+        self.interim_every_ms = interim_every_ms
+        self.latency_ms = latency_ms
+        self.open_delay_ms = open_delay_ms
+        self.streams = 0
+        self.active_streams = 0
+        self.max_active_streams = 0
+        self.bytes_received = 0
+        self.audio_seconds = 0.0
+        self.configs = []
+        self.opened = []  # time.monotonic() at the start of each stream
+        self._lock = threading.Lock()
+
+    def StreamingRecognize(self, request_iterator, context):
+        with self._lock:
+            self.streams += 1
+            self.opened.append(time.monotonic())
+            self.active_streams += 1
+            self.max_active_streams = max(self.max_active_streams, self.active_streams)
+        try:
+            yield from self._recognize(request_iterator)
+        finally:
+            with self._lock:
+                self.active_streams -= 1
+
+    def _recognize(self, request_iterator):
+        requests = iter(request_iterator)
+        first = next(requests, None)
+        if first is None:
+            return
+        if self.open_delay_ms:
+            # Stream setup on the real service takes a noticeable moment
+            time.sleep(self.open_delay_ms / 1000)
+        config = first.streaming_config
+        with self._lock:
+            self.configs.append(config)
+        rate = config.config.sample_rate_hertz or SAMPLE_RATE
+        interim = config.interim_results
+        recognizer = _Recognizer(rate)
+        encoding = config.config.encoding
+        decoder = None
+        if encoding in (speech.RecognitionConfig.AudioEncoding.FLAC, speech.RecognitionConfig.AudioEncoding.OGG_OPUS):
+            decoder = _Decoder(encoding.name.lower(), rate)
+        finalized = 0
+        last_final_ms = 0
+        last_interim_ms = 0
+
+        for request in requests:
+            audio = request.audio_content
+            if not audio:
+                continue
+            with self._lock:
+                self.bytes_received += len(audio)
+            if decoder is not None:
+                audio = decoder.decode(audio)
+            with self._lock:
+                self.audio_seconds += len(audio) / 2 / rate
+            recognizer.feed(audio)
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+            received_ms = recognizer.received * 1000 // rate
+
+            if received_ms - last_final_ms >= self.final_every_ms and len(recognizer.words) > finalized:
+                words = recognizer.words[finalized:]
+                finalized = len(recognizer.words)
+                last_final_ms = words[-1][1]
+                yield _result(words, True, last_final_ms)
+            elif interim and received_ms - last_interim_ms >= self.interim_every_ms:
+                last_interim_ms = received_ms
+                words = recognizer.words[finalized:]
+                partial = recognizer.partial()
+                if partial is not None:
+                    words = words + [partial]
+                if words:
+                    yield _result(words, False, received_ms)
+
+        # Half-close: everything heard so far becomes final
+        if decoder is not None:
+            audio = decoder.finish()
+            with self._lock:
+                self.audio_seconds += len(audio) / 2 / rate
+            recognizer.feed(audio)
+        recognizer.finish()
+        if len(recognizer.words) > finalized:
+            yield _result(recognizer.words[finalized:], True, recognizer.words[-1][1])
+
+    def stats(self):
+        with self._lock:
+            return {"streams": self.streams, "max_active_streams": self.max_active_streams,
+                    "bytes_received": self.bytes_received, "audio_seconds": round(self.audio_seconds, 3)}
+
+
+def start_server(servicer=None, port=0, max_workers=64):
+    """Start a server on localhost; return ``(server, servicer, address)``."""
+    servicer = servicer or FakeSpeechServicer()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler("google.cloud.speech.v1.Speech", {
+        "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+            servicer.StreamingRecognize,
+            request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+            response_serializer=speech.StreamingRecognizeResponse.serialize),
+    }),))
+    port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+    return server, servicer, f"localhost:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Google Speech streaming server for local tests")
+    parser.add_argument("--port", type=int, default=50051, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--final_every_ms", type=int, default=2000, help="Audio between two final results")
+    parser.add_argument("--interim_every_ms", type=int, default=300, help="Audio between two interim results")
+    parser.add_argument("--latency_ms", type=int, default=0, help="Processing delay added per request message")
+    parser.add_argument("--open_delay_ms", type=int, default=0, help="Delay before a new stream starts answering")
+    parser.add_argument("--write_wav", default=None,
+                        help=f"Write a WAV of coded speech (words w1..wN, repeating after w{MAX_WORD_ID}) "
+                             "to this path and exit")
+    parser.add_argument("--words", type=int, default=600, help="Number of words in the WAV written by --write_wav")
+    args = parser.parse_args()
+
+    if args.write_wav:
+        import wave
+        with wave.open(args.write_wav, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes(coded_speech(word_ids(args.words)).tobytes())
+        print(f"Wrote {args.words} coded words to {args.write_wav}")
+        return
+
+    server, servicer, address = start_server(
+        FakeSpeechServicer(args.final_every_ms, args.interim_every_ms, args.latency_ms, args.open_delay_ms), args.port)
+    print(f"Fake Speech server listening on {address}", flush=True)
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(0)
+    print(servicer.stats())
+
+
+if __name__ == "__main__":
+    main()
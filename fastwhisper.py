@@ -1,8 +1,20 @@
+import argparse
+import bisect
+import logging
 import os
+import queue
+import threading
 import time
-import wave
-import pyaudio
-from faster_whisper import WhisperModel
+import numpy as np
+from adaptive import RtfController
+from capture import open_capture
+from compute_profile import DEFAULT_TARGET_RTF, settings_for
+from metrics import metrics
+from model_server import RemoteModel
+from pipeline import BACKPRESSURE_POLICIES, ChunkQueue
+from transcript_store import TranscriptStore, default_path
+from vad import VAD_BACKENDS, VadGate
+from word_events import EventWriter, WordDiffer, segment_words
 
 # Définir les constantes
 NEON_GREEN = '\033[32m'
@@ -10,87 +22,330 @@ RESET_COLOR = '\033[0m'
 
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+class AudioArchive:
+    """
+    Archive en ajout seul de l'audio brut de la session (PCM 16 bits, 16 kHz, mono).
+
+    Les écritures sont faites par un thread dédié : la boucle d'enregistrement
+    se contente de déposer les fragments dans une file.
+    """
+
+    def __init__(self, file_path):
+        self._queue = queue.Queue()
+        self._file = open(file_path, "ab")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        self._queue.put(data)
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            self._file.write(data)
+        self._file.close()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
 # Fonction pour enregistrer un fragment audio
-def record_chunk(p, stream, file_path, chunk_length=1):
+def record_chunk(reader, chunk_length=1, archive=None, gate=None):
     """
-    Enregistre un fragment audio dans un fichier.
+    Enregistre un fragment audio en mémoire.
 
     Args:
-        p (pyaudio.PyAudio): Objet PyAudio.
-        stream (pyaudio.Stream): Flux PyAudio.
-        file_path (str): Chemin du fichier où le fragment audio sera enregistré.
+        reader (capture.RingReader): Lecteur du tampon de capture partagé.
         chunk_length (int): Durée du fragment audio en secondes.
+        archive (AudioArchive): Archive optionnelle de l'audio brut.
+        gate (VadGate): Détecteur d'activité vocale optionnel ; seule la parole est renvoyée.
 
     Returns:
-        None
+        tuple: Échantillons float32 normalisés entre -1 et 1 (vides si silence) et leurs
+        repères ``(décalage dans les échantillons, position dans la capture)``, un par
+        passage de parole conservé, ou None quand la capture est terminée.
     """
 
-    frames = []
+    audio = reader.read(int(16000 * chunk_length))
+    if audio is None:
+        return None
+    # Position du premier échantillon lu (le lecteur saute l'audio perdu en cas de débordement)
+    position = reader.position - len(audio)
+
+    if archive is not None:
+        archive.write(audio.tobytes())
 
-    for _ in range(0, int(16000 / 1024 * chunk_length)):
-        data = stream.read(1024)
-        frames.append(data)
+    if gate is None:
+        return audio.astype(np.float32) / 32768.0, [(0, position)]
 
-    wf = wave.open(file_path, 'wb')
-    wf.setnchannels(1)
-    wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-    wf.setframerate(16000)
-    wf.writeframes(b''.join(frames))
-    wf.close()
+    # Les passages du VAD sont repérés dans le flux qu'il a reçu, que cet écart ramène à la capture
+    shift = position - gate.received
+    marks = []
+    offset = 0
+    runs = gate.process_runs(audio)
+    for start, run in runs:
+        marks.append((offset, start + shift))
+        offset += len(run)
+    speech = np.concatenate([run for _, run in runs]) if runs else np.zeros(0, dtype=np.int16)
+    return speech.astype(np.float32) / 32768.0, marks
+
+def capture_time(marks, seconds, end=False):
+    """
+    Position dans la capture (s) d'un temps (s) de l'audio transcrit, d'après ses repères.
+    Une fin tombant entre deux passages reste au bout du premier.
+    """
+    sample = seconds * 16000
+    offsets = [offset for offset, _ in marks]
+    index = (bisect.bisect_left if end else bisect.bisect_right)(offsets, sample) - 1
+    offset, position = marks[max(index, 0)]
+    return (position + sample - offset) / 16000
 
-def transcribe_chunk(model, file_path):
-    segments, info = model.transcribe(file_path, beam_size=7)
-    transcription = ''.join(segment.text for segment in segments)
-    return transcription
+def transcribe_chunk(model, audio, beam_size=7, best_of=5, word_timestamps=False):
+    """
+    Transcrit un fragment et renvoie ses segments ``(début, fin, texte, confiance, mots)``,
+    les temps en secondes depuis le début du fragment ; les mots ne sont horodatés
+    qu'avec `word_timestamps`.
+    """
+    segments, info = model.transcribe(audio, beam_size=beam_size, best_of=best_of, word_timestamps=word_timestamps)
+    return [(segment.start, segment.end, segment.text, float(np.exp(segment.avg_logprob)), segment_words(segment))
+            for segment in segments]
+
+def merge_chunks(chunks):
+    """
+    Fusionne deux fragments consécutifs de la file (politique "merge").
+    """
+    (captured_at, _, first_marks, first), (_, captured_until, second_marks, second) = chunks
+    marks = first_marks + [(offset + len(first), position) for offset, position in second_marks]
+    return captured_at, captured_until, marks, np.concatenate((first, second))
+
+def capture_loop(reader, chunks, stop_event, archive=None, gate=None, controller=None):
+    """
+    Enregistre en continu et dépose les fragments dans la file, pendant que
+    les workers transcrivent les fragments précédents.
+    """
+    while not stop_event.is_set():
+        chunk_length = controller.settings()[0] if controller else 1
+        captured_at = time.monotonic()
+        chunk = record_chunk(reader, chunk_length, archive=archive, gate=gate)
+        if chunk is None:
+            break
+        audio, marks = chunk
+        metrics.observe("capture", captured_at)
+        # Les fragments silencieux ne sont pas transcrits
+        if len(audio):
+            chunks.put((captured_at, time.monotonic(), marks, audio))
+    chunks.close()
+
+def inference_worker(model, chunks, results, controller=None, word_timestamps=False):
+    """
+    Transcrit les fragments de la file jusqu'à sa fermeture, en signalant au
+    contrôleur la durée de chaque fragment, son attente et son temps d'inférence.
+    Un fragment dont la transcription échoue rend l'erreur à sa place dans l'ordre
+    des résultats, au lieu de bloquer ceux qui le suivent.
+    """
+    while True:
+        item = chunks.get()
+        if item is None:
+            break
+        seq, (_, captured_until, marks, audio) = item
+        _, beam_size, best_of = controller.settings() if controller else (1, 7, 5)
+
+        started = time.monotonic()
+        metrics.observe("queue", captured_until, started, seq=seq)
+        try:
+            segments = transcribe_chunk(model, audio, beam_size, best_of, word_timestamps)
+        except Exception as e:
+            results.put((seq, (captured_until, marks, [], f"{type(e).__name__}: {e}")))
+            continue
+        metrics.observe("inference", started, seq=seq)
+        if controller:
+            # Le RTF se mesure sur l'audio transcrit, la latence sur le temps de capture qu'il couvre,
+            # silences retirés par le VAD compris
+            seconds = len(audio) / 16000
+            captured = capture_time(marks, seconds, end=True) - capture_time(marks, 0)
+            controller.observe(seconds, time.monotonic() - started, started - captured_until, captured)
+        results.put((seq, (captured_until, marks, segments, None)))
 
 def main2():
     """
     Fonction principale du programme.
     """
+    launch_time = time.monotonic()
+    first_transcript = True
+
+    parser = argparse.ArgumentParser(description="Transcription en temps réel avec faster-whisper")
+    parser.add_argument("--archive", type=str, default=None,
+                        help="Fichier PCM brut (16 kHz, mono, 16 bits) auquel ajouter l'audio de la session")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Nombre de threads de transcription")
+    parser.add_argument("--queue_size", type=int, default=4,
+                        help="Nombre maximal de fragments en attente de transcription")
+    parser.add_argument("--backpressure", choices=BACKPRESSURE_POLICIES, default="drop_oldest",
+                        help="Comportement quand la file est pleine")
+    parser.add_argument("--vad", choices=VAD_BACKENDS + ("off",), default="energy",
+                        help="Détecteur d'activité vocale utilisé pour ignorer le silence")
+    parser.add_argument("--model_server", type=str, default=None,
+                        help="Socket Unix d'un model_server.py déjà lancé, au lieu de charger le modèle ici")
+    parser.add_argument("--model", type=str, default=None,
+                        help="Taille du modèle (par défaut : profil mesuré pour cette machine)")
+    parser.add_argument("--device", type=str, default=None, help="cpu ou cuda (par défaut : profil)")
+    parser.add_argument("--compute_type", type=str, default=None,
+                        help="int8, int8_float32, float32, float16... (par défaut : profil)")
+    parser.add_argument("--cpu_threads", type=int, default=None, help="Threads CPU (par défaut : profil)")
+    parser.add_argument("--target_rtf", type=float, default=DEFAULT_TARGET_RTF,
+                        help="Facteur temps réel visé lors de la mesure du profil")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Ajuster durée des fragments, beam_size et best_of selon le facteur temps réel mesuré")
+    parser.add_argument("--latency_slo", type=float, default=3.0,
+                        help="Latence maximale visée entre la parole et le texte, en secondes")
+    parser.add_argument("--min_chunk", type=float, default=1.0, help="Durée minimale d'un fragment (s)")
+    parser.add_argument("--max_chunk", type=float, default=5.0, help="Durée maximale d'un fragment (s)")
+    parser.add_argument("--max_beam", type=int, default=7, help="beam_size maximal")
+    parser.add_argument("--max_best_of", type=int, default=5, help="best_of maximal")
+    parser.add_argument("--controller_log", type=str, default="controller.log",
+                        help="Fichier où sont journalisées les décisions du contrôleur")
+    parser.add_argument("--transcript", type=str, default=None,
+                        help="Fichier de transcription (.jsonl) ; un fichier existant est repris après la dernière ligne complète")
+    parser.add_argument("--input_file", type=str, default=None,
+                        help="Fichier audio rejoué à la place du microphone : WAV 16 bits, ou FLAC, MP3... décodé "
+                             "avec PyAV, à toute fréquence et tout nombre de canaux (ramené en 16 kHz mono)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Vitesse de relecture de --input_file (0 : aussi vite que la transcription)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Retard maximal (s) de chaque fragment rejoué, comme sur une machine chargée")
+    parser.add_argument("--word_events", type=str, default=None,
+                        help="Fichier ou FIFO où écrire les événements par mot (finalisé) en JSON lines")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Port local où servir les histogrammes de latence par étape (/metrics, format Prometheus)")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Fichier JSON où écrire la trace Chrome des étapes à la fin de la session")
+    args = parser.parse_args()
+    if args.word_events == "-":
+        parser.error("--word_events - mélangerait le JSON et la transcription affichée : donner un fichier ou une FIFO")
+    metrics.start(args.metrics_port, args.trace)
+
+    # Choisir le profil de calcul mesuré pour cette machine, sauf réglages explicites
+    try:
+        settings = settings_for("faster-whisper", args.model, args.device, args.compute_type, args.cpu_threads,
+                                args.target_rtf)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Profil : " + str(settings))
 
-    # Sélectionner le modèle Whisper
-    model = WhisperModel("medium", device="cuda", compute_type="float16")
+    controller = None
+    if args.adaptive:
+        logging.basicConfig(filename=args.controller_log, level=logging.INFO, format="%(asctime)s %(message)s")
+        controller = RtfController(latency_slo=args.latency_slo, min_chunk=args.min_chunk, max_chunk=args.max_chunk,
+                                   max_beam=args.max_beam, max_best_of=args.max_best_of)
 
-    # Initialiser PyAudio
-    p = pyaudio.PyAudio()
+    # Sélectionner le modèle Whisper : une connexion au serveur par worker, ou un modèle local préchauffé
+    if args.model_server:
+        models = [RemoteModel("faster-whisper", settings["model"], settings["compute_type"], settings["device"],
+                              socket_path=args.model_server)
+                  for _ in range(args.workers)]
+    else:
+        from faster_whisper import WhisperModel
+        model = WhisperModel(settings["model"], device=settings["device"], compute_type=settings["compute_type"],
+                             cpu_threads=settings.get("cpu_threads") or 0, num_workers=args.workers)
+        transcribe_chunk(model, np.zeros(16000, dtype=np.float32))
+        models = [model] * args.workers
 
-    # Ouvrir le flux d'enregistrement
-    stream = p.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=1024)
+    # Ouvrir la capture : le callback PyAudio (ou le fichier rejoué) alimente un tampon circulaire
+    device = open_capture(16000, 1024, input_file=args.input_file, speed=args.speed, jitter=args.jitter)
+    reader = device.reader()
+    device.start()
 
-    # Initialiser une chaîne vide pour accumuler les transcriptions
-    accumulated_transcription = ""
+    # Chaque segment final est ajouté au fichier de transcription dès qu'il est produit
+    store = TranscriptStore(args.transcript or default_path("faster-whisper"), "faster-whisper",
+                            model=settings["model"], compute_type=settings["compute_type"])
+    archive = AudioArchive(args.archive) if args.archive else None
+    events = EventWriter(args.word_events) if args.word_events else None
+    differ = WordDiffer()
+    gate = VadGate(16000, backend=args.vad) if args.vad != "off" else None
+
+    # L'enregistrement et la transcription tournent dans des threads séparés ;
+    # sous la politique "merge", un fragment fusionné ne dépasse pas la fenêtre de 30 s du modèle
+    chunks = ChunkQueue(maxsize=args.queue_size, policy=args.backpressure, merge=merge_chunks,
+                        max_merged=30 * 16000, size=lambda chunk: len(chunk[3]))
+    results = queue.Queue()
+    stop_event = threading.Event()
+    capture_thread = threading.Thread(target=capture_loop, args=(reader, chunks, stop_event, archive, gate, controller),
+                                      daemon=True)
+    capture_thread.start()
+    workers = [threading.Thread(target=inference_worker, args=(model, chunks, results, controller, events is not None),
+                                daemon=True)
+               for model in models]
+    for worker in workers:
+        worker.start()
+
+    # Les transcriptions sont affichées dans l'ordre des fragments
+    pending = {}
+    next_seq = 0
 
     try:
         while True:
-            # Enregistrer un fragment audio
-            chunk_file = "temp_chunk.wav"
-            record_chunk(p, stream, chunk_file)
+            try:
+                seq, transcription = results.get(timeout=0.5)
+            except queue.Empty:
+                # Fin de l'entrée audio : tous les fragments ont été transcrits
+                if not any(worker.is_alive() for worker in workers) and results.empty():
+                    break
+                continue
+            pending[seq] = transcription
 
-            # Transcrire le fragment audio
-            transcription = transcribe_chunk(model, chunk_file)
-            print(NEON_GREEN + transcription + RESET_COLOR)
+            while next_seq in pending:
+                captured_until, marks, segments, error = pending.pop(next_seq)
+                if error:
+                    print(f"Fragment {next_seq} non transcrit : {error}")
+                rendered = time.monotonic()
+                transcription = ''.join(text for _, _, text, _, _ in segments)
+                print(NEON_GREEN + transcription + RESET_COLOR)
+                metrics.observe("render", rendered, seq=next_seq)
+                metrics.observe("end_to_end", captured_until, seq=next_seq)
+                next_seq += 1
 
-            # Supprimer le fichier temporaire
-            os.remove(chunk_file)
+                if first_transcript and transcription.strip():
+                    first_transcript = False
+                    print(f"Premier texte après {time.monotonic() - launch_time:.1f} s")
 
-            # Ajouter la nouvelle transcription à la transcription accumulée
-            accumulated_transcription += transcription + " "
+                # Temps de la capture : le silence retiré par le VAD ne décale pas les segments suivants
+                for start, end, text, confidence, words in segments:
+                    store.add(capture_time(marks, start), capture_time(marks, end, end=True), text, confidence)
+                    # Chaque segment est définitif : une phrase finalisée par segment
+                    if events:
+                        events.write(differ.finalize([word._replace(start=capture_time(marks, word.start),
+                                                                    end=capture_time(marks, word.end, end=True))
+                                                      for word in words]))
 
     except KeyboardInterrupt:
         print("Arrêt...")
 
-        # Enregistrer la transcription accumulée dans un fichier journal
-        with open("log.txt", "w") as log_file:
-            log_file.write(accumulated_transcription)
+    else:
+        print("Fin de l'entrée audio.")
 
     finally:
-        print("LOG" + accumulated_transcription)
-        # Fermer le flux d'enregistrement
-        stream.stop_stream()
-        stream.close()
+        store.close()
+        print("Transcription : " + store.path + " (" + str(store.segments_written) + " segments)")
+        if events:
+            events.close()
+            print("Événements par mot : " + str(differ.report()))
+        print("File d'attente : " + str(chunks.stats()))
+
+        # Arrêter l'enregistrement et fermer la capture
+        stop_event.set()
+        chunks.close()
+        device.stop()
+        capture_thread.join(timeout=2)
+        print("Capture : " + str(device.stats()))
+        if gate is not None:
+            print(gate.report())
 
-        # Arrêter PyAudio
-        p.terminate()
+        if archive is not None:
+            archive.close()
+        metrics.annotate(capture=device.stats(), queue=chunks.stats())
+        metrics.stop()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,35 @@
+import argparse
+import itertools
 import queue
 import re
 import sys
+import threading
 import time
 import webbrowser
-import pyautogui
-from google.cloud import speech
-import pyaudio
+from bridge import BridgeBuffer
+from capture import FakeDevice, MicrophoneCapture
+from local_agreement import Word
+from metrics import SendTimes, metrics
+from speech_client import make_client
+from terminal import LiveRenderer
+from transcript_store import TranscriptStore, default_path
+from uplink import ENCODINGS, OPUS_BITRATE, Uplink, recognition_encoding
+from vad import VadGate
+from word_events import EventWriter, WordDiffer, text_words
 
 # Paramètres d'enregistrement audio
 STREAMING_LIMIT = 240000  # 4 minutes
 SAMPLE_RATE = 16000
 CHUNK_SIZE = int(SAMPLE_RATE / 10)  # 100ms
+HANDOVER_OVERLAP = 5000  # ms d'audio envoyés aux deux requêtes lors d'un relais
 
 RED = "\033[0;31m"
 GREEN = "\033[0;32m"
 YELLOW = "\033[0;33m"
 
+# Les résultats provisoires sont réécrits sur place, au plus `max_rate` fois par seconde
+renderer = LiveRenderer(max_rate=10.0)
+
 def get_current_time() -> int:
     """Retourne le temps actuel en millisecondes."""
     return int(round(time.time() * 1000))
@@ -23,32 +37,31 @@ def get_current_time() -> int:
 class ResumableMicrophoneStream:
     """Ouvre un flux d'enregistrement en tant que générateur renvoyant les morceaux audio."""
 
-    def __init__(self, rate: int, chunk_size: int) -> None:
-        """Crée un flux de microphone réutilisable."""
+    def __init__(self, rate: int, chunk_size: int, capture=None, streaming_limit: int = STREAMING_LIMIT,
+                 uplink=None) -> None:
+        """Crée un flux de microphone réutilisable (ou lit un périphérique de capture déjà créé)."""
         self._rate = rate
         self.chunk_size = chunk_size
         self._num_channels = 1
-        self._buff = queue.Queue()
         self.closed = True
         self.start_time = get_current_time()
         self.restart_counter = 0
-        self.audio_input = []
-        self.last_audio_input = []
         self.result_end_time = 0
         self.is_final_end_time = 0
-        self.final_request_end_time = 0
         self.bridging_offset = 0
         self.last_transcript_was_final = False
-        self.new_stream = True
-        self._audio_interface = pyaudio.PyAudio()
-        self._audio_stream = self._audio_interface.open(
-            format=pyaudio.paInt16,
-            channels=self._num_channels,
-            rate=self._rate,
-            input=True,
-            frames_per_buffer=self.chunk_size,
-            stream_callback=self._fill_buffer,
-        )
+        self.stream_cut = False
+        self.streaming_limit = streaming_limit
+        self.gate = VadGate(rate)
+        self.bridge = BridgeBuffer(rate)
+        # Encodage de l'audio envoyé (LINEAR16 tel quel, FLAC ou OGG_OPUS)
+        self.uplink = uplink or Uplink("linear16", rate)
+        self.sent = SendTimes()  # heures de capture et d'envoi de l'audio, pour mesurer la latence des résultats
+        self.captured_at = None  # heure de la dernière lecture du périphérique
+        # Le callback PyAudio écrit dans un tampon circulaire partagé
+        self._capture = capture or MicrophoneCapture(self._rate, self.chunk_size, channels=self._num_channels)
+        self._capture.start()
+        self._reader = self._capture.reader()
 
     def __enter__(self):
         """Ouvre le flux."""
@@ -57,71 +70,97 @@ class ResumableMicrophoneStream:
 
     def __exit__(self, type, value, traceback):
         """Ferme le flux et libère les ressources."""
-        self._audio_stream.stop_stream()
-        self._audio_stream.close()
         self.closed = True
-        self._buff.put(None)
-        self._audio_interface.terminate()
+        self._capture.stop()
 
-    def _fill_buffer(self, in_data, *args, **kwargs):
-        """Collecte continuellement les données du flux audio dans le buffer."""
-        self._buff.put(in_data)
-        return None, pyaudio.paContinue
+    def generator(self, first_runs=(), replay=b""):
+        """Stream Audio du microphone vers l'API et le tampon du pont"""
+        if replay:
+            yield replay
 
-    def generator(self):
-        """Stream Audio du microphone vers l'API et le buffer local"""
+        runs = list(first_runs)
         while not self.closed:
-            data = []
-
-            if self.new_stream and self.last_audio_input:
-                chunk_time = STREAMING_LIMIT / len(self.last_audio_input)
-
-                if chunk_time != 0:
-                    if self.bridging_offset < 0:
-                        self.bridging_offset = 0
+            if not runs:
+                # Tout l'audio disponible, au moins un morceau
+                waited = time.monotonic()
+                samples = self._reader.read_available(min_samples=self.chunk_size)
+                if samples is None:
+                    return
+                self.captured_at = time.monotonic()
+                metrics.observe("capture", waited, self.captured_at)
+
+                # Le silence n'est ni envoyé à l'API ni gardé pour le pont
+                runs = self.gate.process_runs(samples)
 
-                    if self.bridging_offset > self.final_request_end_time:
-                        self.bridging_offset = self.final_request_end_time
-
-                    chunks_from_ms = round(
-                        (self.final_request_end_time - self.bridging_offset)
-                        / chunk_time
-                    )
-
-                    self.bridging_offset = round(
-                        (len(self.last_audio_input) - chunks_from_ms) * chunk_time
-                    )
-
-                    for i in range(chunks_from_ms, len(self.last_audio_input)):
-                        data.append(self.last_audio_input[i])
-
-                self.new_stream = False
+            data = []
+            for position, run in runs:
+                self.bridge.append(position, run)
+                data.append(run.tobytes())
+                self.sent.mark(position + len(run), self.captured_at)
+            runs = []
 
-            chunk = self._buff.get()
-            self.audio_input.append(chunk)
+            if data:
+                yield b"".join(data)
 
-            if chunk is None:
+            # Fin de l'énoncé : la requête se termine proprement
+            if not self.gate.active:
                 return
-            data.append(chunk)
-            while True:
-                try:
-                    chunk = self._buff.get(block=False)
 
-                    if chunk is None:
-                        return
-                    data.append(chunk)
-                    self.audio_input.append(chunk)
-
-                except queue.Empty:
-                    break
-
-            yield b"".join(data)
-
-def listen_print_loop(responses, stream):
+    def wait_for_speech(self):
+        """Attend le début d'un énoncé, pour n'ouvrir une requête qu'avec de la parole."""
+        while not self.closed:
+            samples = self._reader.read(self.chunk_size)
+            if samples is None:
+                return None
+            self.captured_at = time.monotonic()
+            runs = self.gate.process_runs(samples)
+            if runs:
+                return runs
+        return None
+
+    def read_runs(self):
+        """Audio suivant à envoyer, découpé par le VAD ; None à la fin de la capture."""
+        waited = time.monotonic()
+        samples = self._reader.read_available(min_samples=self.chunk_size)
+        if samples is None:
+            return None
+        self.captured_at = time.monotonic()
+        metrics.observe("capture", waited, self.captured_at)
+        return self.gate.process_runs(samples)
+
+    def observe_result(self, end_time: int, is_final: bool, received: float) -> None:
+        """Latences d'un résultat affiché : envoi → réception (réseau et reconnaissance), affichage, et bout en bout
+        depuis la capture du dernier échantillon, attente de la capture et file d'envoi comprises."""
+        metrics.observe("render", received, is_final=is_final)
+        position = end_time * self._rate // 1000
+        sent = self.sent.sent_at(position)
+        if sent is not None:
+            metrics.observe("recognition", sent, received, is_final=is_final)
+        captured = self.sent.captured_at(position)
+        if captured is not None:
+            metrics.observe("end_to_end", captured, is_final=is_final)
+
+def print_result(corrected_time: int, transcript: str, is_final: bool, start_time=None, confidence=None,
+                 words=None, source=None) -> None:
+    """Affiche un résultat final (vert) ou provisoire (rouge, réécrit sur place)."""
+    if is_final:
+        renderer.final(str(corrected_time) + ": " + transcript, GREEN)
+    else:
+        renderer.interim(str(corrected_time) + ": " + transcript, RED)
+
+def refresh_renderer(stop: threading.Event) -> None:
+    """Affiche le résultat provisoire retenu par la limite de rafraîchissement, même si aucun autre n'arrive."""
+    # Les boucles de réponses restent bloquées sur le flux gRPC entre deux résultats
+    while not stop.wait(1.0 / renderer.max_rate):
+        renderer.refresh()
+
+def listen_print_loop(responses, stream, show=print_result):
     """Itère à travers les réponses du serveur et les imprime."""
     for response in responses:
-        if get_current_time() - stream.start_time > STREAMING_LIMIT:
+        received = time.monotonic()
+        if get_current_time() - stream.start_time > stream.streaming_limit:
             stream.start_time = get_current_time()
+            stream.stream_cut = True
             break
 
         if not response.results:
@@ -133,40 +172,155 @@ def listen_print_loop(responses, stream):
             continue
 
         transcript = result.alternatives[0].transcript
+        # Un résultat final commence où le précédent s'est arrêté
+        start_time = stream.bridge.session_ms(stream.is_final_end_time)
 
         result_seconds = result.result_end_time.seconds or 0
         result_micros = result.result_end_time.microseconds or 0
 
         stream.result_end_time = int((result_seconds * 1000) + (result_micros / 1000))
 
-        corrected_time = (
-            stream.result_end_time
-            - stream.bridging_offset
-            + (STREAMING_LIMIT * stream.restart_counter)
-        )
+        # Temps de session exact, pont compris
+        corrected_time = stream.bridge.session_ms(stream.result_end_time)
 
-        if result.is_final:
-            sys.stdout.write(GREEN)
-            sys.stdout.write("\033[K")
-            sys.stdout.write(str(corrected_time) + ": " + transcript + "\n")
+        show(corrected_time, transcript, result.is_final, start_time, result.alternatives[0].confidence,
+             _words(result.alternatives[0], stream.bridge))
+        if metrics.enabled:
+            stream.observe_result(corrected_time, result.is_final, received)
 
+        if result.is_final:
             stream.is_final_end_time = stream.result_end_time
             stream.last_transcript_was_final = True
 
             if re.search(r"\b(exit|quit)\b", transcript, re.I):
-                sys.stdout.write(YELLOW)
-                sys.stdout.write("Exiting...\n")
+                renderer.final("Exiting...", YELLOW)
                 stream.closed = True
                 break
         else:
-            sys.stdout.write(RED)
-            sys.stdout.write("\033[K")
-            sys.stdout.write(str(corrected_time) + ": " + transcript + "\r")
-
             stream.last_transcript_was_final = False
 
+class HandoverRequest:
+    """
+    Requête streaming_recognize alimentée depuis une file et écoutée dans son
+    propre thread, pour que deux requêtes puissent recevoir le même audio
+    pendant un relais.
+
+    Chaque mot final n'est gardé que par une des deux requêtes qui se
+    chevauchent : celle qui part garde les mots dont le milieu précède la
+    couture (`keep_until`), celle qui arrive ceux qui la suivent
+    (`keep_from`). Les deux requêtes ont entendu l'audio autour de la
+    couture, qui tombe au milieu du chevauchement.
+    """
+
+    def __init__(self, client, streaming_config, stream, keep_from=None, show=print_result) -> None:
+        self.stream = stream
+        self.show = show
+        self.keep_from = keep_from
+        self.keep_until = None
+        self.show_interim = True
+        self.opened_at = get_current_time()
+        self.last_final_end = None  # temps de session (ms) du dernier résultat final
+        self.bridge = BridgeBuffer(stream._rate)  # positions de session de l'audio envoyé
+        self._audio = queue.Queue()
+        self._thread = threading.Thread(target=self._listen, args=(client, streaming_config), daemon=True)
+        self._thread.start()
+
+    def send(self, position: int, run) -> None:
+        self.bridge.append(position, run)
+        self._audio.put(run.tobytes())
+
+    def close(self) -> None:
+        """Fin de l'audio : la requête rend ses derniers résultats finaux puis se termine."""
+        self._audio.put(None)
+
+    def join(self) -> None:
+        self._thread.join()
+
+    def _listen(self, client, streaming_config) -> None:
+        from google.cloud import speech
+        encoded = self.stream.uplink.encode(iter(self._audio.get, None))
+        requests = (speech.StreamingRecognizeRequest(audio_content=content) for content in encoded)
+        try:
+            self._responses(client.streaming_recognize(streaming_config, requests))
+        finally:
+            encoded.close()
+
+    def _responses(self, responses) -> None:
+        for response in responses:
+            received = time.monotonic()
+            if not response.results or not response.results[0].alternatives:
+                continue
+            result = response.results[0]
+            alternative = result.alternatives[0]
+            end_time = self.bridge.session_ms(_duration_ms(result.result_end_time))
+
+            start_time = self.last_final_end if self.last_final_end is not None else self.bridge.session_ms(0)
+            if not result.is_final:
+                if self.show_interim:
+                    words = self._interim_filter(alternative, start_time, end_time)
+                    if words:
+                        self.show(end_time, " ".join(word.text for word in words), False, None, None, words, self)
+                        if metrics.enabled:
+                            self.stream.observe_result(end_time, False, received)
+                continue
+
+            self.last_final_end = end_time
+            words, start_time, end_time = self._seam_filter(alternative, start_time, end_time)
+            if words:
+                self.show(end_time, " ".join(word.text for word in words), True, start_time, alternative.confidence,
+                          words, self)
+                if metrics.enabled:
+                    self.stream.observe_result(end_time, True, received)
+            if re.search(r"\b(exit|quit)\b", alternative.transcript, re.I):
+                self.stream.closed = True
+
+    def _keeps(self, start_time: int, end_time: int) -> bool:
+        middle = (start_time + end_time) / 2
+        if self.keep_from is not None and middle < self.keep_from:
+            return False
+        return self.keep_until is None or middle < self.keep_until
+
+    def _seam_filter(self, alternative, start_time: int, end_time: int):
+        """Mots (`Word`) d'un résultat final qui reviennent à cette requête, avec le début du premier et la fin du dernier."""
+        words = _words(alternative, self.bridge)
+        if self.keep_from is None and self.keep_until is None:
+            return words, start_time, end_time
+        if not alternative.words:
+            # Sans temps par mot, le résultat entier va à une seule des deux requêtes
+            kept = self._keeps(start_time, end_time)
+            return (words if kept else []), start_time, end_time
+
+        kept = []
+        for word in words:
+            if self._keeps(word.start * 1000, word.end * 1000):
+                if not kept:
+                    start_time = round(word.start * 1000)
+                kept.append(word)
+                end_time = round(word.end * 1000)
+        return kept, start_time, end_time
+
+    def _interim_filter(self, alternative, start_time: int, end_time: int):
+        """Mots d'un résultat provisoire qui reviennent à cette requête, coupés à la couture comme les finaux."""
+        if alternative.words or self.keep_from is None or start_time >= self.keep_from:
+            return self._seam_filter(alternative, start_time, end_time)[0]
+        # Sans temps par mot, la phrase qui chevauche la couture n'est affichée qu'à son résultat final,
+        # coupé mot par mot : ses premiers mots sont ceux que la requête qui part finalise
+        return []
+
+def _words(alternative, bridge) -> list:
+    """Mots d'un résultat en temps de session (s) ; les résultats provisoires n'ont pas de temps par mot."""
+    if not alternative.words:
+        return text_words(alternative.transcript)
+    return [Word(bridge.session_ms(_duration_ms(word.start_time)) / 1000,
+                 bridge.session_ms(_duration_ms(word.end_time)) / 1000, word.word) for word in alternative.words]
+
+def _duration_ms(duration) -> int:
+    return int(duration.total_seconds() * 1000)
+
 def join_zoom_meeting(meeting_link, username="Dummy"):
     """Rejoint une réunion Zoom en tant qu'utilisateur nommé 'Dummy'."""
+    import pyautogui
+
     webbrowser.open(meeting_link)
     time.sleep(10)
 
@@ -180,60 +334,219 @@ def join_zoom_meeting(meeting_link, username="Dummy"):
 
     print(f"Joined the meeting as {username}")
 
+def show_status(message: str) -> None:
+    renderer.final("\n" + message, YELLOW)
+
+def transcribe_sequential(client, streaming_config, stream, show=print_result) -> None:
+    """Une requête à la fois ; à STREAMING_LIMIT, la suivante rejoue l'audio qui suit le dernier résultat final."""
+    from google.cloud import speech
+    replay = b""
+    while not stream.closed:
+        # Sans audio à rejouer, la requête suivante attend le prochain énoncé
+        first_runs = []
+        if not replay:
+            first_runs = stream.wait_for_speech()
+            if first_runs is None:
+                break
+        stream.start_time = get_current_time()
+        stream.stream_cut = False
+
+        start_ms = stream.bridge.session_ms(0) if replay else first_runs[0][0] * 1000 // SAMPLE_RATE
+        show_status(str(start_ms) + ": NOUVELLE DEMANDE")
+
+        audio_generator = stream.generator(first_runs, replay)
+        # L'encodeur lit l'audio dans son propre thread ; la requête n'envoie que le flux encodé
+        encoded = stream.uplink.encode(audio_generator)
+
+        requests = (
+            speech.StreamingRecognizeRequest(audio_content=content)
+            for content in encoded #"https://zoom.us/j/94009403014?pwd=VsMO2lxmH0Cs9wHXiZgYyTg1ZdqrIn.1"
+        )
+
+        responses = client.streaming_recognize(streaming_config, requests)
+
+        listen_print_loop(responses, stream, show)
+        # Le flux envoyé rend le générateur, qui partage le lecteur et le VAD, avant que la requête suivante lise
+        # la capture : sinon l'ancienne requête continuerait d'en prendre une partie
+        encoded.close()
+
+        # Une requête coupée à STREAMING_LIMIT rejoue ce qui suit son dernier résultat final
+        replay = stream.bridge.restart(stream.is_final_end_time if stream.stream_cut else None)
+        stream.bridging_offset = len(replay) // 2 * 1000 // SAMPLE_RATE
+        stream.result_end_time = 0
+        stream.is_final_end_time = 0
+        stream.restart_counter += 1
+
+def transcribe_handover(client, streaming_config, stream, overlap_ms: int = HANDOVER_OVERLAP,
+                        show=print_result) -> None:
+    """
+    Relais avec chevauchement : la requête suivante s'ouvre `overlap_ms` avant
+    STREAMING_LIMIT et reçoit le même audio que la précédente jusqu'à la
+    limite. Les résultats ne s'arrêtent pas pendant l'ouverture de la nouvelle
+    requête, et chaque mot de la couture n'est affiché qu'une fois.
+    """
+    rate = stream._rate
+    previous = current = None
+    open_requests = []
+    # Pendant un relais, les deux requêtes reçoivent leurs résultats chacune dans son thread :
+    # l'affichage, la transcription et les événements par mot n'en traitent qu'un à la fois
+    lock = threading.Lock()
+
+    def show_one(*result):
+        with lock:
+            show(*result)
+
+    while not stream.closed:
+        if current is None:
+            runs = stream.wait_for_speech()
+            if runs is None:
+                break
+            current = HandoverRequest(client, streaming_config, stream, show=show_one)
+            open_requests.append(current)
+            show_status(str(runs[0][0] * 1000 // rate) + ": NOUVELLE DEMANDE")
+        else:
+            runs = stream.read_runs()
+            if runs is None:
+                break
+
+        for position, run in runs:
+            current.send(position, run)
+            if previous is not None:
+                previous.send(position, run)
+            stream.sent.mark(position + len(run), stream.captured_at)
+
+        now = get_current_time()
+        if previous is not None and now - previous.opened_at >= stream.streaming_limit:
+            previous.close()
+            previous = None
+        if previous is None and now - current.opened_at >= stream.streaming_limit - overlap_ms:
+            # La couture tombe au milieu du chevauchement, entendu par les deux requêtes
+            seam = stream.gate.position * 1000 // rate + overlap_ms // 2
+            current.keep_until = seam
+            current.show_interim = False
+            previous, current = current, HandoverRequest(client, streaming_config, stream, keep_from=seam, show=show_one)
+            open_requests.append(current)
+            stream.restart_counter += 1
+            show_status(str(seam) + ": RELAIS")
+
+        if not stream.gate.active:
+            # Fin de l'énoncé : les requêtes ouvertes rendent leurs derniers résultats
+            for request in (previous, current):
+                if request is not None:
+                    request.close()
+            previous = current = None
+            open_requests = [request for request in open_requests if request._thread.is_alive()]
+
+    for request in (previous, current):
+        if request is not None:
+            request.close()
+    for request in open_requests:
+        request.join()
+
 def main():
     """Démarre le streaming bidirectionnel du microphone vers l'API de reconnaissance vocale."""
-    client = speech.SpeechClient()
+    parser = argparse.ArgumentParser(description="Transcription en continu d'une réunion avec Google Speech")
+    parser.add_argument("--handover_overlap", type=int, default=HANDOVER_OVERLAP,
+                        help="ms d'audio envoyés aux deux requêtes lors d'un relais (0 : relance séquentielle)")
+    parser.add_argument("--server", default=None, help="host:port d'un serveur local (fake_speech_server.py)")
+    parser.add_argument("--refresh_rate", type=float, default=10.0,
+                        help="Nombre maximal de rafraîchissements par seconde du résultat provisoire (0 : sans limite)")
+    parser.add_argument("--transcript", default=None,
+                        help="Fichier de transcription (.jsonl) ; un fichier existant est repris après sa dernière ligne complète")
+    parser.add_argument("--input_file", default=None,
+                        help="Fichier audio rejoué à la place du microphone, sans réunion Zoom : WAV 16 bits, ou "
+                             "FLAC, MP3... décodé avec PyAV, à toute fréquence et tout nombre de canaux")
+    parser.add_argument("--speed", type=float, default=1.0, help="Vitesse de relecture de --input_file")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Retard maximal (s) de chaque fragment rejoué, comme sur une machine chargée")
+    parser.add_argument("--word_events", default=None,
+                        help="Fichier ou FIFO où écrire les événements par mot (ajouté/révisé/finalisé) en JSON lines")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="linear16",
+                        help="Encodage de l'audio envoyé : flac et ogg_opus réduisent le débit (ffmpeg requis)")
+    parser.add_argument("--bitrate", type=int, default=OPUS_BITRATE, help="Débit Opus en bit/s")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Port local où servir les histogrammes de latence par étape (/metrics, format Prometheus)")
+    parser.add_argument("--trace", default=None,
+                        help="Fichier JSON où écrire la trace Chrome des étapes à la fin de la session")
+    args = parser.parse_args()
+    if args.word_events == "-":
+        parser.error("--word_events - mélangerait le JSON et l'affichage en direct : donner un fichier ou une FIFO")
+    metrics.start(args.metrics_port, args.trace)
+
+    # Importé seulement maintenant : --help n'attend pas le client Google
+    from google.cloud import speech
+    client = make_client(args.server)
+    renderer.max_rate = args.refresh_rate
+    uplink = Uplink(args.encoding, SAMPLE_RATE, args.bitrate)
     config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=recognition_encoding(args.encoding),
         sample_rate_hertz=SAMPLE_RATE,
         language_code="fr-FR",  # Changez en fonction de la langue de la réunion
         max_alternatives=1,
+        enable_word_time_offsets=True,  # pour dédoublonner les mots de la couture d'un relais
     )
 
     streaming_config = speech.StreamingRecognitionConfig(
         config=config, interim_results=True
     )
 
-    meeting_link = input("Veuillez entrer le lien d'invitation Zoom : ")
-    join_zoom_meeting(meeting_link)
+    capture = None
+    if args.input_file:
+        capture = FakeDevice(args.input_file, SAMPLE_RATE, CHUNK_SIZE, speed=args.speed, jitter=args.jitter)
+    else:
+        meeting_link = input("Veuillez entrer le lien d'invitation Zoom : ")
+        join_zoom_meeting(meeting_link)
 
-    mic_manager = ResumableMicrophoneStream(SAMPLE_RATE, CHUNK_SIZE)
+    mic_manager = ResumableMicrophoneStream(SAMPLE_RATE, CHUNK_SIZE, capture, uplink=uplink)
     print(mic_manager.chunk_size)
     sys.stdout.write(YELLOW)
     sys.stdout.write('\nÉcoute en cours, dites "Quitter" ou "Sortir" pour arrêter.\n\n')
     sys.stdout.write("Fin (ms)       Résultats de la transcription/Statut\n")
     sys.stdout.write("=====================================================\n")
 
-    with mic_manager as stream:
-        while not stream.closed:
-            sys.stdout.write(YELLOW)
-            sys.stdout.write(
-                "\n" + str(STREAMING_LIMIT * stream.restart_counter) + ": NOUVELLE DEMANDE\n"
-            )
-
-            stream.audio_input = []
-            audio_generator = stream.generator()
-
-            requests = (
-                speech.StreamingRecognizeRequest(audio_content=content)
-                for content in audio_generator #"https://zoom.us/j/94009403014?pwd=VsMO2lxmH0Cs9wHXiZgYyTg1ZdqrIn.1"
-            )
-
-            responses = client.streaming_recognize(streaming_config, requests)
-
-            listen_print_loop(responses, stream)
-
-            if stream.result_end_time > 0:
-                stream.final_request_end_time = stream.is_final_end_time
-            stream.result_end_time = 0
-            stream.last_audio_input = []
-            stream.last_audio_input = stream.audio_input
-            stream.audio_input = []
-            stream.restart_counter += 1
-
-            if not stream.last_transcript_was_final:
-                sys.stdout.write("\n")
-            stream.new_stream = True
+    store = TranscriptStore(args.transcript or default_path("google"), "google", language=config.language_code)
+
+    # Les consommateurs en aval ne reçoivent que les mots qui ont changé
+    events = EventWriter(args.word_events) if args.word_events else None
+    # Une phrase par requête : pendant un relais, chaque requête révise la sienne, numérotée à la suite des autres
+    phrases = itertools.count()
+    differs = {}
+
+    def show(corrected_time, transcript, is_final, start_time=None, confidence=None, words=None, source=None):
+        print_result(corrected_time, transcript, is_final)
+        if events:
+            if source not in differs:
+                differs[source] = WordDiffer(phrases)
+            differ = differs[source]
+            words = words if words is not None else text_words(transcript)
+            events.write(differ.finalize(words) if is_final else differ.update(words))
+        if is_final:
+            start_time = corrected_time if start_time is None else start_time
+            store.add(start_time / 1000, corrected_time / 1000, transcript, confidence)
+
+    stop_refresh = threading.Event()
+    if renderer.max_rate:
+        threading.Thread(target=refresh_renderer, args=(stop_refresh,), daemon=True).start()
+
+    with mic_manager as stream, store:
+        if args.handover_overlap > 0:
+            transcribe_handover(client, streaming_config, stream, args.handover_overlap, show)
+        else:
+            transcribe_sequential(client, streaming_config, stream, show)
+
+        stop_refresh.set()
+        renderer.close()
+        renderer.final(stream.gate.report(), YELLOW)
+        renderer.final(str(uplink.stats()), YELLOW)
+        if events:
+            events.close()
+            report = {}
+            for differ in differs.values():
+                for key, value in differ.report().items():
+                    report[key] = report.get(key, 0) + value
+            renderer.final("Événements par mot : " + str(report), YELLOW)
+    metrics.annotate(capture=mic_manager._capture.stats())
+    metrics.stop()
 
 if __name__ == "__main__":
     main()
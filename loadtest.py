@@ -0,0 +1,222 @@
+"""Load test of the live transcription loops with replayed audio.
+
+Runs N concurrent sessions of one live loop (WhisperApp.py, fastwhisper.py
+or ggTranscriptUser.py, each in its own process through transcribe.py), for
+each session count given. Every session replays the same recording through
+its `capture.FakeDevice`, at real time, faster (--speed) or with jittered
+delivery (--jitter). For each session count it reports:
+
+- end-to-end latency percentiles over all sessions, from the ``end_to_end``
+  stage of each session's Chrome trace (see metrics.py);
+- dropped frames: audio the sessions' readers lost to ring overruns, and
+  chunks dropped by fastwhisper's backpressure queue;
+- CPU time and peak RSS per session, from each process's rusage, and the
+  share of the machine's cores in use.
+
+Where latency and drops start climbing with the session count is where the
+engine saturates on this machine. Google sessions run against a local
+fake_speech_server unless --server is given; without --input_file they replay
+coded speech, which the fake server recognizes:
+
+    python loadtest.py google --sessions 1 4 16 64
+    python loadtest.py faster-whisper --input_file meeting.flac --sessions 1 2 4 --jitter 0.05 -- --model base
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+TRANSCRIBE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcribe.py")
+LOOPS = ("whisper", "faster-whisper", "google")
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+
+def write_coded_speech(path, utterances=5):
+    """Write the coded-speech corpus of benchmarks.py as a 16 kHz mono WAV file; return its length in seconds."""
+    from benchmarks import load_corpus
+    audio, _ = load_corpus(None, utterances)
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(audio.tobytes())
+    return len(audio) / SAMPLE_RATE
+
+
+class Session:
+    """One live loop process replaying the recording, with its trace and rusage once it exits."""
+
+    def __init__(self, index, loop, directory, argv):
+        self.index = index
+        self.trace_path = os.path.join(directory, f"session{index}.trace.json")
+        self.log_path = os.path.join(directory, f"session{index}.log")
+        command = [sys.executable, TRANSCRIBE, loop] + list(argv) + [
+            "--trace", self.trace_path, "--transcript", os.path.join(directory, f"session{index}.jsonl")]
+        self.started = time.monotonic()
+        with open(self.log_path, "wb") as log:
+            self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        self.wall = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+
+    def wait(self):
+        if hasattr(os, "wait4"):
+            # The session's own CPU time and peak memory, not those of every child of this process
+            _, status, usage = os.wait4(self.process.pid, 0)
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+            self.cpu_seconds = usage.ru_utime + usage.ru_stime
+            # Kilobytes on Linux, bytes on macOS
+            self.peak_rss_mb = usage.ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+        else:
+            self.process.wait()
+        self.wall = time.monotonic() - self.started
+
+    def error(self):
+        """Last line of the session's output when it failed, else None."""
+        if self.process.returncode == 0:
+            return None
+        with open(self.log_path, encoding="utf-8", errors="replace") as log:
+            lines = log.read().strip().splitlines()
+        return lines[-1] if lines else f"exit code {self.process.returncode}"
+
+    def trace(self):
+        """``(end_to_end latencies in seconds, otherData)`` of the session's trace, empty if it wrote none."""
+        try:
+            with open(self.trace_path, encoding="utf-8") as trace:
+                data = json.load(trace)
+        except (OSError, ValueError):
+            return [], {}
+        latencies = [event["dur"] / 1e6 for event in data["traceEvents"] if event["name"] == "end_to_end"]
+        return latencies, data.get("otherData", {})
+
+
+def run_sessions(loop, count, argv, directory):
+    """Start `count` sessions at once and wait for all of them."""
+    sessions = [Session(index, loop, directory, argv) for index in range(count)]
+    waiters = [threading.Thread(target=session.wait) for session in sessions]
+    for waiter in waiters:
+        waiter.start()
+    for waiter in waiters:
+        waiter.join()
+    return sessions
+
+
+def summarize(loop, sessions, audio_seconds, speed):
+    """One report line for a session count."""
+    latencies, dropped, captured, queue_dropped = [], 0, 0, 0
+    session_p95 = []
+    for session in sessions:
+        session_latencies, other = session.trace()
+        latencies += session_latencies
+        if session_latencies:
+            session_p95.append(_percentile(session_latencies, 95))
+        capture = other.get("capture", {})
+        dropped += sum(capture.get("reader_overruns", []))
+        captured += capture.get("captured_seconds", 0.0) * SAMPLE_RATE
+        queue_dropped += other.get("queue", {}).get("dropped", 0)
+    wall = max(session.wall for session in sessions)
+    cpu = [session.cpu_seconds for session in sessions if session.cpu_seconds is not None]
+    rss = [session.peak_rss_mb for session in sessions if session.peak_rss_mb is not None]
+    errors = [error for error in (session.error() for session in sessions) if error]
+    result = {
+        "loop": loop,
+        "sessions": len(sessions),
+        "failed": len(errors),
+        "latency_p50_s": round(_percentile(latencies, 50), 3),
+        "latency_p95_s": round(_percentile(latencies, 95), 3),
+        "latency_p99_s": round(_percentile(latencies, 99), 3),
+        "worst_session_p95_s": round(max(session_p95, default=float("nan")), 3),
+        "dropped_frames": int(dropped),
+        "dropped_percent": round(100 * dropped / captured, 3) if captured else None,
+        "queue_dropped_chunks": queue_dropped,
+        "cpu_s_per_session": round(float(np.mean(cpu)), 2) if cpu else None,
+        "machine_cpu_percent": round(100 * sum(cpu) / wall / (os.cpu_count() or 1), 1) if cpu else None,
+        "peak_rss_mb_per_session": round(float(np.mean(rss)), 1) if rss else None,
+        # Replays in real time take the audio's length: the rest is start-up and falling behind
+        "wall_s": round(wall, 1),
+        "replay_s": round(audio_seconds / speed, 1) if speed else None,
+    }
+    if errors:
+        result["error"] = errors[0]
+    return result
+
+
+def load_test(loop, session_counts, input_file=None, speed=1.0, jitter=0.0, server=None, extra_args=(),
+              keep=None):
+    """Yield a report for each session count; the sessions' files are kept in `keep` if given."""
+    directory = keep or tempfile.mkdtemp(prefix="loadtest-")
+    os.makedirs(directory, exist_ok=True)
+    if input_file is None:
+        input_file = os.path.join(directory, "coded_speech.wav")
+        audio_seconds = write_coded_speech(input_file)
+    elif input_file.lower().endswith(".wav"):
+        with wave.open(input_file, "rb") as wav:
+            audio_seconds = wav.getnframes() / wav.getframerate()
+    else:
+        import av
+        with av.open(input_file) as container:
+            audio_seconds = float(container.duration or 0) / av.time_base
+
+    fake_server = None
+    argv = ["--input_file", input_file, "--speed", str(speed), "--jitter", str(jitter)]
+    if loop == "google":
+        if server is None:
+            from fake_speech_server import FakeSpeechServicer, start_server
+            # Two requests per session during a handover, each holding a server thread
+            fake_server, _, server = start_server(FakeSpeechServicer(), max_workers=max(64, 4 * max(session_counts)))
+        argv += ["--server", server]
+    try:
+        for count in session_counts:
+            run_directory = os.path.join(directory, f"{count}_sessions")
+            os.makedirs(run_directory, exist_ok=True)
+            sessions = run_sessions(loop, count, argv + list(extra_args), run_directory)
+            yield summarize(loop, sessions, audio_seconds, speed)
+    finally:
+        if fake_server is not None:
+            fake_server.stop(0)
+        if keep is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent replayed sessions of a live transcription loop, with latency, drops, CPU and RSS",
+        epilog="Arguments after -- are passed to every session, e.g. -- --model base --vad webrtc")
+    parser.add_argument("loop", choices=LOOPS, help="Live loop to run: WhisperApp, fastwhisper or ggTranscriptUser")
+    parser.add_argument("--input_file", default=None,
+                        help="Recording replayed by every session, WAV or any format PyAV reads (default: coded speech)")
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 2, 4, 8], help="Concurrent session counts to run")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed relative to real time")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum delay of each replayed chunk, in seconds")
+    parser.add_argument("--server", default=None,
+                        help="host:port of the Speech server for google sessions (default: a local fake server)")
+    parser.add_argument("--keep", default=None, help="Directory where the sessions' traces, logs and transcripts are kept")
+    parser.add_argument("--output", default=None, help="Also append the results to this JSONL file")
+    argv = sys.argv[1:]
+    extra = []
+    if "--" in argv:
+        argv, extra = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = parser.parse_args(argv)
+
+    for result in load_test(args.loop, args.sessions, args.input_file, args.speed, args.jitter, args.server, extra,
+                            args.keep):
+        print(result, flush=True)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as output:
+                output.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""LocalAgreement commit policy for streaming Whisper decoding.
+
+Each decode of the uncommitted audio yields a timestamped word hypothesis.
+Words that two consecutive hypotheses agree on are committed: their audio is
+trimmed from the window and their text becomes the prompt of the next decode,
+so every tick only decodes the uncommitted tail of the phrase.
+"""
+from collections import namedtuple
+
+Word = namedtuple("Word", ["start", "end", "text"])
+
+# Committed text kept as the decoding prompt, in characters
+PROMPT_CHARS = 200
+
+
+def _normalize(text):
+    return text.strip().lower()
+
+
+def words_text(words):
+    """Join Whisper words, which carry their own leading spaces."""
+    return "".join(word.text for word in words).strip()
+
+
+class HypothesisBuffer:
+    """Commits the longest common prefix of consecutive word hypotheses."""
+
+    def __init__(self):
+        self.committed = []
+        self.tentative = []
+        self.last_committed_end = 0.0
+
+    def insert(self, words):
+        """Add a new hypothesis, in phrase time, and return the newly committed words."""
+        new = [word for word in words if word.start > self.last_committed_end - 0.1]
+
+        # Whisper tends to repeat the end of its prompt at the start of the window
+        if new and self.committed and abs(new[0].start - self.last_committed_end) < 1.0:
+            for n in range(min(len(self.committed), len(new), 5), 0, -1):
+                tail = [_normalize(word.text) for word in self.committed[-n:]]
+                head = [_normalize(word.text) for word in new[:n]]
+                if tail == head:
+                    new = new[n:]
+                    break
+
+        agreed = []
+        for previous, current in zip(self.tentative, new):
+            if _normalize(previous.text) != _normalize(current.text):
+                break
+            agreed.append(current)
+
+        self.tentative = new[len(agreed):]
+        self.committed.extend(agreed)
+        if agreed:
+            self.last_committed_end = agreed[-1].end
+        return agreed
+
+    def flush(self):
+        """Commit whatever is still tentative, e.g. at the end of a phrase."""
+        rest = self.tentative
+        self.committed.extend(rest)
+        self.tentative = []
+        if rest:
+            self.last_committed_end = rest[-1].end
+        return rest
+
+
+class StreamingDecoder:
+    """Decodes the uncommitted tail of a `PhraseBuffer` with an openai-whisper model."""
+
+    def __init__(self, model, phrase_buffer, **transcribe_options):
+        self.model = model
+        self.buffer = phrase_buffer
+        self.transcribe_options = transcribe_options
+        self.hypothesis = HypothesisBuffer()
+        self.offset = 0.0
+        self._context = ""
+
+    def prompt(self):
+        """Committed text used to condition the next decode."""
+        text = (self._context + " " + words_text(self.hypothesis.committed)).strip()
+        return text[-PROMPT_CHARS:]
+
+    def decode(self):
+        """Decode the current window and return the words committed by it."""
+        result = self.model.transcribe(
+            self.buffer.window(),
+            word_timestamps=True,
+            condition_on_previous_text=False,
+            initial_prompt=self.prompt() or None,
+            **self.transcribe_options,
+        )
+        words = [
+            Word(self.offset + word["start"], self.offset + word["end"], word["word"])
+            for segment in result["segments"]
+            for word in segment.get("words", [])
+        ]
+        agreed = self.hypothesis.insert(words)
+
+        # Committed audio is never decoded again
+        if agreed:
+            cut = int((self.hypothesis.last_committed_end - self.offset) * self.buffer.sample_rate)
+            cut = max(0, min(cut, len(self.buffer)))
+            self.buffer.consume(cut)
+            self.offset += cut / self.buffer.sample_rate
+        return agreed
+
+    def words(self):
+        """Committed words of the phrase followed by the tentative tail, in phrase time."""
+        return self.hypothesis.committed + self.hypothesis.tentative
+
+    def text(self):
+        """Committed text of the phrase followed by the tentative tail."""
+        return words_text(self.words())
+
+    def finish(self):
+        """Commit the rest of the phrase and start a new one."""
+        self.hypothesis.flush()
+        text = words_text(self.hypothesis.committed)
+        self._context = (self._context + " " + text).strip()[-PROMPT_CHARS:]
+        self.hypothesis = HypothesisBuffer()
+        self.buffer.clear()
+        self.offset = 0.0
+        return text
@@ -0,0 +1,248 @@
+"""Long-lived local server that keeps transcription models loaded.
+
+Loading Whisper from scratch on every launch costs many seconds before the
+first word appears. The server loads each model once, keyed by
+``(engine, name, compute_type, device)`` with "default" and "auto" resolved
+to what they load on this machine, runs a warm-up pass on it, and serves
+any number of capture clients over a Unix socket. `RemoteModel` gives clients
+the same `transcribe` call as the in-process model.
+
+Each message is a 4-byte big-endian header length, a JSON header, then the
+number of payload bytes announced in the header (float32 audio for requests).
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+DEFAULT_SOCKET = "/tmp/transcription-models.sock"
+ENGINES = ("whisper", "faster-whisper")
+SAMPLE_RATE = 16000
+
+
+def load_model(engine, name, compute_type="default", device="auto", warm_up=True, cpu_threads=0):
+    """Load a model in this process and optionally run a warm-up pass on it."""
+    start = time.monotonic()
+    if engine == "whisper":
+        import torch
+        import whisper
+        if cpu_threads:
+            torch.set_num_threads(cpu_threads)
+        model = whisper.load_model(name, device=None if device == "auto" else device)
+    elif engine == "faster-whisper":
+        from faster_whisper import WhisperModel
+        model = WhisperModel(name, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+    loaded = time.monotonic()
+
+    if warm_up:
+        # The first inference pays for kernel selection and memory allocation
+        run_transcribe(engine, model, np.zeros(SAMPLE_RATE, dtype=np.float32), {})
+    print(f"Loaded {engine} {name} ({compute_type}, {device}) in {loaded - start:.1f} s, "
+          f"warm-up {time.monotonic() - loaded:.1f} s", flush=True)
+    return model
+
+
+def _cuda_available(engine):
+    if engine == "faster-whisper":
+        try:
+            import ctranslate2
+            return ctranslate2.get_cuda_device_count() > 0
+        except ImportError:
+            pass
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def resolve_settings(engine, compute_type="default", device="auto"):
+    """The ``(compute_type, device)`` that "default" and "auto" amount to for `engine` on this machine."""
+    if device == "auto":
+        device = "cuda" if _cuda_available(engine) else "cpu"
+    # faster-whisper's converted models are float16, which CTranslate2 runs as float32 on CPU;
+    # openai-whisper loads the same model whatever the compute type, which only sets fp16 per call
+    if compute_type == "default" or engine == "whisper":
+        compute_type = "float16" if device == "cuda" else "float32"
+    return compute_type, device
+
+
+def run_transcribe(engine, model, audio, options):
+    """Transcribe with either engine and return a JSON-serializable result."""
+    if engine == "whisper":
+        result = model.transcribe(audio, **options)
+        segments = [{
+            "start": segment["start"],
+            "end": segment["end"],
+            "text": segment["text"],
+            "avg_logprob": segment.get("avg_logprob"),
+            "words": [{"start": word["start"], "end": word["end"], "word": word["word"],
+                       "probability": word.get("probability")} for word in segment.get("words", [])],
+        } for segment in result["segments"]]
+        return {"text": result["text"], "segments": segments, "language": result.get("language")}
+
+    segments, info = model.transcribe(audio, **options)
+    segments = [{
+        "start": segment.start,
+        "end": segment.end,
+        "text": segment.text,
+        "avg_logprob": segment.avg_logprob,
+        "words": [{"start": word.start, "end": word.end, "word": word.word,
+                   "probability": word.probability} for word in (segment.words or [])],
+    } for segment in segments]
+    return {"text": "".join(segment["text"] for segment in segments), "segments": segments,
+            "language": info.language, "duration": info.duration}
+
+
+def send_message(sock, header, payload=b""):
+    header = dict(header, payload_bytes=len(payload))
+    encoded = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(encoded)) + encoded + payload)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock):
+    (header_length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, header_length).decode("utf-8"))
+    payload = _recv_exact(sock, header.get("payload_bytes", 0))
+    return header, payload
+
+
+class ModelRegistry:
+    """Models held by the server, loaded at most once per key."""
+
+    def __init__(self):
+        self._models = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, engine, name, compute_type, device):
+        # Preloaded specs and client requests spell the same model differently: "auto" is "cuda" here
+        compute_type, device = resolve_settings(engine, compute_type, device)
+        key = (engine, name, compute_type, device)
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            key_lock = self._locks[key]
+        # Loading happens outside the registry lock so other models stay available
+        with key_lock:
+            if key not in self._models:
+                self._models[key] = load_model(engine, name, compute_type, device)
+        return self._models[key], key_lock
+
+    def keys(self):
+        return list(self._models)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        registry = self.server.registry
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                engine = header["engine"]
+                model, model_lock = registry.get(engine, header["model"], header.get("compute_type", "default"),
+                                                 header.get("device", "auto"))
+                audio = np.frombuffer(payload, dtype=np.float32)
+                if engine == "whisper":
+                    # openai-whisper models are not safe to call from several threads
+                    with model_lock:
+                        result = run_transcribe(engine, model, audio, header.get("options", {}))
+                else:
+                    result = run_transcribe(engine, model, audio, header.get("options", {}))
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            send_message(self.request, result)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, registry):
+        self.registry = registry
+        super().__init__(socket_path, _Handler)
+
+
+class RemoteModel:
+    """Client for a model held by the server, with the engine's own `transcribe` signature.
+
+    For ``whisper`` it returns Whisper's result dict; for ``faster-whisper`` a
+    ``(segments, info)`` pair whose items have the same attributes.
+    """
+
+    def __init__(self, engine, name, compute_type="default", device="auto", socket_path=DEFAULT_SOCKET):
+        self.engine = engine
+        self.header = {"engine": engine, "model": name, "compute_type": compute_type, "device": device}
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._lock = threading.Lock()
+
+    def transcribe(self, audio, **options):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        with self._lock:
+            send_message(self._sock, dict(self.header, options=options), audio.tobytes())
+            result, _ = recv_message(self._sock)
+        if "error" in result:
+            raise RuntimeError(f"Model server error: {result['error']}")
+        if self.engine == "whisper":
+            return result
+
+        segments = [SimpleNamespace(**dict(segment, words=[SimpleNamespace(**word) for word in segment["words"]]))
+                    for segment in result["segments"]]
+        info = SimpleNamespace(language=result["language"], duration=result["duration"])
+        return segments, info
+
+    def close(self):
+        self._sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep transcription models loaded for local capture clients")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path to listen on")
+    parser.add_argument("--preload", nargs="*", default=[],
+                        help="Models to load at start, as engine:name[:compute_type[:device]]")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    for spec in args.preload:
+        engine, name, *rest = spec.split(":")
+        if engine not in ENGINES:
+            parser.error(f"Unknown engine in {spec!r}; expected one of {', '.join(ENGINES)}")
+        compute_type = rest[0] if len(rest) > 0 else "default"
+        device = rest[1] if len(rest) > 1 else "auto"
+        registry.get(engine, name, compute_type, device)
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    with ModelServer(args.socket, registry) as server:
+        print(f"Serving {len(registry.keys())} preloaded models on {args.socket}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
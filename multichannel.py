@@ -0,0 +1,261 @@
+"""Multi-channel capture transcribed by one shared faster-whisper model.
+
+A microphone array, or a multi-channel recording, is captured once into the
+shared ring as interleaved frames. Each read is split with `deinterleave`
+into per-channel strided views, and every channel has its own `VadGate`, so
+silence on one microphone never reaches the model whatever the others pick
+up.
+
+Speech accumulates per channel until its utterance ends or `chunk_seconds` of
+it is waiting. The channels ready at that point are transcribed together, one
+clip per channel in a single batched call (faster-whisper's
+`BatchedInferencePipeline`), so the cost follows the channels that are
+speaking, not the ones installed. Segments are tagged with their channel and
+speaker and stored that way in the transcript:
+
+    python multichannel.py --channels 4 --speakers Alice Bob Carol Dan
+"""
+import argparse
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from audio_buffer import PhraseBuffer
+from batch_transcribe import MAX_SEGMENT_SECONDS, pack_windows, window_of
+from capture import deinterleave, open_capture
+from metrics import metrics
+from transcript_store import TranscriptStore, default_path
+from vad import VAD_BACKENDS, VadGate
+from word_events import EventWriter, WordDiffer, segment_words
+
+SAMPLE_RATE = 16000
+
+ChannelSegment = namedtuple("ChannelSegment", "channel speaker start end text confidence words")
+
+
+class BatchTranscriber:
+    """Several clips per call on one faster-whisper model.
+
+    Models without batched inference (a `model_server.RemoteModel`, or
+    faster-whisper before 1.1) transcribe the clips one after the other.
+    """
+
+    def __init__(self, model, beam_size=5, language=None, word_timestamps=False):
+        self.model = model
+        self.options = {"beam_size": beam_size, "word_timestamps": word_timestamps}
+        if language:
+            self.options["language"] = language
+        self._pipeline = None
+        try:
+            from faster_whisper import BatchedInferencePipeline, WhisperModel
+        except ImportError:
+            pass
+        else:
+            if isinstance(model, WhisperModel):
+                self._pipeline = BatchedInferencePipeline(model)
+        self.calls = 0
+        self.clips = 0
+
+    def _one(self, clip):
+        segments, _ = self.model.transcribe(clip, **self.options)
+        return [(segment.start, segment.end, segment.text, float(np.exp(segment.avg_logprob)), segment_words(segment))
+                for segment in segments]
+
+    def transcribe(self, clips):
+        """Segments ``(start, end, text, confidence, words)`` of each float32 clip, in seconds from the clip's start."""
+        self.calls += 1
+        self.clips += len(clips)
+        if self._pipeline is None:
+            return [self._one(clip) for clip in clips]
+
+        # Each clip in a 30 s window of its own: channels never share a decode, and every segment has one channel
+        audio, clip_timestamps = pack_windows(clips)
+        segments, _ = self._pipeline.transcribe(audio, vad_filter=False, batch_size=len(clips),
+                                                clip_timestamps=clip_timestamps, **self.options)
+        out = [[] for _ in clips]
+        for segment in segments:
+            index, start, end = window_of(segment, len(clips))
+            out[index].append((start, end, segment.text, float(np.exp(segment.avg_logprob)),
+                               segment_words(segment, start - segment.start)))
+        return out
+
+
+class _Channel:
+    def __init__(self, index, speaker, rate, max_seconds, vad_backend):
+        self.index = index
+        self.speaker = speaker
+        self.gate = VadGate(rate, backend=vad_backend)
+        self.buffer = PhraseBuffer(rate, max_seconds)
+        self.start = None  # position of the buffered speech in the channel's stream
+
+    def take(self):
+        """``(channel, start, clip)`` of the buffered speech, which is cleared."""
+        clip = (self, self.start, self.buffer.window().copy())
+        self.buffer.clear()
+        self.start = None
+        return clip
+
+
+class MultiChannelTranscriber:
+    """Interleaved frames in, channel-tagged segments out."""
+
+    def __init__(self, transcriber, channels, speakers=None, rate=SAMPLE_RATE, chunk_seconds=5.0,
+                 vad_backend="energy"):
+        if chunk_seconds > MAX_SEGMENT_SECONDS:
+            raise ValueError(f"chunk_seconds must be at most {MAX_SEGMENT_SECONDS:g}, the length of a Whisper window")
+        speakers = list(speakers or [])
+        speakers += [f"channel {index + 1}" for index in range(len(speakers), channels)]
+        self.transcriber = transcriber
+        self.rate = rate
+        self.chunk = int(rate * chunk_seconds)
+        self.channels = [_Channel(index, speakers[index], rate, chunk_seconds, vad_backend)
+                         for index in range(channels)]
+
+    def feed(self, frames):
+        """Gate each channel of interleaved int16 `frames`; transcribe the channels whose speech is ready."""
+        ready = []
+        for channel, samples in zip(self.channels, deinterleave(frames, len(self.channels))):
+            for position, run in channel.gate.process_runs(samples):
+                if channel.start is not None and (position != channel.start + len(channel.buffer)
+                                                  or len(run) > channel.buffer.free):
+                    ready.append(channel.take())
+                if channel.start is None:
+                    channel.start = position
+                channel.buffer.append(run)
+            if channel.start is not None and (not channel.gate.active or len(channel.buffer) >= self.chunk):
+                ready.append(channel.take())
+        return self._transcribe(ready)
+
+    def finish(self):
+        """Transcribe the speech still buffered on every channel."""
+        return self._transcribe([channel.take() for channel in self.channels if channel.start is not None])
+
+    def _transcribe(self, ready):
+        if not ready:
+            return []
+        started = time.monotonic()
+        results = self.transcriber.transcribe([clip for _, _, clip in ready])
+        metrics.observe("inference", started, channels=len(ready))
+        out = []
+        for (channel, start, _), segments in zip(ready, results):
+            offset = start / self.rate
+            for segment_start, segment_end, text, confidence, words in segments:
+                out.append(ChannelSegment(channel.index, channel.speaker, offset + segment_start, offset + segment_end,
+                                          text.strip(), confidence,
+                                          [word._replace(start=offset + word.start, end=offset + word.end)
+                                           for word in words]))
+        return out
+
+    def report(self):
+        return {channel.speaker: channel.gate.report() for channel in self.channels}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-channel live transcription with one shared faster-whisper model")
+    parser.add_argument("--channels", type=int, default=2, help="Number of interleaved input channels")
+    parser.add_argument("--speakers", nargs="*", default=None, help="Speaker name of each channel, in order")
+    parser.add_argument("--device_index", type=int, default=None, help="PortAudio index of the input device")
+    parser.add_argument("--input_file", default=None,
+                        help="Recording with --channels channels replayed instead of the microphone: 16-bit WAV, "
+                             "or FLAC, MP3, ... decoded with PyAV, at any sample rate")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed of --input_file relative to real time (0 replays as fast as it is transcribed)")
+    parser.add_argument("--model", default=None, help="Model size (default: the profile benchmarked on this machine)")
+    parser.add_argument("--device", default=None, help="cpu or cuda (default: profile)")
+    parser.add_argument("--compute_type", default=None, help="int8, float16, ... (default: profile)")
+    parser.add_argument("--language", default=None, help="Language of the speakers (default: detected)")
+    parser.add_argument("--beam_size", type=int, default=5, help="Beam size of the batched decode")
+    parser.add_argument("--chunk_seconds", type=float, default=5.0,
+                        help="Speech buffered on a channel before it is transcribed without waiting for a pause (at most 30)")
+    parser.add_argument("--vad", choices=VAD_BACKENDS, default="energy", help="Voice activity detector of each channel")
+    parser.add_argument("--transcript", default=None,
+                        help="Transcript file (.jsonl) to write; an existing one is continued after its last complete line")
+    parser.add_argument("--word_events", default=None,
+                        help="Write word-level finalized events, tagged with their channel, as JSON lines to this file")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Local port serving per-stage latency histograms (/metrics, Prometheus format)")
+    args = parser.parse_args()
+    if args.chunk_seconds > MAX_SEGMENT_SECONDS:
+        parser.error(f"--chunk_seconds must be at most {MAX_SEGMENT_SECONDS:g}")
+    if args.word_events == "-":
+        parser.error("--word_events - would mix JSON with the transcript printed on stdout; give a file or FIFO")
+    metrics.start(args.metrics_port)
+
+    from faster_whisper import WhisperModel
+
+    from compute_profile import settings_for
+    try:
+        settings = settings_for("faster-whisper", args.model, args.device, args.compute_type)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Profile: " + str(settings))
+    model = WhisperModel(settings["model"], device=settings["device"], compute_type=settings["compute_type"],
+                         cpu_threads=settings["cpu_threads"])
+    events = EventWriter(args.word_events) if args.word_events else None
+    transcriber = MultiChannelTranscriber(BatchTranscriber(model, args.beam_size, args.language, events is not None),
+                                          args.channels, args.speakers, chunk_seconds=args.chunk_seconds,
+                                          vad_backend=args.vad)
+    # Every segment is final: one finalized phrase per segment, numbered per channel
+    differs = [WordDiffer() for _ in range(args.channels)]
+
+    device = open_capture(SAMPLE_RATE, 1024, args.device_index, args.input_file, args.speed, args.channels)
+    reader = device.reader(max_read=SAMPLE_RATE * args.channels * 2)
+    device.start()
+    store = TranscriptStore(args.transcript or default_path("faster-whisper"), "faster-whisper",
+                            model=settings["model"], channels=args.channels, speakers=args.speakers)
+
+    # Transcription runs beside the capture loop, so a slow batch never makes the reader fall behind
+    batches = queue.Queue()
+    results = queue.Queue()
+
+    def transcribe():
+        for frames in iter(batches.get, None):
+            results.put(transcriber.feed(frames))
+        results.put(transcriber.finish())
+        results.put(None)
+
+    worker = threading.Thread(target=transcribe, daemon=True)
+    worker.start()
+
+    def show(segments):
+        for segment in segments:
+            if segment.text:
+                print(f"[{segment.start:7.1f}s] {segment.speaker}: {segment.text}", flush=True)
+                store.add(segment.start, segment.end, segment.text, segment.confidence,
+                          channel=segment.channel, speaker=segment.speaker)
+                if events:
+                    events.write(differs[segment.channel].finalize(segment.words), channel=segment.channel,
+                                 speaker=segment.speaker)
+
+    try:
+        while True:
+            frames = reader.read_available(min_samples=SAMPLE_RATE // 10 * args.channels, timeout=0.5)
+            if frames is None:
+                if device.closed:
+                    break
+            else:
+                batches.put(frames.copy())
+            while not results.empty():
+                show(results.get())
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        device.stop()
+        batches.put(None)
+        for segments in iter(results.get, None):
+            show(segments)
+        store.close()
+        if events:
+            events.close()
+        metrics.stop()
+        print(f"Transcript: {store.path} ({store.segments_written} segments)")
+        print(f"Batched calls: {transcriber.transcriber.calls}, clips: {transcriber.transcriber.clips}")
+        for speaker, report in transcriber.report().items():
+            print(f"{speaker}: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Bounded hand-off between a capture thread and inference workers."""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+BACKPRESSURE_POLICIES = ("drop_oldest", "merge", "block")
+
+
+class ChunkQueue:
+    """Bounded FIFO of audio chunks with a configurable backpressure policy.
+
+    When the queue is full, `put` either drops the oldest queued chunk
+    (``drop_oldest``), appends the new audio to the newest queued chunk
+    (``merge``) or waits for a worker to take one (``block``). A merge that
+    would make a chunk longer than `max_merged` (as measured by `size`)
+    drops the oldest chunk instead. Chunks are numbered as workers take them,
+    so results can be put back in order.
+    """
+
+    def __init__(self, maxsize=4, policy="drop_oldest", merge=np.concatenate, max_merged=None, size=len):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._merge = merge
+        self.max_merged = max_merged
+        self._size = size
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._next_seq = 0
+        self.put_count = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def put(self, item):
+        """Queue a chunk, applying the backpressure policy if the queue is full."""
+        with self._cond:
+            self.put_count += 1
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest" or self.policy == "merge" and self.max_merged is not None and (
+                        self._size(self._items[-1]) + self._size(item) > self.max_merged):
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == "merge":
+                    self._items[-1] = self._merge((self._items[-1], item))
+                    self.merged += 1
+                    return
+                else:
+                    start = time.monotonic()
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    self.blocked_seconds += time.monotonic() - start
+            if self._closed:
+                return
+            self._items.append(item)
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Return ``(seq, chunk)``, or None once the queue is closed and empty."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            seq = self._next_seq
+            self._next_seq += 1
+            self._cond.notify_all()
+            return seq, item
+
+    def close(self):
+        """Wake every waiting thread; queued chunks can still be drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": len(self._items),
+                "max_depth": self.max_depth,
+                "put": self.put_count,
+                "dropped": self.dropped,
+                "merged": self.merged,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+            }
@@ -0,0 +1,138 @@
+"""Streaming sample-rate and channel conversion for capture devices.
+
+Many devices only run at 44.1 or 48 kHz, often in stereo, while every
+transcription path here works on 16 kHz mono int16. `FormatConverter` takes
+the device's interleaved int16 frames as they arrive and returns frames in
+the target format: channels are downmixed (or kept, one resampler each), then
+resampled by a `StreamingResampler`.
+
+The resampler is a polyphase FIR filter for the rational ratio up/down
+(16000/48000 = 1/3, 16000/44100 = 160/441): each output sample is the dot
+product of `taps` input samples with one phase of a Kaiser-windowed sinc
+low-pass, computed a chunk at a time as one matrix product over a strided
+view of the input. The input the next output still needs is kept between
+chunks, so chunk boundaries leave no trace. The converter's buffers are
+allocated once for the largest chunk: a call writes into them and returns a
+view, valid until the next call, like `capture.RingReader.read`.
+"""
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+INT16_SCALE = 32768.0
+
+
+def lowpass(up, down, taps=32, rolloff=0.9, beta=8.0):
+    """Prototype filter at the upsampled rate, ``up * taps`` coefficients with a gain of `up`."""
+    cutoff = rolloff * 0.5 / max(up, down)  # cycles per upsampled sample
+    length = up * taps
+    t = np.arange(length) - (length - 1) / 2
+    return 2 * cutoff * up * np.sinc(2 * cutoff * t) * np.kaiser(length, beta)
+
+
+class StreamingResampler:
+    """Resample a mono float32 stream chunk by chunk, keeping the filter history between chunks.
+
+    Outputs come in whole cycles of `up` samples, which read the input `down`
+    samples further each: the last partial cycle of a chunk waits for the
+    next one (at most `down` input samples, 10 ms from 44.1 kHz).
+    """
+
+    def __init__(self, in_rate, out_rate, max_chunk=48000, taps=32):
+        divisor = math.gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps = taps
+        self.max_chunk = max_chunk
+        if taps * self.up <= self.down:
+            raise ValueError(f"{taps} taps are too few to downsample by {self.down}/{self.up}")
+
+        # Output q*up + r is the dot product of filter phase (r*down) % up with the `taps` inputs
+        # ending at q*down + (r*down)//up: one cycle of outputs is one (span x up) matrix product
+        phases = lowpass(self.up, self.down, taps)
+        offsets = np.arange(self.up) * self.down // self.up
+        self.span = int(offsets[-1]) + taps
+        self._matrix = np.zeros((self.span, self.up), dtype=np.float32)
+        for r, offset in enumerate(offsets):
+            # Oldest input first, so the newest sample meets the first coefficient of the phase
+            self._matrix[offset:offset + taps, r] = phases[r * self.down % self.up::self.up][::-1]
+        # One phase per cycle is a plain dot product, faster through einsum than through BLAS
+        self._einsum = self.up < 8
+
+        max_cycles = max_chunk // self.down + 2
+        self._input = np.zeros(self.span + self.down + max_chunk, dtype=np.float32)
+        self._held = taps - 1  # samples at the front of `_input` not consumed yet
+        self._base = -(taps - 1)  # absolute input index of `_input[0]`: history starts as silence
+        self._cycle = 0  # next output cycle
+        self._output = np.empty(max_cycles * self.up, dtype=np.float32)
+
+    def input_buffer(self, n):
+        """Where the caller writes the next `n` input samples before calling `process(n)`."""
+        if n > self.max_chunk:
+            raise ValueError(f"Chunk of {n} samples is larger than max_chunk ({self.max_chunk})")
+        return self._input[self._held:self._held + n]
+
+    def process(self, n):
+        """Resample the `n` samples written to `input_buffer(n)`; return a view of the output samples."""
+        end = self._held + n
+        last = self._base + end - 1  # absolute index of the newest input sample
+        # Cycle q reads inputs q*down - (taps-1) to q*down - (taps-1) + span - 1
+        cycles = max((last - self.span + self.taps) // self.down - self._cycle + 1, 0)
+        start = self._cycle * self.down - (self.taps - 1) - self._base
+        item = self._input.itemsize
+        windows = as_strided(self._input[start:], shape=(cycles, self.span), strides=(self.down * item, item))
+        output = self._output[:cycles * self.up].reshape(cycles, self.up)
+        if self._einsum:
+            np.einsum("cs,su->cu", windows, self._matrix, out=output)
+        else:
+            np.matmul(windows, self._matrix, out=output)
+        self._cycle += cycles
+
+        # Keep only the input the next cycle still needs
+        keep_from = start + cycles * self.down
+        self._held = end - keep_from
+        self._input[:self._held] = self._input[keep_from:end]
+        self._base += keep_from
+        return output.reshape(-1)
+
+
+class FormatConverter:
+    """Interleaved int16 frames of a device converted to the target rate and channel count.
+
+    `out_channels` is 1 (the device's channels are averaged) or the device's
+    own channel count (each channel is resampled on its own).
+    """
+
+    def __init__(self, in_rate, in_channels, out_rate=16000, out_channels=1, max_frames=48000, taps=32):
+        if out_channels not in (1, in_channels):
+            raise ValueError(f"Cannot convert {in_channels} channel(s) to {out_channels}")
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.out_rate = out_rate
+        self.out_channels = out_channels
+        self.max_frames = max_frames
+        self._resamplers = [StreamingResampler(in_rate, out_rate, max_frames, taps) for _ in range(out_channels)]
+        self._output = np.empty((len(self._resamplers[0]._output), out_channels), dtype=np.int16)
+
+    def process(self, samples):
+        """Convert interleaved int16 `samples`; return a view of the interleaved int16 output."""
+        frames = samples[:len(samples) // self.in_channels * self.in_channels].reshape(-1, self.in_channels)
+        produced = 0
+        for channel, resampler in enumerate(self._resamplers):
+            target = resampler.input_buffer(len(frames))
+            if self.out_channels == 1 and self.in_channels > 1:
+                # Channel by channel: summing along a short axis is several times slower
+                np.copyto(target, frames[:, 0], casting="unsafe")
+                for other in range(1, self.in_channels):
+                    np.add(target, frames[:, other], out=target, casting="unsafe")
+                target *= np.float32(1.0 / (self.in_channels * INT16_SCALE))
+            else:
+                np.multiply(frames[:, channel], np.float32(1.0 / INT16_SCALE), out=target)
+            output = resampler.process(len(frames))
+            np.clip(output, -1.0, 32767 / INT16_SCALE, out=output)
+            output *= INT16_SCALE
+            np.rint(output, out=output)
+            produced = len(output)
+            np.copyto(self._output[:produced, channel], output, casting="unsafe")
+        return self._output[:produced].reshape(-1)
@@ -0,0 +1,26 @@
+"""Google Speech clients, for the API or for a local plain-text gRPC server.
+
+The live loop, the asyncio client and the engine benchmarks all talk either
+to Google or to a server such as fake_speech_server.py at ``host:port``.
+google.cloud.speech and grpc are imported only once a client is made.
+"""
+
+
+def make_client(address=None):
+    """`SpeechClient` for Google, or for the plain-text gRPC server at `address`."""
+    from google.cloud import speech
+    if address is None:
+        return speech.SpeechClient()
+    import grpc
+    from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+    return speech.SpeechClient(transport=SpeechGrpcTransport(channel=grpc.insecure_channel(address)))
+
+
+def make_async_client(address=None):
+    """`SpeechAsyncClient` for Google, or for the plain-text gRPC server at `address`."""
+    from google.cloud import speech
+    if address is None:
+        return speech.SpeechAsyncClient()
+    import grpc
+    from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport
+    return speech.SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(address)))
@@ -0,0 +1,101 @@
+"""Terminal output shared by the live transcription loops.
+
+Final lines are written once and scroll away; the interim tail line is
+rewritten in place with ANSI cursor control, appending only the new
+characters when the text just grew. Interim refreshes are capped at
+`max_rate` per second, and each update goes out as one write and one flush.
+The cost of an update does not depend on how long the session has been
+running: nothing already finished is ever redrawn.
+
+When the output is not a terminal, interim results are skipped and no
+escape codes are written.
+"""
+import shutil
+import sys
+import threading
+import time
+
+CLEAR_TO_END = "\033[K"
+RESET = "\033[0m"
+
+
+class LiveRenderer:
+    def __init__(self, stream=None, max_rate=10.0):
+        self._stream = stream
+        self.max_rate = max_rate
+        self._shown = ""  # interim text currently on the tail line
+        self._shown_color = ""
+        self._pending = None  # newest interim (text, color) not drawn yet because of the rate cap
+        self._last_draw = 0.0
+        self._lock = threading.Lock()
+        self.interim_updates = 0
+        self.interim_draws = 0
+
+    @property
+    def out(self):
+        # Resolved on every write so redirect_stdout and replaced streams are honoured
+        return self._stream or sys.stdout
+
+    def _is_terminal(self):
+        isatty = getattr(self.out, "isatty", None)
+        return bool(isatty and isatty())
+
+    def _fit(self, text):
+        """The end of `text`, cut to the terminal width so the tail line never wraps."""
+        width = shutil.get_terminal_size().columns - 1
+        return text if len(text) <= width else "…" + text[-(width - 1):]
+
+    def _write(self, data):
+        out = self.out
+        out.write(data)
+        out.flush()
+
+    def _draw(self, text, color):
+        text = self._fit(text)
+        if self._shown and color == self._shown_color and text.startswith(self._shown):
+            data = text[len(self._shown):]
+        else:
+            data = "\r" + color + text + CLEAR_TO_END
+        if data:
+            self._write(data)
+        self._shown, self._shown_color = text, color
+        self._pending = None
+        self._last_draw = time.monotonic()
+        self.interim_draws += 1
+
+    def interim(self, text, color=""):
+        """Show `text` on the tail line, at most `max_rate` times per second."""
+        with self._lock:
+            self.interim_updates += 1
+            if not self._is_terminal():
+                return
+            if self.max_rate and time.monotonic() - self._last_draw < 1.0 / self.max_rate:
+                self._pending = (text, color)
+                return
+            self._draw(text, color)
+
+    def final(self, text, color=""):
+        """Replace the tail line with a finished line."""
+        with self._lock:
+            self._pending = None
+            if self._is_terminal():
+                self._write("\r" + color + text + CLEAR_TO_END + (RESET if color else "") + "\n")
+            else:
+                self._write(text + "\n")
+            self._shown = self._shown_color = ""
+
+    def refresh(self):
+        """Draw an interim update held back by the rate cap, if it is due."""
+        with self._lock:
+            if self._pending is not None and (
+                    not self.max_rate or time.monotonic() - self._last_draw >= 1.0 / self.max_rate):
+                self._draw(*self._pending)
+
+    def close(self):
+        """Draw the last held-back update and end the tail line."""
+        with self._lock:
+            if self._pending is not None:
+                self._draw(*self._pending)
+            if self._shown:
+                self._write((RESET if self._shown_color else "") + "\n")
+                self._shown = self._shown_color = ""
@@ -0,0 +1,46 @@
+"""Replay of recordings through capture.FakeDevice, as the live loops read them."""
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture import FakeDevice  # noqa: E402
+from fastwhisper import record_chunk  # noqa: E402
+
+RATE = 16000
+
+
+def write_wav(path, samples, rate=RATE):
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+
+@pytest.mark.parametrize("speed", [0, 8.0])
+def test_replayed_file_is_read_to_its_end(tmp_path, speed):
+    # 2.5 s: the last one-second chunk is only half full when the file ends
+    samples = (np.arange(int(2.5 * RATE)) % 1000).astype(np.int16)
+    path = tmp_path / "short.wav"
+    write_wav(path, samples)
+
+    device = FakeDevice(str(path), RATE, 1024, speed=speed)
+    reader = device.reader()
+    device.start()
+    chunks = []
+    while True:
+        chunk = record_chunk(reader, chunk_length=1)
+        if chunk is None:
+            break
+        chunks.append(chunk)
+    device.stop()
+
+    assert [len(audio) for audio, _ in chunks] == [RATE, RATE, RATE // 2]
+    assert [marks for _, marks in chunks] == [[(0, 0)], [(0, RATE)], [(0, 2 * RATE)]]
+    audio = np.concatenate([audio for audio, _ in chunks])
+    np.testing.assert_array_equal(np.round(audio * 32768.0).astype(np.int16), samples)
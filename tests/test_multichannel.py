@@ -0,0 +1,97 @@
+"""Channel tags of multichannel.py with a stand-in for faster-whisper's batched pipeline."""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_transcribe  # noqa: E402
+from multichannel import BatchTranscriber, MultiChannelTranscriber  # noqa: E402
+
+RATE = 16000
+
+
+class FakePipeline:
+    """Merges adjacent clip timestamps into windows of up to 30 s, as faster-whisper 1.2.0 does.
+
+    Each window decodes to one segment over its non-silent samples, named
+    after the loudest of them: a window holding two channels gets one name.
+    """
+
+    def __init__(self):
+        self.windows = 0
+
+    def transcribe(self, audio, clip_timestamps, **options):
+        windows = []
+        for clip in clip_timestamps:
+            if windows and clip["end"] - windows[-1][0] <= 30:
+                windows[-1][1] = clip["end"]
+            else:
+                windows.append([clip["start"], clip["end"]])
+        self.windows += len(windows)
+        segments = []
+        for start, end in windows:
+            window = audio[int(start * RATE):int(end * RATE)]
+            loud = np.flatnonzero(np.abs(window) > 0.01)
+            if len(loud):
+                text = f" {np.abs(window).max():.1f}"
+                first, last = start + loud[0] / RATE, start + (loud[-1] + 1) / RATE
+                segments.append(SimpleNamespace(start=first, end=last, text=text, avg_logprob=0.0,
+                                                words=[SimpleNamespace(start=first, end=last, word=text)]))
+        return iter(segments), None
+
+
+@pytest.fixture
+def transcriber(monkeypatch):
+    monkeypatch.setattr(batch_transcribe, "_timestamp_scale", lambda: 1)
+    transcriber = BatchTranscriber(model=None)
+    transcriber._pipeline = FakePipeline()
+    return transcriber
+
+
+def tone(seconds, amplitude):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def test_batch_keeps_each_clip_in_its_own_window(transcriber):
+    clips = [tone(2.0, 0.2), tone(1.0, 0.5), tone(3.0, 0.8)]
+    results = transcriber.transcribe(clips)
+    assert transcriber._pipeline.windows == 3
+    assert [[text for _, _, text, _, _ in segments] for segments in results] == [[" 0.2"], [" 0.5"], [" 0.8"]]
+    for clip, segments in zip(clips, results):
+        (start, end, _, _, words), = segments
+        assert start == pytest.approx(0.0, abs=0.01)
+        assert end == pytest.approx(len(clip) / RATE, abs=0.01)
+        assert [(word.start, word.end) for word in words] == [(start, end)]
+
+
+def test_segments_are_tagged_with_their_channel(transcriber):
+    # Both channels speak at once, at their own level: their clips are transcribed in the same call
+    seconds = 6.0
+    channels = np.zeros((int(seconds * RATE), 2), dtype=np.float32)
+    channels[RATE:2 * RATE, 0] = tone(1.0, 0.3)
+    channels[RATE + RATE // 2:2 * RATE, 1] = tone(0.5, 0.6)
+    frames = (channels * 32767).astype(np.int16).reshape(-1)
+
+    multichannel = MultiChannelTranscriber(transcriber, 2, ["Alice", "Bob"])
+    segments = []
+    for start in range(0, len(frames), 2 * 1600):
+        segments += multichannel.feed(frames[start:start + 2 * 1600])
+    segments += multichannel.finish()
+
+    assert [(segment.channel, segment.speaker, segment.text) for segment in segments] == [
+        (0, "Alice", "0.3"), (1, "Bob", "0.6")]
+    assert segments[0].start == pytest.approx(1.0, abs=0.05)
+    assert segments[1].start == pytest.approx(1.5, abs=0.05)
+    assert [word.text for segment in segments for word in segment.words] == ["0.3", "0.6"]
+    assert segments[1].words[0].start == segments[1].start
+    assert transcriber.calls == 1
+
+
+def test_chunks_longer_than_a_window_are_rejected(transcriber):
+    with pytest.raises(ValueError):
+        MultiChannelTranscriber(transcriber, 2, chunk_seconds=45.0)
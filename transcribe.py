@@ -0,0 +1,75 @@
+"""One command line for every transcription tool in this directory.
+
+    python transcribe.py <command> [options]
+    python transcribe.py google --input_file meeting.wav --encoding ogg_opus
+    python transcribe.py devices
+
+Each command runs the `main` of its module with the remaining arguments, so
+``python transcribe.py whisper --help`` shows WhisperApp.py's own options.
+Nothing is imported before a command is chosen, and the modules import their
+heavy dependencies (torch, faster_whisper, google.cloud.speech) only once
+they are about to use them: help and device listings start in a fraction of
+a second. ``python benchmarks.py startup`` keeps track of it.
+"""
+import argparse
+import importlib
+import sys
+
+# command: (module, entry point, description)
+COMMANDS = {
+    "whisper": ("WhisperApp", "transcribe_audio", "Live transcription with openai-whisper"),
+    "faster-whisper": ("fastwhisper", "main2", "Live transcription with faster-whisper"),
+    "google": ("ggTranscriptUser", "main", "Live transcription of a meeting with Google Speech streaming"),
+    "google-streams": ("async_speech", "main", "Several audio streams transcribed concurrently with Google Speech"),
+    "multichannel": ("multichannel", "main", "Multi-channel capture transcribed by one faster-whisper model"),
+    "batch": ("batch_transcribe", "main", "Batched offline transcription of a directory of recordings"),
+    "devices": ("transcribe", "list_devices", "List the audio input devices"),
+    "profile": ("compute_profile", "main", "Pick and cache the fastest compute profile for this machine"),
+    "model-server": ("model_server", "main", "Keep transcription models loaded for local clients"),
+    "fake-server": ("fake_speech_server", "main", "Fake Google Speech streaming server for local tests"),
+    "export": ("transcript_store", "main", "Export a stored transcript as subtitles or text"),
+    "loadtest": ("loadtest", "main", "Concurrent replayed sessions of a live loop under load"),
+    "benchmark": ("benchmarks", "main", "Benchmarks of the live transcription paths"),
+}
+
+
+def list_devices():
+    parser = argparse.ArgumentParser(prog="transcribe devices", description=COMMANDS["devices"][2])
+    parser.add_argument("--name", default=None, help="Only the devices whose name contains this text")
+    args = parser.parse_args()
+
+    from capture import list_input_devices
+    for index, name in list_input_devices():
+        if args.name is None or args.name in name:
+            print(f"{index}: {name}")
+
+
+def run(command, argv):
+    """Run `command`'s entry point as if its module had been started with `argv`."""
+    module, function, _ = COMMANDS[command]
+    sys.argv = [f"transcribe {command}"] + list(argv)
+    if module == "transcribe":
+        # Commands of this file: importing it again as a module would be pointless
+        entry = globals()[function]
+    else:
+        entry = getattr(importlib.import_module(module), function)
+    return entry()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return run(argv[0], argv[1:])
+
+    width = max(len(command) for command in COMMANDS)
+    parser = argparse.ArgumentParser(
+        prog="transcribe", formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Speech transcription tools", epilog="commands:\n" + "\n".join(
+            f"  {command:<{width}}  {description}" for command, (_, _, description) in COMMANDS.items()))
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="see below; <command> --help for its options")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main()
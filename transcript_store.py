@@ -0,0 +1,207 @@
+"""Append-only transcript store shared by every engine.
+
+A transcript is a JSON Lines file. Each run of a script first writes a
+``session`` record (engine, model, start time), then one ``segment`` record
+per final result, with its start and end in seconds, text, confidence and
+engine, and periodic ``checkpoint`` records. Every record is flushed at once
+and fsynced in batches, every `sync_every` records or `sync_interval`
+seconds, whichever comes first, so a crash loses at most that window.
+
+Reopening a transcript after a crash drops a last line the crash cut short
+and appends after the last complete record; the times of the new run follow
+those of the previous one. SRT and WebVTT exports are generated from the
+stored segments on demand, one segment at a time:
+
+    python transcript_store.py transcripts/whisper-20240101-120000.jsonl --format srt
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+TRANSCRIPT_DIR = "transcripts"
+EXPORT_FORMATS = ("srt", "vtt", "txt")
+
+
+def default_path(engine):
+    """New transcript file for a session of `engine`, named after its start time."""
+    return os.path.join(TRANSCRIPT_DIR, f"{engine}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+
+
+def _records(file):
+    """Yield ``(end_offset, record)`` up to the first line that is incomplete or not JSON."""
+    offset = 0
+    for line in file:
+        if not line.endswith(b"\n"):
+            return
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        offset += len(line)
+        yield offset, record
+
+
+class TranscriptStore:
+    def __init__(self, path, engine, sync_every=20, sync_interval=1.0, checkpoint_interval=30.0, **metadata):
+        self.path = path
+        self.engine = engine
+        self.sync_every = sync_every
+        self.checkpoint_interval = checkpoint_interval
+        self.segments_written = 0
+        self.offset = 0.0  # end of the previous runs, added to the times of this one
+        self.recovered = None  # last checkpoint found when reopening an existing transcript
+        self.last_end = 0.0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self._recover()
+        self._file = open(path, "a", encoding="utf-8")
+        self._session_start = self._file.tell()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._checkpointed = self.segments_written
+
+        with self._lock:
+            self._write({"type": "session", "engine": engine, "started": datetime.now().isoformat(timespec="seconds"),
+                         "offset": self.offset, **metadata})
+        self._closed = threading.Event()
+        self._syncer = threading.Thread(target=self._sync_loop, args=(sync_interval,), daemon=True)
+        self._syncer.start()
+
+    def _recover(self):
+        """Cut a last line left incomplete by a crash and resume the times and counts where the file stops."""
+        with open(self.path, "rb") as file:
+            good = 0
+            for good, record in _records(file):
+                if record.get("type") == "segment":
+                    self.segments_written += 1
+                    self.offset = max(self.offset, record["end"])
+                elif record.get("type") == "checkpoint":
+                    self.recovered = record
+        if good < os.path.getsize(self.path):
+            with open(self.path, "r+b") as file:
+                file.truncate(good)
+        self.last_end = self.offset
+
+    def _write(self, record):
+        # Called with self._lock held, so the counters always match the lines written
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def _sync_loop(self, interval):
+        last_checkpoint = time.monotonic()
+        while not self._closed.wait(interval):
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                last_checkpoint = time.monotonic()
+                self.checkpoint()
+            with self._lock:
+                if self._unsynced:
+                    self._sync()
+
+    def add(self, start, end, text, confidence=None, **metadata):
+        """Store one final segment; `start` and `end` are seconds since the start of this run."""
+        text = text.strip()
+        if not text:
+            return
+        record = {"type": "segment", "start": round(self.offset + start, 3), "end": round(self.offset + end, 3),
+                  "text": text, "confidence": None if confidence is None else round(float(confidence), 3),
+                  "engine": self.engine, **metadata}
+        with self._lock:
+            self.last_end = max(self.last_end, record["end"])
+            self.segments_written += 1
+            self._write(record)
+
+    def checkpoint(self, **state):
+        """Record how far the transcript got, synced to disk immediately."""
+        with self._lock:
+            if self.segments_written == self._checkpointed and not state:
+                return
+            self._checkpointed = self.segments_written
+            self._write({"type": "checkpoint", "segments": self.segments_written, "end": self.last_end,
+                         "time": datetime.now().isoformat(timespec="seconds"), **state})
+            self._sync()
+
+    def segments(self, this_session=True):
+        """Read back the stored segments of this run (or of the whole file), lazily."""
+        with self._lock:
+            self._file.flush()
+        return read_segments(self.path, self._session_start if this_session else 0)
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self.checkpoint()
+        self._closed.set()
+        self._syncer.join()
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def read_segments(path, start=0):
+    """Yield the segment records of a transcript file from byte offset `start`."""
+    with open(path, "rb") as file:
+        file.seek(start)
+        for _, record in _records(file):
+            if record.get("type") == "segment":
+                yield record
+
+
+def format_timestamp(seconds, separator=","):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def subtitle_lines(segments, fmt="srt"):
+    """Yield the lines of an SRT or WebVTT file, one segment at a time."""
+    separator = "," if fmt == "srt" else "."
+    if fmt == "vtt":
+        yield "WEBVTT\n\n"
+    for index, segment in enumerate(segments, 1):
+        if fmt == "srt":
+            yield f"{index}\n"
+        yield (f"{format_timestamp(segment['start'], separator)} --> "
+               f"{format_timestamp(segment['end'], separator)}\n{segment['text']}\n\n")
+
+
+def export(path, output_path=None, fmt="srt"):
+    """Write the transcript at `path` as SRT, WebVTT or plain text; return the output path."""
+    output_path = output_path or os.path.splitext(path)[0] + "." + fmt
+    segments = read_segments(path)
+    lines = (segment["text"] + "\n" for segment in segments) if fmt == "txt" else subtitle_lines(segments, fmt)
+    with open(output_path, "w", encoding="utf-8") as output:
+        output.writelines(lines)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a stored transcript as subtitles or text")
+    parser.add_argument("transcript", help="Transcript file (.jsonl)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="srt", help="Output format")
+    parser.add_argument("--output", default=None, help="Output file (default: next to the transcript)")
+    args = parser.parse_args()
+    print(export(args.transcript, args.output, args.format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Compressed audio uplink for the Google streaming requests.
+
+LINEAR16 at 16 kHz is 256 kbit/s per stream. An `Uplink` can also send FLAC,
+which is lossless and roughly halves that, or OGG_OPUS at a chosen bitrate,
+24 kbit/s by default. The request's `RecognitionConfig.encoding` has to
+match: see `recognition_encoding`.
+
+Each request gets its own ffmpeg process and so its own stream headers. A
+worker thread pulls the request's PCM chunks and writes them to the
+encoder. The request iterates over the encoded bytes as ffmpeg flushes them:
+an Ogg page per 20 ms Opus frame, or a FLAC frame per 100 ms. The capture
+callback only ever writes to the ring, so nothing the encoder does can hold
+it up.
+
+ffmpeg must be on the PATH for FLAC and OGG_OPUS; LINEAR16 is passed through.
+"""
+import os
+import shutil
+import subprocess
+import threading
+
+ENCODINGS = ("linear16", "flac", "ogg_opus")
+OPUS_BITRATE = 24000
+READ_SIZE = 65536
+
+_FFMPEG = ("ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin")
+_FORMATS = {"flac": "flac", "ogg_opus": "ogg"}
+
+
+def _require_ffmpeg(encoding):
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"ffmpeg is needed to send {encoding.upper()} audio; install it or use linear16")
+
+
+def encoder_command(encoding, rate, bitrate=OPUS_BITRATE):
+    """ffmpeg command reading mono s16le PCM on stdin and writing `encoding` on stdout."""
+    # Without probing, ffmpeg starts encoding at once instead of after seconds of input
+    command = list(_FFMPEG) + ["-probesize", "32", "-analyzeduration", "0",
+                               "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0"]
+    if encoding == "ogg_opus":
+        command += ["-c:a", "libopus", "-b:a", str(bitrate), "-application", "voip", "-vbr", "constrained", "-frame_duration", "20",
+                    "-page_duration", "20000"]
+    else:
+        command += ["-c:a", "flac", "-frame_size", str(rate // 10)]
+    # Write every packet out at once instead of filling ffmpeg's 32 KB output buffer first
+    return command + ["-flush_packets", "1", "-f", _FORMATS[encoding], "pipe:1"]
+
+
+def decoder_command(encoding, rate):
+    """ffmpeg command decoding `encoding` on stdin to mono s16le PCM at `rate` on stdout."""
+    return list(_FFMPEG) + ["-probesize", "32", "-analyzeduration", "0", "-f", _FORMATS[encoding], "-i", "pipe:0",
+                            "-flush_packets", "1", "-f", "s16le", "-ar", str(rate), "-ac", "1", "pipe:1"]
+
+
+def recognition_encoding(encoding):
+    """The `RecognitionConfig.AudioEncoding` of an uplink encoding name."""
+    from google.cloud import speech
+    return getattr(speech.RecognitionConfig.AudioEncoding, encoding.upper())
+
+
+class _Source:
+    """The PCM chunks of one request, pulled by one thread and closed from another."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __iter__(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                chunk = next(self._chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        """Stop reading the chunks: once this returns, none is ever pulled again."""
+        with self._lock:
+            self._closed = True
+            close = getattr(self._chunks, "close", None)
+            if close is not None:
+                close()
+
+
+class _Passthrough:
+    def __init__(self, chunks, uplink):
+        self._source = _Source(chunks)
+        self._uplink = uplink
+
+    def __iter__(self):
+        for chunk in self._source:
+            self._uplink._count(len(chunk), len(chunk), 0.0)
+            yield chunk
+
+    def close(self):
+        self._source.close()
+
+
+class EncodedStream:
+    """The chunks of one request, encoded by an ffmpeg process fed from a worker thread."""
+
+    def __init__(self, chunks, command, uplink):
+        self._uplink = uplink
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, bufsize=0)
+        self._source = _Source(chunks)
+        self._reap_lock = threading.Lock()
+        self._reaped = False
+        self._bytes_in = 0
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    def _feed(self):
+        try:
+            for chunk in self._source:
+                self._bytes_in += len(chunk)
+                self._process.stdin.write(chunk)
+        except OSError:
+            # The encoder was stopped under us
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+
+    def __iter__(self):
+        while True:
+            try:
+                data = self._process.stdout.read(READ_SIZE)
+            except ValueError:
+                # Closed by close() from another thread
+                break
+            if not data:
+                break
+            self._uplink._count(0, len(data), 0.0)
+            yield data
+        self._reap()
+
+    def close(self):
+        """Stop the encoder and wait for the worker, e.g. once the request was cut short."""
+        self._source.close()
+        self._process.kill()
+        self._feeder.join()
+        self._reap()
+
+    def _reap(self):
+        # close() and the end of the iteration can get here at once from two threads: only one waits
+        with self._reap_lock:
+            if self._reaped:
+                return
+            self._reaped = True
+            self._process.stdout.close()
+            cpu = 0.0
+            if hasattr(os, "wait4") and self._process.returncode is None:
+                # The encoder's own CPU time, which the parent's rusage only sees for all children at once
+                try:
+                    _, status, usage = os.wait4(self._process.pid, 0)
+                except ChildProcessError:
+                    # Already reaped by the poll of Popen.kill()
+                    self._process.wait()
+                else:
+                    self._process.returncode = os.waitstatus_to_exitcode(status)
+                    cpu = usage.ru_utime + usage.ru_stime
+            else:
+                self._process.wait()
+            self._uplink._count(self._bytes_in, 0, cpu)
+
+
+class Uplink:
+    """How the audio of every request is encoded, with totals over all of them."""
+
+    def __init__(self, encoding="linear16", rate=16000, bitrate=OPUS_BITRATE):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+        if encoding != "linear16":
+            _require_ffmpeg(encoding)
+        self.encoding = encoding
+        self.rate = rate
+        self.bitrate = bitrate
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    def recognition_encoding(self):
+        return recognition_encoding(self.encoding)
+
+    def encode(self, chunks):
+        """Iterable of the encoded bytes of one request's PCM `chunks`; `close()` it once the request ends.
+
+        Whatever the encoding, `chunks` is never read again once `close()` has returned, so the next request
+        can read the same source.
+        """
+        if self.encoding == "linear16":
+            return _Passthrough(chunks, self)
+        return EncodedStream(chunks, encoder_command(self.encoding, self.rate, self.bitrate), self)
+
+    def stats(self):
+        with self._lock:
+            return {"encoding": self.encoding, "pcm_bytes": self.bytes_in, "sent_bytes": self.bytes_out,
+                    "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+                    "encoder_cpu_s": round(self.cpu_seconds, 3)}
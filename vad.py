@@ -0,0 +1,178 @@
+"""Voice activity detection gate shared by the live transcription loops.
+
+Raw int16 audio is cut into short frames and every frame of a chunk is
+classified at once: a frame is speech when its energy is well above the
+tracked noise floor and its spectrum is not flat like background noise.
+WebRTC VAD is used instead when ``backend="webrtc"`` and the package is
+installed. Speech is forwarded with padding on both sides, so silence never
+reaches a model or the network.
+"""
+from collections import deque
+
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+VAD_BACKENDS = ("energy", "webrtc")
+
+
+class VadGate:
+    """Streaming speech gate over int16 PCM.
+
+    `process` takes any amount of audio and returns the part of it that
+    should be forwarded: speech frames, up to `padding_ms` of audio before
+    speech starts and up to `padding_ms` after it stops. The output of one
+    utterance is contiguous; `active` is False once its trailing padding has
+    been emitted.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=30, padding_ms=300, margin_db=10.0,
+                 min_energy_db=-50.0, max_flatness=0.45, backend="energy", aggressiveness=2):
+        if backend not in VAD_BACKENDS:
+            raise ValueError(f"Unknown VAD backend: {backend}")
+        if backend == "webrtc" and webrtcvad is None:
+            raise ImportError("The webrtc VAD backend needs the webrtcvad package")
+        self.sample_rate = sample_rate
+        self.frame_length = sample_rate * frame_ms // 1000
+        self.padding_frames = max(1, padding_ms // frame_ms)
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.max_flatness = max_flatness
+        self._webrtc = webrtcvad.Vad(aggressiveness) if backend == "webrtc" else None
+        self._window = np.hanning(self.frame_length).astype(np.float32)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._preroll = deque(maxlen=self.padding_frames)
+        self._hangover = 0
+        self.noise_floor_db = None
+        self.active = False
+        self.position = 0
+        self.forwarded = 0
+        self.utterances = 0
+
+    def is_speech(self, frames):
+        """Classify a (n_frames, frame_length) int16 array, one boolean per frame."""
+        if self._webrtc is not None:
+            return np.array([self._webrtc.is_speech(frame.tobytes(), self.sample_rate) for frame in frames],
+                            dtype=bool)
+
+        x = frames.astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.einsum("ij,ij->i", x, x) / self.frame_length + 1e-10)
+        power = np.abs(np.fft.rfft(x * self._window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+        speech = np.zeros(len(frames), dtype=bool)
+        for i, level in enumerate(energy_db):
+            if self.noise_floor_db is None:
+                self.noise_floor_db = level
+            threshold = max(self.min_energy_db, self.noise_floor_db + self.margin_db)
+            speech[i] = level > threshold and flatness[i] < self.max_flatness
+            if level < self.noise_floor_db:
+                self.noise_floor_db = level
+            elif not speech[i]:
+                self.noise_floor_db += 0.05 * (level - self.noise_floor_db)
+        return speech
+
+    def process_runs(self, samples):
+        """Gate an int16 array and return ``(start, samples)`` runs to forward.
+
+        `start` is the position of the run's first sample in the gated
+        stream. Consecutive runs of one utterance continue each other; a new
+        utterance starts a new run.
+        """
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        n_frames = len(samples) // self.frame_length
+        self._pending = samples[n_frames * self.frame_length:].copy()
+        frames = samples[:n_frames * self.frame_length].reshape(n_frames, self.frame_length)
+        first_index = self.position // self.frame_length
+        self.position += n_frames * self.frame_length
+
+        out = []
+        for index, (frame, speech) in enumerate(zip(frames, self.is_speech(frames)), first_index):
+            if speech:
+                if not self.active:
+                    self.active = True
+                    self.utterances += 1
+                    out.extend(self._preroll)
+                    self._preroll.clear()
+                self._hangover = self.padding_frames
+                out.append((index, frame))
+            elif self.active:
+                out.append((index, frame))
+                self._hangover -= 1
+                if self._hangover <= 0:
+                    self.active = False
+            else:
+                # The caller may reuse its buffer, so held frames are copied
+                self._preroll.append((index, frame.copy()))
+
+        runs = []
+        for index, frame in out:
+            if runs and index == runs[-1][0] + len(runs[-1][1]):
+                runs[-1][1].append(frame)
+            else:
+                runs.append([index, [frame]])
+        runs = [(index * self.frame_length, np.concatenate(frames)) for index, frames in runs]
+        self.forwarded += sum(len(run) for _, run in runs)
+        return runs
+
+    def process_samples(self, samples):
+        """Gate an int16 array and return the int16 samples to forward."""
+        runs = self.process_runs(samples)
+        if not runs:
+            return np.zeros(0, dtype=np.int16)
+        if len(runs) == 1:
+            return runs[0][1]
+        return np.concatenate([run for _, run in runs])
+
+    def process(self, raw_audio):
+        """Gate int16 PCM bytes and return the bytes to forward."""
+        return self.process_samples(np.frombuffer(raw_audio, dtype=np.int16)).tobytes()
+
+    def utterances_from(self, chunks):
+        """Split an iterator of PCM chunks into one iterator per utterance.
+
+        An utterance iterator is only returned once speech has been detected,
+        so a streaming request built from it starts with speech, and it ends
+        after the trailing padding of that utterance.
+        """
+        chunks = iter(chunks)
+        while True:
+            for chunk in chunks:
+                speech = self.process(chunk)
+                if speech:
+                    break
+            else:
+                return
+            yield self._utterance(speech, chunks)
+
+    def _utterance(self, first, chunks):
+        yield first
+        if not self.active:
+            return
+        for chunk in chunks:
+            speech = self.process(chunk)
+            if speech:
+                yield speech
+            if not self.active:
+                return
+
+    @property
+    def received(self):
+        """Samples given to the gate so far: the position of the next one in the gated stream."""
+        return self.position + len(self._pending)
+
+    @property
+    def saved_seconds(self):
+        return (self.position - self.forwarded) / self.sample_rate
+
+    def report(self):
+        """One-line summary of how much audio was kept away from inference."""
+        total = self.position / self.sample_rate
+        saved = self.saved_seconds
+        percent = 100.0 * saved / total if total else 0.0
+        return (f"VAD: {self.utterances} utterances, {total - saved:.1f} s of {total:.1f} s forwarded, "
+                f"{saved:.1f} s ({percent:.0f}%) of silence skipped")
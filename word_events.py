@@ -0,0 +1,126 @@
+"""Word-level output events: only what changed since the last hypothesis.
+
+Live engines revise the current phrase on every decode or interim result,
+and each update carries the whole phrase again: a consumer receiving every
+update of an n-word phrase word by word gets O(n²) words. A `WordDiffer`
+keeps the last hypothesis of the phrase and turns the next one into at most
+one event:
+
+- ``appended``: `words` follow the previous hypothesis, which is unchanged;
+- ``revised``: `words` replace the previous ones from `index` on (an empty
+  list when the hypothesis only got shorter);
+- ``finalized``: the phrase is final and `words` are all of its words, with
+  their final times; the next phrase starts again at index 0.
+
+Words are compared by text: times move a little between decodes and are not
+a revision on their own. `EventWriter` writes the events as JSON lines, for
+a file, a FIFO read by another process, or stdout when nothing else is
+printed there (the live loops print their transcript on it, so they take a
+file or a FIFO).
+"""
+import itertools
+import json
+import sys
+from collections import namedtuple
+
+from local_agreement import Word
+
+WordEvent = namedtuple("WordEvent", "kind phrase index words")
+
+
+def whisper_words(segments, offset=0.0):
+    """`Word`s, in seconds from `offset`, of whisper or model_server result segments transcribed with word_timestamps."""
+    return [Word(offset + word["start"], offset + word["end"], word["word"].strip())
+            for segment in segments for word in segment.get("words") or ()]
+
+
+def segment_words(segment, offset=0.0):
+    """`Word`s, in seconds from `offset`, of a faster-whisper segment transcribed with word_timestamps."""
+    return [Word(offset + word.start, offset + word.end, word.word.strip()) for word in segment.words or ()]
+
+
+def text_words(text, start=None, end=None):
+    """`Word`s of a hypothesis without word times (Google interim results)."""
+    return [Word(start, end, word) for word in text.split()]
+
+
+def _common_prefix(previous, current):
+    count = 0
+    for old, new in zip(previous, current):
+        if old.text != new.text:
+            break
+        count += 1
+    return count
+
+
+class WordDiffer:
+    """Hypotheses of successive phrases in, `WordEvent`s out.
+
+    Differs writing to the same consumer can share their `phrases` counter
+    (an `itertools.count`), so that their phrase numbers never collide.
+    """
+
+    def __init__(self, phrases=None):
+        self._phrases = itertools.count() if phrases is None else phrases
+        self.phrase = next(self._phrases)
+        self.words = []  # last hypothesis of the current phrase
+        self.updates = 0
+        self.words_sent = 0
+        self.words_updated = 0  # words a consumer would have received with every full hypothesis
+
+    def _event(self, kind, index, words):
+        self.words_sent += len(words)
+        return WordEvent(kind, self.phrase, index, list(words))
+
+    def update(self, words):
+        """Events for a new hypothesis of the current phrase: none if its text did not change."""
+        self.updates += 1
+        self.words_updated += len(words)
+        words = [word for word in words if word.text]
+        previous, self.words = self.words, words
+        common = _common_prefix(previous, words)
+        if common == len(previous):
+            return [self._event("appended", common, words[common:])] if len(words) > common else []
+        return [self._event("revised", common, words[common:])]
+
+    def finalize(self, words=None):
+        """Events ending the current phrase, with its final `words` (default: the last hypothesis)."""
+        if words is not None:
+            self.words = [word for word in words if word.text]
+            self.updates += 1
+            self.words_updated += len(self.words)
+        if not self.words:
+            return []
+        event = self._event("finalized", 0, self.words)
+        self.phrase = next(self._phrases)
+        self.words = []
+        return [event]
+
+    def report(self):
+        return {"updates": self.updates, "words_sent": self.words_sent, "words_in_updates": self.words_updated}
+
+
+def event_dict(event):
+    words = [{"text": word.text} if word.start is None else
+             {"text": word.text, "start": round(word.start, 3), "end": round(word.end, 3)} for word in event.words]
+    return {"event": event.kind, "phrase": event.phrase, "index": event.index, "words": words}
+
+
+class EventWriter:
+    """Word events as JSON lines, flushed as they are written ("-" writes to stdout)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def write(self, events, **fields):
+        """Write `events`, each with the extra `fields` (e.g. the channel it was heard on)."""
+        if not events:
+            return
+        self._file.write("".join(json.dumps(dict(event_dict(event), **fields), ensure_ascii=False) + "\n"
+                                 for event in events))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()